@@ -1,9 +1,6 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import time
 
 st.subheader("Home 🏠​")
 st.sidebar.markdown("# Home🏠​")
 
-st.write("Welcome to the Home Page of the Video Tool App")
\ No newline at end of file
+st.write("Welcome to the Home Page of the Video Tool App")
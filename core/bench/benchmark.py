@@ -0,0 +1,254 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.fix.atom_scanner import scan_mp4
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ==================== 测试素材 ====================
+# (名称, 视频编码, 音频编码, 容器, 分辨率, 时长秒)
+QUICK_MATRIX = [
+    ("h264_aac_360p_5s", "libx264", "aac", "mp4", "640x360", 5),
+    ("mpeg4_mp3_360p_5s", "mpeg4", "libmp3lame", "mkv", "640x360", 5),
+    ("h264_aac_360p_5s", "libx264", "aac", "flv", "640x360", 5),
+]
+FULL_MATRIX = QUICK_MATRIX + [
+    ("h264_aac_720p_30s", "libx264", "aac", "mp4", "1280x720", 30),
+    ("mpeg4_aac_720p_30s", "mpeg4", "aac", "mkv", "1280x720", 30),
+    ("h264_aac_720p_30s", "libx264", "aac", "flv", "1280x720", 30),
+    ("mpeg4_aac_1080p_60s", "mpeg4", "aac", "mp4", "1920x1080", 60),
+]
+
+# 不同素材要测的操作
+NORMAL_OPS = ["remux", "pr_encode", "mp3_extract", "detect", "detect_deep"]
+BROKEN_OPS = ["detect", "fix"]
+
+def lavfi_command(vcodec, acodec, size, duration, output_path, faststart=True):
+    """用lavfi测试源生成可复现的素材（bitexact去掉版本相关的元数据）"""
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", vcodec, "-c:a", acodec,
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        "-map_metadata", "-1", "-shortest",
+    ]
+    if vcodec == "libx264":
+        cmd += ["-threads", "1"]  # 单线程编码结果才可复现
+    if faststart and output_path.suffix == ".mp4":
+        cmd += ["-movflags", "+faststart"]
+    return cmd + [str(output_path)]
+
+def generate_inputs(workdir, full=False):
+    """生成测试素材（已存在则复用），返回 [(素材名, 路径, 操作列表)]"""
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    cases = []
+    for name, vcodec, acodec, container, size, duration in (FULL_MATRIX if full else QUICK_MATRIX):
+        path = workdir / f"{name}.{container}"
+        if not path.exists():
+            subprocess.run(lavfi_command(vcodec, acodec, size, duration, path), check=True)
+        cases.append((path.name, path, NORMAL_OPS))
+
+        if container != "mp4":
+            continue
+
+        # moov 在文件末尾的MP4，以及截掉 moov 的“录制中断”文件
+        tail_moov = workdir / f"{name}_tailmoov.mp4"
+        if not tail_moov.exists():
+            subprocess.run(lavfi_command(vcodec, acodec, size, duration, tail_moov, faststart=False), check=True)
+        cases.append((tail_moov.name, tail_moov, BROKEN_OPS))
+
+        moovless = workdir / f"{name}_moovless.mp4"
+        if not moovless.exists():
+            boxes = scan_mp4(tail_moov)['boxes']
+            moov_offset = next(offset for box_type, offset, _ in boxes if box_type == 'moov')
+            with open(tail_moov, 'rb') as src, open(moovless, 'wb') as dst:
+                dst.write(src.read(moov_offset))
+        cases.append((moovless.name, moovless, BROKEN_OPS))
+    return cases
+
+# ==================== 被测操作 ====================
+def read_proc_io():
+    """/proc/self/io 在子进程被回收时会累加其I/O，可覆盖ffmpeg子进程"""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def run_operation(op, input_path, output_dir):
+    """在独立进程中执行一次操作，保证峰值RSS与I/O统计只属于这一次"""
+    # 使用空的缓存目录，测量的是未命中缓存时的耗时；ffmpeg能力缓存由 main 预先探测并共用
+    os.environ["VIDEOTOOL_CACHE_DIR"] = tempfile.mkdtemp(prefix="videotool_bench_cache_")
+    converter_module = importlib.import_module("core.convert.flv-to-mp4")
+    from core.extract.mp3_extract import build_extract_command
+    from core.fix.detect import run_detection
+    from core.fix.faststart import fix_moov
+    from core.process.async_runner import run, ENCODE
+    from core.process.ffmpeg_capabilities import capabilities
+
+    capabilities()  # 在计时前读入，能力探测不计入任何操作的耗时
+
+    input_path = str(input_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(input_path).stem + "_" + Path(input_path).suffix.lstrip('.')
+
+    read_before, written_before = read_proc_io()
+    start = time.perf_counter()
+    ok, error = True, ''
+    try:
+        if op in ("remux", "pr_encode"):
+            config = {'pr_compat_mode': op == "pr_encode", 'preset': 'medium', 'audio_bitrate': '192k'}
+            converter = converter_module.VideoConverter(config)
+            output_path = str(output_dir / f"{stem}_{op}.mp4")
+            if not converter.try_native_faststart(input_path, output_path):
+                cmd = converter.build_command(input_path, output_path)
+                run(cmd, kind=converter.process_kind(cmd))
+        elif op == "mp3_extract":
+            run(build_extract_command(input_path, output_dir / f"{stem}.mp3", '320k'), kind=ENCODE)
+        elif op in ("detect", "detect_deep"):
+            run_detection(input_path, deep_scan=op == "detect_deep")
+        elif op == "fix":
+            fix_moov(input_path, output_dir / f"fixed_{stem}.mp4")
+        else:
+            raise ValueError(f"未知操作: {op}")
+    except Exception as e:
+        ok, error = False, str(e)[-500:]
+    wall = time.perf_counter() - start
+    read_after, written_after = read_proc_io()
+
+    peak_rss_kb = python_rss_kb = None
+    if resource is not None:
+        scale = 1024 if sys.platform == 'darwin' else 1  # macOS 单位为字节
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+        python_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    return {
+        'ok': ok,
+        'error': error,
+        'wall_sec': wall,
+        'peak_rss_kb': peak_rss_kb,      # ffmpeg/ffprobe 子进程峰值
+        'python_rss_kb': python_rss_kb,  # 原生实现（结构扫描、faststart等）所在的Python进程峰值
+        'bytes_read': read_after - read_before if read_before is not None else None,
+        'bytes_written': written_after - written_before if written_before is not None else None,
+    }
+
+def measure(op, input_path, output_dir, repeat):
+    """每次都用全新的进程执行，取耗时中位数"""
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            runs.append(pool.submit(run_operation, op, input_path, output_dir).result())
+    best = dict(runs[-1])
+    best['wall_sec'] = round(statistics.median(r['wall_sec'] for r in runs), 4)
+    best['ok'] = all(r['ok'] for r in runs)
+    return best
+
+# ==================== 基线对比 ====================
+def compare(results, baseline, threshold, min_delta):
+    """对比基线，耗时或峰值内存超过阈值（且绝对差值足够大）的记为退化"""
+    baseline_map = {(r['case'], r['op']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        base = baseline_map.get((r['case'], r['op']))
+        if base is None or not (r['ok'] and base['ok']):
+            continue
+        checks = [('wall_sec', min_delta), ('peak_rss_kb', 1024), ('python_rss_kb', 1024)]
+        for metric, floor in checks:
+            old, new = base.get(metric), r.get(metric)
+            if old and new and new > old * (1 + threshold) and new - old > floor:
+                regressions.append({
+                    'case': r['case'], 'op': r['op'], 'metric': metric,
+                    'baseline': old, 'current': new, 'ratio': round(new / old, 3),
+                })
+    return regressions
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+        return result.stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+# ==================== 命令行入口 ====================
+def main():
+    parser = argparse.ArgumentParser(description="视频工具性能基准测试")
+    parser.add_argument("--workdir", default="bench_media", help="测试素材与输出目录")
+    parser.add_argument("--out", default="bench_results.json", help="结果JSON路径")
+    parser.add_argument("--full", action="store_true", help="使用完整素材矩阵（更多分辨率和时长）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个操作重复次数（取中位数）")
+    parser.add_argument("--ops", help="只运行指定操作，逗号分隔")
+    parser.add_argument("--baseline", help="基线结果JSON，用于检测性能退化")
+    parser.add_argument("--threshold", type=float, default=0.10, help="退化阈值（相对比例）")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="耗时退化的最小绝对差值(秒)")
+    args = parser.parse_args()
+
+    selected = set(args.ops.split(',')) if args.ops else None
+    # 能力只探测一次，写到工作目录中供每个操作进程读取
+    os.environ["VIDEOTOOL_CAPABILITIES_PATH"] = str(Path(args.workdir).resolve() / "ffmpeg_capabilities.json")
+    from core.process.ffmpeg_capabilities import capabilities
+    capabilities()
+
+    print("正在生成测试素材...")
+    cases = generate_inputs(args.workdir, args.full)
+    output_dir = Path(args.workdir) / "outputs"
+
+    results = []
+    for case, path, ops in cases:
+        for op in ops:
+            if selected and op not in selected:
+                continue
+            result = measure(op, path, output_dir, args.repeat)
+            result.update({'case': case, 'op': op, 'input_size': path.stat().st_size})
+            results.append(result)
+            status = "ok" if result['ok'] else "failed"
+            print(f"[{status}] {case:<32} {op:<12} {result['wall_sec']:.3f}s  "
+                  f"ffmpeg RSS {result['peak_rss_kb']} KB  python RSS {result['python_rss_kb']} KB")
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'ffmpeg': ffmpeg_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        report['regressions'] = compare(results, baseline, args.threshold, args.min_delta)
+        for r in report['regressions']:
+            print(f"⚠️ 退化: {r['case']} {r['op']} {r['metric']} {r['baseline']} -> {r['current']} ({r['ratio']}x)")
+        if report['regressions']:
+            exit_code = 1
+        else:
+            print("未发现性能退化")
+
+    Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"结果已写入 {args.out}")
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+CACHE_ROOT = Path(os.environ.get("VIDEOTOOL_CACHE_DIR", Path.home() / ".cache" / "videotool"))
+
+SAMPLE_SIZE = 256 * 1024  # 每个采样块大小
+SAMPLE_COUNT = 5          # 头、尾及中间均匀分布的采样块数量
+FULL_HASH_CHUNK = 8 * 1024 * 1024
+
+_hash_memo = {}
+_full_hash_memo = {}
+_hash_lock = threading.Lock()
+
+# ==================== 内容哈希 ====================
+def content_hash(path):
+    """快速内容哈希：文件大小 + 若干均匀分布的采样块
+
+    只读取 SAMPLE_COUNT * SAMPLE_SIZE 字节，与文件大小无关。
+    同一进程内按 (路径, 大小, mtime) 记忆，避免重复读取。
+    """
+    path = str(path)
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    size = stat.st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            digest.update(f.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for i in range(SAMPLE_COUNT):
+                f.seek(i * step)
+                digest.update(f.read(SAMPLE_SIZE))
+
+    value = digest.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = value
+    return value
+
+def hash_sidecar(path):
+    """与暂存文件放在一起的完整哈希记录"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.blake2b")
+
+def write_full_hash(path, value):
+    """记录完整内容哈希（暂存上传时已在内存中算出），附带大小与mtime用于校验"""
+    stat = os.stat(path)
+    hash_sidecar(path).write_text(
+        json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': value}), encoding='utf-8'
+    )
+    with _hash_lock:
+        _full_hash_memo[(str(path), stat.st_size, stat.st_mtime_ns)] = value
+
+def full_hash(path):
+    """完整内容哈希：结果缓存的键必须覆盖文件的每个字节，采样哈希相同的不同文件不能共用结果
+
+    优先读取暂存时写入的记录；没有记录（如监视目录中的原文件）时完整读取一次，同一进程内记忆。
+    """
+    path = str(path)
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _full_hash_memo:
+            return _full_hash_memo[memo_key]
+
+    value = None
+    try:
+        record = json.loads(hash_sidecar(path).read_text(encoding='utf-8'))
+        if (record['size'], record['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            value = record['hash']
+    except (OSError, ValueError, KeyError):
+        pass
+    if value is None:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            while chunk := f.read(FULL_HASH_CHUNK):
+                digest.update(chunk)
+        value = digest.hexdigest()
+
+    with _hash_lock:
+        _full_hash_memo[memo_key] = value
+    return value
+
+# ==================== 磁盘缓存 ====================
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except OSError:  # 可能已被其他进程淘汰
+        return 0
+
+class MediaInfoCache:
+    """以内容哈希为键的本地磁盘缓存，按访问时间做LRU淘汰
+
+    每个条目是一个JSON文件，读取时更新mtime作为最近访问时间。
+    """
+
+    def __init__(self, cache_dir=CACHE_ROOT / "media_info", max_entries=512):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.listeners = []  # 每次查询以 (是否命中) 回调，用于统计命中率
+
+    def make_key(self, path, params):
+        """内容哈希 + 参数摘要（如完整的ffprobe参数列表）"""
+        params_digest = hashlib.blake2b(
+            json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'), digest_size=8
+        ).hexdigest()
+        return f"{content_hash(path)}-{params_digest}"
+
+    def get(self, key):
+        entry = self.cache_dir / f"{key}.json"
+        try:
+            value = json.loads(entry.read_text(encoding='utf-8'))
+            os.utime(entry)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = self.cache_dir / f"{key}.json"
+        tmp = entry.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(value, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, entry)  # 原子替换，避免并发读到半个文件
+        self.evict()
+
+    def evict(self):
+        """超出容量时删除最久未访问的条目"""
+        with self._lock:
+            entries = list(self.cache_dir.glob("*.json"))
+            overflow = len(entries) - self.max_entries
+            if overflow <= 0:
+                return
+            entries.sort(key=_mtime)
+            for entry in entries[:overflow]:
+                entry.unlink(missing_ok=True)
+
+    def get_or_compute(self, path, params, compute):
+        """命中则直接返回缓存值，否则调用 compute() 并写入缓存
+
+        compute 抛出的异常不会被缓存。
+        """
+        key = self.make_key(path, params)
+        value = self.get(key)
+        for listener in self.listeners:
+            listener(value is not None)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+media_cache = MediaInfoCache()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+
+from core.cache.media_cache import CACHE_ROOT, full_hash
+
+RESULT_ROOT = CACHE_ROOT / "results"
+MAX_BYTES = int(os.environ.get("VIDEOTOOL_RESULT_CACHE_BYTES", 20 * 1024 ** 3))
+
+# 影响转换输出内容的配置项（进度刷新间隔等界面参数不参与缓存键）
+CONVERT_KEYS = ('pr_compat_mode', 'audio_bitrate', 'preset', 'force_audio', 'hw_encode')
+
+_lock = threading.Lock()
+
+# ==================== 缓存键 ====================
+def normalize_params(kind, params):
+    """提取决定输出内容的参数"""
+    if kind == 'convert':
+        if not params['config'].get('pr_compat_mode'):
+            return {'pr_compat_mode': False}  # 快速模式只做无损封装，其他编码参数不影响输出
+        return {key: params['config'].get(key) for key in CONVERT_KEYS}
+    if kind == 'extract':
+        if params.get('audio_filter'):
+            return {'bitrate': params['bitrate'], 'audio_filter': params['audio_filter']}
+        return {'bitrate': params['bitrate']}
+    if kind == 'fix':
+        if params.get('fix_type') == 'ranges':
+            return {'fix_type': 'ranges', 'ranges': params['ranges']}
+        if params.get('fix_type') == 'timestamps':
+            return {'fix_type': 'timestamps', 'repair': params['repair']}
+        return {'fix_type': params.get('fix_type', 'moov')}
+    if kind == 'trim':
+        return dict({key: params['config'].get(key) for key in CONVERT_KEYS},
+                    start=params['start'], end=params.get('end'))
+    if kind == 'split':
+        return {'max_seconds': params.get('max_seconds'), 'max_bytes': params.get('max_bytes')}
+    if kind == 'rebuild':
+        # 重建结果取决于参考文件内容
+        return {'reference': full_hash(params['reference_path']), 'video_only': bool(params.get('video_only'))}
+    return dict(params)
+
+def cache_key(kind, params):
+    """输入文件的完整内容哈希 + 参数摘要"""
+    normalized = json.dumps([kind, normalize_params(kind, params)], sort_keys=True, ensure_ascii=False)
+    params_digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+    return f"{full_hash(params['input_path'])}-{params_digest}"
+
+def output_equivalents(params):
+    """多输出任务中每个输出对应的单输出任务 (kind, params)，与单独提交的任务共享缓存"""
+    for output in params['outputs']:
+        single = {'input_path': params['input_path'], 'output_path': output['output_path']}
+        if params.get('shared_output'):
+            single['shared_output'] = True
+        if output['format'] == 'mp3':
+            yield 'extract', dict(single, bitrate=output['bitrate'], audio_filter=output.get('audio_filter'))
+        else:
+            yield 'convert', dict(single, config=output['config'])
+
+def link_or_copy(src, dst, link=True):
+    """同一文件系统上硬链接（零拷贝），否则复制；link=False 时总是复制"""
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+def shares_inode(params):
+    """输出是否可以与缓存产物共用inode：监视目录等工作区之外的输出可能被用户原地改写，总是复制"""
+    return not params.get('shared_output')
+
+def remove_tree(path):
+    """删除缓存条目；只读产物在Windows上需要先恢复写权限才能删除"""
+    def retry_writable(func, target, _):
+        os.chmod(target, stat.S_IWRITE)
+        func(target)
+
+    try:
+        shutil.rmtree(path, onerror=retry_writable)
+    except OSError:
+        pass
+
+# ==================== 查询与写入 ====================
+def read_entry(kind, params):
+    """读取缓存条目，返回 (条目目录, meta)；不存在或损坏时返回 None"""
+    entry = RESULT_ROOT / cache_key(kind, params)
+    try:
+        meta = json.loads((entry / "meta.json").read_text(encoding='utf-8'))
+        if not (entry / meta['artifact']).is_file():
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return entry, meta
+
+def lookup(kind, params):
+    """命中时把缓存产物放到 params['output_path'] 并返回当时记录的结果，否则返回 None"""
+    if kind == 'multi':
+        return lookup_multi(params)
+
+    found = read_entry(kind, params)
+    if found is None:
+        return None
+    entry, meta = found
+    output_path = Path(params['output_path'])
+    try:
+        output_path.unlink(missing_ok=True)
+        link_or_copy(entry / meta['artifact'], output_path, shares_inode(params))
+        os.utime(entry / "meta.json")  # 记录最近访问时间
+    except OSError:
+        return None
+
+    result = dict(meta['result'])
+    result['output_path'] = str(output_path)
+    result['cache_hit'] = True
+    return result
+
+def lookup_multi(params):
+    """所有输出都已缓存时才算命中；先检查再链接，部分命中时ffmpeg不会写到只读的硬链接上"""
+    equivalents = list(output_equivalents(params))
+    if any(read_entry(kind, single) is None for kind, single in equivalents):
+        return None
+
+    outputs = [lookup(kind, single) for kind, single in equivalents]
+    if any(output is None for output in outputs):
+        return None
+    return {
+        'outputs': outputs,
+        'summary': f"全部 {len(outputs)} 个输出均已缓存",
+        'cache_hit': True,
+    }
+
+def store(kind, params, result):
+    """任务成功后把输出文件存入缓存；多输出任务按输出分别存储"""
+    if kind == 'split':
+        return  # 分段数量不定，且只做流复制，不缓存
+    if kind == 'multi':
+        for (single_kind, single), output in zip(output_equivalents(params), result['outputs']):
+            if not output.get('cache_hit'):
+                store(single_kind, single, output)
+        return
+
+    entry = RESULT_ROOT / cache_key(kind, params)
+    artifact_name = Path(result['output_path']).name
+    tmp_entry = entry.with_name(entry.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+    remove_tree(tmp_entry)
+    link_or_copy(result['output_path'], tmp_entry / artifact_name, shares_inode(params))
+    # 产物与任务输出、已发布的下载可能是同一inode：设为只读，之后原地截断改写会失败，而不是悄悄损坏缓存
+    os.chmod(tmp_entry / artifact_name, 0o444)
+    meta = {'artifact': artifact_name, 'result': {k: v for k, v in result.items() if k != 'output_path'}}
+    (tmp_entry / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+
+    with _lock:
+        remove_tree(entry)
+        try:
+            os.replace(tmp_entry, entry)
+        except OSError:  # 其他进程刚写入同一条目
+            remove_tree(tmp_entry)
+    evict()
+
+def evict(max_bytes=MAX_BYTES):
+    """总大小超过上限时按最近访问时间淘汰"""
+    with _lock:
+        entries = []
+        for entry in RESULT_ROOT.glob("*"):
+            meta_path = entry / "meta.json"
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((meta_path.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= max_bytes:
+                break
+            remove_tree(entry)
+            total -= size
@@ -0,0 +1,202 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+converter_module = importlib.import_module("core.convert.flv-to-mp4")
+VideoConverter = converter_module.VideoConverter
+from core.process.async_runner import run
+from core.jobs.cost_model import estimate, format_eta
+
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.flv'}
+
+# ==================== 并发规划 ====================
+def plan_workers(cpu_count=None):
+    """根据CPU核数规划并发数与每个ffmpeg的线程数
+
+    remux只做流拷贝，几乎不占CPU，按核数密集排布；
+    libx264编码本身多线程，限制并发数使 并发数*线程数 ≈ 核数。
+    """
+    cores = cpu_count or os.cpu_count() or 1
+    encode_workers = max(1, cores // 4)
+    return {
+        'remux': {'workers': max(1, min(cores * 2, 16)), 'threads': 1},
+        'encode': {'workers': encode_workers, 'threads': max(1, cores // encode_workers)},
+    }
+
+def classify_job(cmd):
+    """判断命令是纯封装(remux)还是需要编码(encode)"""
+    return 'encode' if converter_module.encodes_video(cmd) else 'remux'
+
+def with_threads(cmd, threads):
+    """在输出路径前插入 -threads 参数"""
+    return cmd[:-1] + ["-threads", str(threads), cmd[-1]]
+
+# ==================== 任务收集 ====================
+def collect_jobs(source, output_dir, pr_compat_mode):
+    """从目录或清单文件收集 (输入, 输出) 任务列表
+
+    清单支持 .json（字符串或 {"input": ..., "output": ...} 的列表）
+    以及每行一个路径的纯文本文件。
+    """
+    source = Path(source)
+    suffix = "_PR.mp4" if pr_compat_mode else ".mp4"
+
+    if source.is_dir():
+        entries = [{'input': str(p)} for p in sorted(source.iterdir())
+                   if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS]
+    elif source.suffix.lower() == '.json':
+        entries = [e if isinstance(e, dict) else {'input': e}
+                   for e in json.loads(source.read_text(encoding='utf-8'))]
+    else:
+        lines = source.read_text(encoding='utf-8').splitlines()
+        entries = [{'input': line.strip()} for line in lines
+                   if line.strip() and not line.lstrip().startswith('#')]
+
+    jobs = []
+    for entry in entries:
+        input_path = Path(entry['input'])
+        output_path = entry.get('output') or Path(output_dir or input_path.parent) / (input_path.stem + suffix)
+        jobs.append((str(input_path), str(output_path)))
+    return jobs
+
+# ==================== 任务执行 ====================
+def run_job(cmd, input_path, output_path, kind, converter=None):
+    """执行单个任务并返回结果摘要
+
+    传入 converter 时先尝试原生faststart重定位，成功则跳过ffmpeg。
+    """
+    start = time.monotonic()
+    if converter is not None and converter.try_native_faststart(input_path, output_path):
+        kind, returncode, stderr = 'faststart', 0, ''
+    else:
+        result = run(cmd, kind=kind, check=False)  # kind 与运行器的进程类别同名
+        returncode = result.returncode
+        stderr = result.text('stderr')
+    elapsed = time.monotonic() - start
+
+    return {
+        'input': input_path,
+        'output': output_path,
+        'kind': kind,
+        'status': 'ok' if returncode == 0 else 'failed',
+        'returncode': returncode,
+        'elapsed_sec': round(elapsed, 2),
+        'input_size': os.path.getsize(input_path),
+        'output_size': os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+        'error': stderr[-2000:] if returncode != 0 else '',
+    }
+
+def prefetch_media_info(converter, input_path):
+    """预取失败时忽略，构建命令时会再次报告错误"""
+    try:
+        converter.get_media_info(converter.safe_path(input_path))
+    except Exception:
+        pass
+
+def job_cost(input_path, output_path, config):
+    try:
+        return estimate('convert', {'input_path': input_path, 'output_path': output_path, 'config': config})['seconds']
+    except Exception:
+        return float('inf')  # 无法估算的排在最后，构建命令时再报告错误
+
+def order_shortest_first(jobs, config):
+    costs = {job: job_cost(*job, config) for job in jobs}
+    total = sum(c for c in costs.values() if c != float('inf'))
+    print(f"预计总耗时 {format_eta(total)}（按CPU并发执行会更短）")
+    return sorted(jobs, key=costs.get)
+
+def run_batch(jobs, config, cpu_count=None):
+    """并行执行批量转换，remux与编码任务分别进入各自的线程池"""
+    converter = VideoConverter(config)
+    plan = plan_workers(cpu_count)
+    pools = {kind: ThreadPoolExecutor(max_workers=p['workers']) for kind, p in plan.items()}
+
+    # 并发预取媒体信息（受运行器的探测并发上限约束），构建命令时直接命中缓存
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda job: prefetch_media_info(converter, job[0]), jobs))
+
+    # 短作业优先：所有任务一开始就已知，不会有饥饿问题，直接按预计耗时排序即可降低平均完成时间
+    jobs = order_shortest_first(jobs, config)
+
+    results = []
+    futures = {}
+    try:
+        for input_path, output_path in jobs:
+            try:
+                Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+                cmd = converter.build_command(converter.safe_path(input_path), converter.safe_path(output_path))
+            except Exception as e:
+                results.append({'input': input_path, 'output': output_path, 'kind': None,
+                                'status': 'failed', 'returncode': None, 'error': f"构建命令失败: {e}"})
+                continue
+
+            kind = classify_job(cmd)
+            cmd = with_threads(cmd, plan[kind]['threads'])
+            future = pools[kind].submit(run_job, cmd, input_path, output_path, kind,
+                                        converter if kind == 'remux' else None)
+            futures[future] = input_path
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{result['status']}] {result['kind']} {Path(result['input']).name} "
+                  f"({result['elapsed_sec']}s)")
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    return results
+
+def write_summary(results, summary_path):
+    """写入每个文件的转换结果摘要"""
+    summary = {
+        'total': len(results),
+        'succeeded': sum(r['status'] == 'ok' for r in results),
+        'failed': sum(r['status'] != 'ok' for r in results),
+        'results': sorted(results, key=lambda r: r['input']),
+    }
+    Path(summary_path).write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+    return summary
+
+# ==================== 命令行入口 ====================
+def main():
+    parser = argparse.ArgumentParser(description="无界面批量视频转换")
+    parser.add_argument("source", help="输入目录或清单文件(.json/.txt)")
+    parser.add_argument("-o", "--output-dir", help="输出目录（默认与输入文件同目录）")
+    parser.add_argument("--fast", action="store_true", help="仅封装转换（关闭PR兼容模式）")
+    parser.add_argument("--preset", default="medium", help="libx264编码预设")
+    parser.add_argument("--audio-bitrate", default="320k", help="音频比特率")
+    parser.add_argument("--force-audio", action="store_true", help="强制重新编码音频")
+    parser.add_argument("--hw-encode", action="store_true", help="优先使用本机可用的硬件H.264编码器")
+    parser.add_argument("--cpus", type=int, help="可用CPU核数（默认自动检测）")
+    parser.add_argument("--summary", default="batch_summary.json", help="结果摘要输出路径")
+    args = parser.parse_args()
+
+    config = {
+        'pr_compat_mode': not args.fast,
+        'audio_bitrate': args.audio_bitrate,
+        'preset': args.preset,
+        'force_audio': args.force_audio,
+        'hw_encode': args.hw_encode,
+    }
+
+    jobs = collect_jobs(args.source, args.output_dir, config['pr_compat_mode'])
+    if not jobs:
+        print(f"错误：未找到可转换的文件 - {args.source}")
+        return 1
+
+    print(f"共 {len(jobs)} 个文件，开始批量转换^_^~")
+    results = run_batch(jobs, config, args.cpus)
+    summary = write_summary(results, args.summary)
+    print(f"完成：成功 {summary['succeeded']} 个，失败 {summary['failed']} 个，摘要已写入 {args.summary}")
+    return 0 if summary['failed'] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,88 @@
 import streamlit as st
-import subprocess
 import os
+import sys
 import json
 from pathlib import Path
-import tempfile
+import time
+from collections import deque
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.cache.media_cache import media_cache
+from core.process.async_runner import run, stream, ENCODE, REMUX
+from core.telemetry import job_metrics
+from core.process.ffmpeg_capabilities import (
+    AAC_ENCODERS, H264_ENCODERS, hwaccel_args, pick_encoder, require_muxer
+)
+from core.staging.upload_staging import stage_upload, new_output_path
+from core.jobs.job_panel import submit_job, job_panel
+from core.jobs.cost_model import estimate, format_eta
+from core.preview.media_preview import preview_panel
+from core.fix.faststart import relocate_moov, FaststartUnsupported
+from core.convert.segmented_encode import segmented_encode, single_process_encode
+from core.convert.smart_cut import parse_timecode, parse_size
+
+# ==================== 进度解析 ====================
+class ProgressTracker:
+    """解析ffmpeg -progress 输出的 key=value 行"""
+    KEYS = {'frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms',
+            'out_time', 'dup_frames', 'drop_frames', 'speed', 'progress'}
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.values = {}
+
+    def feed(self, line):
+        """处理一行输出，是进度行则返回True"""
+        key, sep, value = line.strip().partition('=')
+        if not sep or key not in self.KEYS:
+            return False
+        self.values[key] = value.strip()
+        return True
+
+    @property
+    def out_time(self):
+        # out_time_ms 实际单位也是微秒（ffmpeg历史遗留）
+        raw = self.values.get('out_time_us') or self.values.get('out_time_ms')
+        try:
+            return max(int(raw), 0) / 1_000_000
+        except (TypeError, ValueError):
+            return 0.0
+
+    @property
+    def speed(self):
+        try:
+            return float(self.values.get('speed', '').rstrip('x'))
+        except ValueError:
+            return 0.0
+
+    @property
+    def finished(self):
+        return self.values.get('progress') == 'end'
+
+    @property
+    def percent(self):
+        if self.finished:
+            return 100.0
+        if not self.duration:
+            return 0.0
+        return min(self.out_time / self.duration * 100, 100.0)
+
+    @property
+    def eta(self):
+        """剩余秒数，未知时返回None"""
+        if not self.duration or self.speed <= 0:
+            return None
+        return max(self.duration - self.out_time, 0) / self.speed
+
+    def summary(self):
+        eta = self.eta
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        return (f"{self.percent:.1f}% | fps: {self.values.get('fps', '0')} | "
+                f"速度: {self.values.get('speed', 'N/A')} | 剩余: {eta_text}")
+
+def encodes_video(cmd):
+    """命令中是否有视频编码器（-c:v 的值不是 copy）"""
+    return any(arg in ("-c:v", "-vcodec") and value != "copy" for arg, value in zip(cmd, cmd[1:]))
 
 # ==================== 核心转换类 ====================
 class VideoConverter:
@@ -11,6 +90,7 @@ class VideoConverter:
         self.config = config
         self.system_encoding = 'gbk' if os.name == 'nt' else 'utf-8'
         self.force_encoding = 'utf-8'
+        self.duration = 0.0
         
     def safe_path(self, path):
         """处理特殊字符路径"""
@@ -23,33 +103,51 @@ class VideoConverter:
             "-v", "quiet",
             "-print_format", "json",
             "-show_streams",
+            "-show_format",
             input_path
         ]
         
-        result = subprocess.run(cmd, capture_output=True, check=True)
-        return json.loads(result.stdout)
+        def probe():
+            return json.loads(run(cmd).stdout)
+
+        return media_cache.get_or_compute(input_path, cmd[:-1], probe)
+
+    def get_duration(self, media_info):
+        """从媒体信息中取时长（秒），取不到时返回0"""
+        candidates = [media_info.get('format', {}).get('duration')]
+        candidates += [s.get('duration') for s in media_info.get('streams', [])]
+        for value in candidates:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+        return 0.0
 
     def build_command(self, input_path, output_path):
         """构建FFmpeg命令"""
         media_info = self.get_media_info(input_path)
+        self.duration = self.get_duration(media_info)
+        require_muxer('mp4')  # 缺少封装器时在启动ffmpeg前报错
         
         if self.config['pr_compat_mode']:
             return self._build_pr_command(input_path, output_path, media_info)
         else:
             return self._build_fast_command(input_path, output_path)
 
-    def _build_pr_command(self, input_path, output_path, media_info):
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-hwaccel", "auto",
-            "-i", input_path
-        ]
-
-        # 视频处理
+    def needs_video_encode(self, media_info):
+        """PR兼容模式下视频流是否需要重新编码"""
         video_stream = next(s for s in media_info['streams'] if s['codec_type'] == 'video')
-        if video_stream['codec_name'] != 'h264':
-            cmd += [
+        return video_stream['codec_name'] != 'h264'
+
+    def video_encoder(self):
+        """启用硬件编码时优先选择本机可用的硬件H.264编码器，否则使用libx264"""
+        return pick_encoder(H264_ENCODERS, "H.264", allow_hardware=self.config.get('hw_encode', False))
+
+    def _pr_video_args(self):
+        """PR兼容的H.264编码参数（High profile / 4.2 / yuv420p）"""
+        encoder = self.video_encoder()
+        if encoder == "libx264":
+            return [
                 "-c:v", "libx264",
                 "-preset", self.config.get('preset', 'medium'),
                 "-profile:v", "high",
@@ -59,26 +157,55 @@ class VideoConverter:
                 "-g", "60",
                 "-x264-params", "nal-hrd=cbr"
             ]
+
+        # 硬件编码器不支持x264专有参数，只保留PR兼容所需的部分
+        args = ["-c:v", encoder, "-profile:v", "high", "-g", "60", "-movflags", "+faststart"]
+        if encoder == "h264_qsv":
+            args += ["-pix_fmt", "nv12", "-level", "4.2"]
+        elif encoder == "h264_nvenc":
+            args += ["-pix_fmt", "yuv420p", "-level", "4.2", "-preset", "p4"]
         else:
-            cmd += ["-c:v", "copy"]
+            args += ["-pix_fmt", "yuv420p"]
+        return args
 
-        # 音频处理
-        audio_stream = next(s for s in media_info['streams'] if s['codec_type'] == 'audio')
+    def _pr_audio_args(self, audio_stream):
+        """PR兼容的音频参数，AAC源默认直接复制"""
         if audio_stream['codec_name'] != 'aac' or self.config.get('force_audio'):
-            cmd += [
-                "-c:a", "aac",
+            return [
+                "-c:a", pick_encoder(AAC_ENCODERS, "AAC"),
                 "-b:a", self.config.get('audio_bitrate', '192k')
             ]
+        return ["-c:a", "copy"]
+
+    def output_args(self, media_info):
+        """单个MP4输出的编码/复制参数（不含输入与输出路径），多输出任务复用"""
+        if not self.config['pr_compat_mode']:
+            return ["-c", "copy", "-movflags", "+faststart"]
+
+        # 视频处理
+        if self.needs_video_encode(media_info):
+            args = self._pr_video_args()
         else:
-            cmd += ["-c:a", "copy"]
+            args = ["-c:v", "copy"]
 
-        cmd += [
+        # 音频处理
+        audio_stream = next(s for s in media_info['streams'] if s['codec_type'] == 'audio')
+        args += self._pr_audio_args(audio_stream)
+
+        return args + [
             "-map", "0:v",
             "-map", "0:a",
-            "-max_muxing_queue_size", "9999",
-            output_path
+            "-max_muxing_queue_size", "9999"
         ]
-        return cmd
+
+    def _build_pr_command(self, input_path, output_path, media_info):
+        cmd = [
+            "ffmpeg",
+            "-y",
+            *hwaccel_args(),  # 仅在ffmpeg支持硬件解码时启用
+            "-i", input_path
+        ]
+        return cmd + self.output_args(media_info) + [output_path]
 
     def _build_fast_command(self, input_path, output_path):
         return [
@@ -90,40 +217,116 @@ class VideoConverter:
             output_path
         ]
 
+    def process_kind(self, cmd):
+        """ffmpeg命令的进程类别：重新编码视频的按编码限流，其余按封装限流"""
+        return ENCODE if encodes_video(cmd) else REMUX
+
+    def try_native_faststart(self, input_path, output_path):
+        """快速模式下MP4输入只需把moov移到前面，原生完成时返回True"""
+        if self.config['pr_compat_mode'] or Path(input_path).suffix.lower() != '.mp4':
+            return False
+        try:
+            return relocate_moov(input_path, output_path)
+        except FaststartUnsupported:
+            return False
+
+    def use_segmented_encode(self, input_path):
+        """PR兼容模式且需要重新编码视频时，按配置启用分段并行编码"""
+        if not self.config['pr_compat_mode'] or self.config.get('parallel_segments', 1) <= 1:
+            return False
+        return self.needs_video_encode(self.get_media_info(input_path))
+
+    def convert_segmented(self, input_path, output_path):
+        """分段并行编码：关键帧切分 -> 并发编码 -> concat无损拼接"""
+        with st.status("分段并行编码中...", expanded=True) as status:
+            progress_bar = st.progress(0)
+            try:
+                stats = segmented_encode(
+                    self, input_path, output_path,
+                    count=self.config['parallel_segments'],
+                    on_segment_done=lambda done, total: progress_bar.progress(
+                        done / total, text=f"已完成分段 {done}/{total}"
+                    )
+                )
+            except Exception as e:
+                status.update(label="转换失败", state="error")
+                st.error(f"分段编码失败: {str(e)}")
+                return None
+
+            status.update(label="转换成功!", state="complete")
+            st.success(
+                f"文件转换成功完成！{stats['segments']} 个分段 × {stats['threads_per_segment']} 线程，"
+                f"耗时 {stats['wall_time']}s，平均并行度 {stats['parallelism']}"
+            )
+
+        if self.config.get('measure_speedup'):
+            with st.spinner("正在运行单进程编码以测量实际加速比..."):
+                reference = Path(output_path).with_name(Path(output_path).stem + "_single.mp4")
+                single_time = single_process_encode(self, input_path, str(reference))
+                reference.unlink(missing_ok=True)
+            st.info(f"单进程耗时 {single_time:.2f}s，实际加速比 {single_time / stats['wall_time']:.2f}x")
+
+        self._verify_output(output_path)
+        return output_path
+
     def convert(self):
-        """执行转换主逻辑"""
+        """执行转换主逻辑（采集耗时、速度、CPU等指标）"""
+        with job_metrics.collect('convert', self.config['input_path']) as metrics:
+            output_path = self._convert()
+            if output_path is None:
+                metrics.status = 'failed'
+            metrics.observe_outputs(output_path)
+            return output_path
+
+    def _convert(self):
         input_path = self.safe_path(self.config['input_path'])
         output_path = self.safe_path(self.config['output_path'])
         
+        if self.try_native_faststart(input_path, output_path):
+            st.success("moov已原生移动到文件开头，无需ffmpeg重新封装")
+            self._verify_output(output_path)
+            return output_path
+        
+        if self.use_segmented_encode(input_path):
+            return self.convert_segmented(input_path, output_path)
+        
         cmd = self.build_command(input_path, output_path)
+        # 机器可读进度输出到stdout，关闭默认的统计行
+        cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+        refresh_interval = self.config.get('ui_refresh_interval', 0.5)
         
         with st.status("转换进行中...", expanded=True) as status:
             st.write(f"**执行的命令:** `{' '.join(cmd)}`")
             progress_bar = st.progress(0)
             log_container = st.empty()
             
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                bufsize=1,
-                universal_newlines=False
-            )
-            
-            full_log = ""
-            while True:
-                output = process.stdout.readline()
-                if not output and process.poll() is not None:
-                    break
-                if output:
+            tracker = ProgressTracker(self.duration)
+            log_lines = deque(maxlen=self.config.get('log_lines', 200))  # 固定大小的日志环形缓冲
+            last_render = 0.0
+
+            def render():
+                progress_bar.progress(tracker.percent / 100, text=tracker.summary())
+                log_container.code(''.join(log_lines), language='bash')
+
+            # 页面重跑或停止时退出 with，ffmpeg子进程随之终止
+            with stream(cmd, kind=self.process_kind(cmd)) as process:
+                for output in process:
                     try:
                         decoded = output.decode(self.force_encoding)
                     except UnicodeDecodeError:
                         decoded = output.decode(self.system_encoding, errors='replace')
-                    
-                    full_log += decoded
-                    log_container.code(full_log[-2000:], language='bash')  # 显示最后2000字符
-                    progress_bar.progress(min(process.poll() or 0, 100)/100)
+
+                    if not tracker.feed(decoded):
+                        log_lines.append(decoded)
+
+                    now = time.monotonic()
+                    if now - last_render >= refresh_interval:
+                        render()
+                        last_render = now
+
+            render()
+            job_metrics.observe_progress(tracker)
+            full_log = ''.join(log_lines)
             
             if process.returncode == 0:
                 status.update(label="转换成功!", state="complete")
@@ -136,8 +339,8 @@ class VideoConverter:
                 st.code(full_log[-2000:], language='bash')
                 return None
 
-    def _verify_output(self, output_path):
-        """验证输出文件"""
+    def verify_output(self, output_path):
+        """检查输出文件的PR兼容性，返回 (是否通过, 视频流信息)"""
         cmd = [
             "ffprobe",
             "-v", "error",
@@ -147,18 +350,29 @@ class VideoConverter:
             output_path
         ]
         
+        def probe():
+            # 探测失败或没有视频流时抛出异常，get_or_compute 不缓存异常，下次验证会重新探测
+            info = json.loads(run(cmd, timeout=10).stdout)
+            if not info.get('streams'):
+                raise RuntimeError("输出文件中未找到视频流")
+            return info
+
+        info = media_cache.get_or_compute(output_path, cmd[:-1], probe)
+        video_info = info['streams'][0]
+        
+        verification = {
+            'codec_name': video_info['codec_name'] == 'h264',
+            'profile': video_info['profile'] in ['High', 'Main', 'Baseline'],
+            'pix_fmt': video_info['pix_fmt'] == 'yuv420p'
+        }
+        return all(verification.values()), video_info
+
+    def _verify_output(self, output_path):
+        """验证输出文件"""
         try:
-            result = subprocess.run(cmd, capture_output=True, timeout=10)
-            info = json.loads(result.stdout)
-            video_info = info['streams'][0]
-            
-            verification = {
-                'codec_name': video_info['codec_name'] == 'h264',
-                'profile': video_info['profile'] in ['High', 'Main', 'Baseline'],
-                'pix_fmt': video_info['pix_fmt'] == 'yuv420p'
-            }
+            passed, video_info = self.verify_output(output_path)
             
-            if all(verification.values()):
+            if passed:
                 st.success("PR兼容性验证通过")
             else:
                 warning = [
@@ -179,7 +393,17 @@ def main():
     config = {
         'pr_compat_mode': st.sidebar.checkbox("启用PR兼容模式", True),
         'audio_bitrate': st.sidebar.selectbox("音频比特率", ['192k', '256k', '320k'], index=2),
-        'preset': st.sidebar.selectbox("编码预设", ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'], index=5)
+        'preset': st.sidebar.selectbox("编码预设", ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'], index=5),
+        'ui_refresh_interval': st.sidebar.slider("进度刷新间隔(秒)", 0.1, 5.0, 0.5, step=0.1),
+        'parallel_segments': st.sidebar.number_input(
+            "并行编码分段数", min_value=1, max_value=64, value=1,
+            help="大于1时在关键帧处切分并发编码（仅PR兼容模式下需要重新编码时生效）"
+        ),
+        'measure_speedup': st.sidebar.checkbox("测量分段编码加速比", False, help="额外运行一次单进程编码用于对比"),
+        'hw_encode': st.sidebar.checkbox(
+            "硬件编码（如可用）", False,
+            help="优先使用本机可用的NVENC/QSV/VideoToolbox/AMF编码器，速度更快；不可用时自动回退libx264"
+        )
     }
     
     # 文件上传
@@ -187,41 +411,81 @@ def main():
     if not uploaded_file:
         st.stop()
     
-    # 生成临时文件路径
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_input:
-        tmp_input.write(uploaded_file.getvalue())
-        config['input_path'] = tmp_input.name
+    # 上传文件只落盘一次，重复转换时复用
+    input_path = stage_upload(uploaded_file)
+    config['input_path'] = str(input_path)
     
-    # 自动生成输出路径
+    # 自动生成输出文件名（每个任务使用独立的输出目录）
     output_ext = "_PR.mp4" if config['pr_compat_mode'] else ".mp4"
-    config['output_path'] = Path(config['input_path']).with_suffix(output_ext).name
+    output_name = input_path.stem + output_ext
+    
+    # 关键帧缩略图与低码率代理片段（文件已落盘，直接生成）
+    with st.expander("🎥 视频预览", expanded=True):
+        preview_panel(uploaded_file)
     
     # 显示配置摘要
     with st.expander("当前配置"):
         st.json({
             "输入文件": config['input_path'],
-            "输出文件": config['output_path'],
+            "输出文件": output_name,
             "PR兼容模式": config['pr_compat_mode'],
             "音频比特率": config['audio_bitrate'],
             "编码预设": config['preset']
         })
     
-    # 开始转换
+    # 开始前给出预计耗时（按媒体时长、分辨率、是否重新编码和历史速度估算）
+    try:
+        eta = estimate('convert', {'input_path': config['input_path'], 'config': config})
+        st.caption(f"⏱️ 预计耗时 {format_eta(eta['seconds'])}" + ("（基于历史速度）" if eta['source'] == 'history' else ""))
+    except Exception:
+        pass  # 估算失败不影响转换
+    
+    # 开始转换：提交到任务队列，由worker执行；页面重跑或刷新不会中断转换
     if st.button("开始转换"):
-        converter = VideoConverter(config)
-        output_path = converter.convert()
-        
-        if output_path:
-            with open(output_path, "rb") as f:
-                st.download_button(
-                    label="下载转换后的文件",
-                    data=f,
-                    file_name=Path(output_path).name,
-                    mime="video/mp4"
-                )
-            # 清理临时文件
-            os.unlink(config['input_path'])
-            os.unlink(output_path)
+        config['output_path'] = str(new_output_path(input_path, output_name))
+        submit_job(
+            'convert',
+            {'input_path': config['input_path'], 'output_path': config['output_path'], 'config': config},
+            label=f"{uploaded_file.name} → {output_name}"
+        )
+    
+    # 裁剪/分割：关键帧之间流复制，不经过整文件转换
+    with st.expander("✂️ 裁剪 / 分割"):
+        operation = st.radio("操作", ["裁剪片段", "按时长分割", "按大小分割"], horizontal=True)
+        if operation == "裁剪片段":
+            col_start, col_end = st.columns(2)
+            start = col_start.text_input("开始时间", "0:00:00", help="如 1:02:03.5、62:03 或 3723.5（秒）")
+            end = col_end.text_input("结束时间", "", help="留空表示到文件末尾")
+            st.caption("PR兼容模式下只按PR参数重新编码切点所在的不完整GOP，其余无损复制；"
+                       "关闭PR兼容模式时开始位置对齐到之前的关键帧，全部无损复制")
+            if st.button("✂️ 裁剪", use_container_width=True):
+                try:
+                    params = {'input_path': config['input_path'], 'start': parse_timecode(start),
+                              'end': parse_timecode(end) if end.strip() else None, 'config': config}
+                except ValueError:
+                    st.error("时间格式无效")
+                else:
+                    params['output_path'] = str(new_output_path(input_path, f"{input_path.stem}_cut.mp4"))
+                    submit_job('trim', params, label=f"{uploaded_file.name} ✂️ {start} - {end.strip() or '结尾'}")
+        else:
+            if operation == "按时长分割":
+                limit = st.text_input("每段最长时长", "30m", help="如 30m、1h、00:45:00")
+            else:
+                limit = st.text_input("每段最大大小", "2G", help="如 700M、2G")
+            st.caption("在关键帧处切分并全部流复制，每段时间戳从0开始，适合批量归档")
+            if st.button("📦 分割", use_container_width=True):
+                try:
+                    params = {'input_path': config['input_path'],
+                              'max_seconds': parse_timecode(limit) if operation == "按时长分割" else None,
+                              'max_bytes': parse_size(limit) if operation == "按大小分割" else None}
+                except ValueError:
+                    st.error("格式无效")
+                else:
+                    params['output_dir'] = str(new_output_path(input_path, input_path.name).parent)
+                    submit_job('split', params, label=f"{uploaded_file.name} 📦 每段 {limit}")
+    
+    # 任务状态与下载
+    job_panel(['convert', 'trim', 'split'], config['ui_refresh_interval'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import bisect
+import os
+import tempfile
+import time
+from contextlib import closing
+from pathlib import Path
+
+from core.cache.media_cache import media_cache
+from core.process.async_runner import run, run_all, ENCODE, REMUX
+
+# ==================== 关键帧索引 ====================
+def probe_keyframe_index(input_path, read_intervals=None):
+    """读取视频流关键帧的 [时间戳, 字节偏移]（只解析包头，不解码）
+
+    默认读取整个文件；传入 read_intervals（ffprobe -read_intervals 语法）时只读取这些区间。
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,pos,flags",
+        "-of", "csv=p=0",
+    ]
+    if read_intervals:
+        cmd += ["-read_intervals", read_intervals]
+    cmd.append(str(input_path))
+
+    def probe():
+        index = []
+        for line in run(cmd).text().splitlines():
+            pts_time, pos, flags = (line.split(',') + ['', ''])[:3]
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                index.append([float(pts_time), int(pos) if pos.isdigit() else None])
+        return [[pts_time, pos] for pts_time, pos in sorted(dict(index).items())]  # 相邻区间可能重叠
+
+    return media_cache.get_or_compute(input_path, cmd[:-1], probe)
+
+def probe_keyframes(input_path):
+    """读取视频流所有关键帧的时间戳"""
+    return [pts_time for pts_time, _ in probe_keyframe_index(input_path)]
+
+def media_start_time(media_info):
+    """容器的起始时间戳；ffmpeg 的输入 -ss 以它为零点，关键帧的 pts_time 需减去它"""
+    try:
+        return float(media_info.get('format', {}).get('start_time') or 0.0)
+    except ValueError:
+        return 0.0
+
+def plan_segments(keyframes, duration, count):
+    """按时长均分，并将切点对齐到其后的第一个关键帧，返回 [(开始, 结束)]
+
+    结束为 None 表示一直到文件末尾。
+    """
+    cuts = []
+    for i in range(1, count):
+        index = bisect.bisect_left(keyframes, duration * i / count)
+        if index < len(keyframes):
+            cut = keyframes[index]
+            if 0 < cut < duration and (not cuts or cut > cuts[-1]):
+                cuts.append(cut)
+    bounds = [0.0] + cuts + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+# ==================== 分段编码 ====================
+def run_ffmpeg(cmd, kind=ENCODE):
+    """失败时抛出 ProcessError（RuntimeError 子类），消息为stderr末尾"""
+    run(cmd, kind=kind)
+
+def segment_command(converter, input_path, segment_path, start, end, threads):
+    """以PR兼容参数编码单个分段（仅视频）的命令，start/end 为相对文件起点的秒数"""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{start:.6f}", "-i", input_path]
+    if end is not None:
+        cmd += ["-t", f"{end - start:.6f}"]
+    return cmd + ["-map", "0:v:0", "-an"] + converter._pr_video_args() + ["-threads", str(threads), str(segment_path)]
+
+def segmented_encode(converter, input_path, output_path, count=None, on_segment_done=None):
+    """在关键帧处切分源文件，并发编码各分段后用concat demuxer无损拼接
+
+    音频不分段，拼接时从源文件整体处理，避免分段边界的AAC填充间隙。
+    任一分段失败或 on_segment_done 抛出异常（如任务被取消）时，其余分段的ffmpeg会被终止。
+    返回统计信息，其中 parallelism = 各分段耗时之和 / 实际耗时，即平均同时运行的分段数，
+    并非相对单进程编码的加速比（实际加速比需用 single_process_encode 测量）。
+    """
+    cores = os.cpu_count() or 1
+    count = count or cores
+    media_info = converter.get_media_info(input_path)
+    duration = converter.get_duration(media_info)
+    origin = media_start_time(media_info)
+    keyframes = [t - origin for t in probe_keyframes(input_path)]
+    segments = plan_segments(keyframes, duration, count)
+    threads = max(1, cores // len(segments))
+
+    start_time = time.monotonic()
+    with tempfile.TemporaryDirectory(dir=Path(output_path).parent) as tmp_dir:
+        segment_paths = [Path(tmp_dir) / f"segment_{i:04d}.mp4" for i in range(len(segments))]
+        segment_times = [0.0] * len(segments)
+        commands = [
+            segment_command(converter, input_path, path, start, end, threads)
+            for path, (start, end) in zip(segment_paths, segments)
+        ]
+
+        # 结果在当前线程中回调，分段进程的资源占用计入当前任务的指标
+        with closing(run_all(commands, kind=ENCODE)) as results:
+            for done, (i, result) in enumerate(results, 1):
+                segment_times[i] = result.wall_sec
+                if on_segment_done:
+                    on_segment_done(done, len(segments))
+
+        list_path = Path(tmp_dir) / "segments.txt"
+        list_path.write_text(
+            ''.join("file '{}'\n".format(path.as_posix().replace("'", "'\\''")) for path in segment_paths),
+            encoding='utf-8'
+        )
+
+        cmd = ["ffmpeg", "-y", "-v", "error",
+               "-f", "concat", "-safe", "0", "-i", str(list_path),
+               "-i", input_path,
+               "-map", "0:v:0", "-c:v", "copy"]
+        audio_stream = next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+        if audio_stream is not None:
+            cmd += ["-map", "1:a:0"] + converter._pr_audio_args(audio_stream)
+        cmd += ["-movflags", "+faststart", "-max_muxing_queue_size", "9999", output_path]
+        run_ffmpeg(cmd, kind=REMUX)
+
+    wall_time = time.monotonic() - start_time
+    return {
+        'segments': len(segments),
+        'threads_per_segment': threads,
+        'segment_times': [round(t, 2) for t in segment_times],
+        'wall_time': round(wall_time, 2),
+        'parallelism': round(sum(segment_times) / wall_time, 2) if wall_time else 0.0,
+    }
+
+def single_process_encode(converter, input_path, output_path):
+    """按原有单进程路径编码，返回耗时（用于测量实际加速比）"""
+    cmd = converter._build_pr_command(input_path, output_path, converter.get_media_info(input_path))
+    begin = time.monotonic()
+    run_ffmpeg(cmd)
+    return time.monotonic() - begin
@@ -0,0 +1,356 @@
+import argparse
+import bisect
+import contextvars
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.process.async_runner import run, ENCODE, REMUX
+from core.process.ffmpeg_capabilities import has_encoder
+from core.convert.segmented_encode import media_start_time, probe_keyframe_index
+
+KEYFRAME_EPSILON = 0.001   # 切点与关键帧相差不超过该值(秒)时视为落在关键帧上
+KEYFRAME_WINDOW = 10.0     # 裁剪时在开始切点之后读取关键帧的初始窗口(秒)
+SIZE_MARGIN = 0.97         # 按大小分割时为每段的moov等封装开销预留的余量
+
+# ffprobe 报告的profile -> 编码器的 -profile:v；切点GOP按源profile重新编码才能与复制段拼接
+ENCODE_PROFILES = {
+    'h264': {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high'},
+    'hevc': {'Main': 'main', 'Main 10': 'main10'},
+}
+
+# ==================== 参数解析 ====================
+def parse_timecode(value):
+    """'1:02:03.5' / '62:03' / '3723.5' / '90s' / '30m' / '1.5h' -> 秒"""
+    value = str(value).strip().lower()
+    match = re.fullmatch(r'([\d.]+)\s*([smh])', value)
+    if match:
+        return float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600}[match.group(2)]
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_size(value):
+    """'700M' / '2G' / '1.5GB' / 字节数 -> 字节"""
+    match = re.fullmatch(r'([\d.]+)\s*([kmg]?)i?b?', str(value).strip().lower())
+    if not match:
+        raise ValueError(f"无法解析大小: {value}")
+    return int(float(match.group(1)) * 1024 ** ' kmg'.index(match.group(2) or ' '))
+
+def format_timecode(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes // 60):02d}:{int(minutes % 60):02d}:{seconds:06.3f}"
+
+# ==================== 裁剪 ====================
+def cut_plan(keyframes, start, end, snap=False):
+    """[(开始, 结束, 是否重新编码)]：完整的GOP直接复制，切点所在的不完整GOP重新编码
+
+    snap=True 时开始位置移到其前面的关键帧，整段复制（无损但不是帧精确）。
+    """
+    if snap:
+        i = bisect.bisect_right(keyframes, start + KEYFRAME_EPSILON) - 1
+        return [(keyframes[i] if i >= 0 else 0.0, end, False)]
+
+    i = bisect.bisect_left(keyframes, start - KEYFRAME_EPSILON)
+    j = bisect.bisect_right(keyframes, end + KEYFRAME_EPSILON) - 1
+    if i >= len(keyframes) or j < 0 or keyframes[j] - keyframes[i] <= KEYFRAME_EPSILON:
+        return [(start, end, True)]  # 区间内没有完整的GOP
+    first, last = keyframes[i], keyframes[j]
+
+    plan = []
+    if first - start > KEYFRAME_EPSILON:
+        plan.append((start, first, True))
+    plan.append((first, last, False))
+    if end - last > KEYFRAME_EPSILON:
+        plan.append((last, end, True))
+    return plan
+
+def keyframes_for_cut(input_path, origin, start, end, snap=False):
+    """只读取切点附近的关键帧（相对文件起点的秒数），不扫描整个文件
+
+    每个区间先seek到切点之前的关键帧再向后读取：开始处读 KEYFRAME_WINDOW 秒，找到其后的第一个关键帧
+    （GOP更长时扩大窗口）；结束处只需切点之前的最后一个关键帧。ffprobe 的区间使用绝对时间戳。
+    """
+    window = KEYFRAME_WINDOW
+    while True:
+        intervals = [f"{origin + start:.6f}%+{0.001 if snap else window:.6f}"]
+        if not snap:
+            intervals.append(f"{origin + end:.6f}%+0.001")
+        keyframes = [t - origin for t, _ in probe_keyframe_index(input_path, ','.join(intervals))]
+        if not keyframes:
+            # 无法按区间seek（如不可seek的封装）时退回完整索引
+            return [t - origin for t, _ in probe_keyframe_index(input_path)]
+        if snap or start + window >= end or any(start < t <= start + window for t in keyframes):
+            return keyframes
+        window *= 4
+
+def video_signature(stream):
+    """复制段与重新编码段能否直接拼接取决于这些码流参数（SPS中的profile/level/分辨率等）"""
+    return tuple(stream.get(key) for key in
+                 ('codec_name', 'profile', 'level', 'width', 'height', 'pix_fmt', 'r_frame_rate'))
+
+def matching_video_args(video, preset='medium'):
+    """按源码流的profile、level、像素格式与帧率重新编码的参数（分辨率不变），无法匹配时返回 None"""
+    codec = video.get('codec_name')
+    profile = ENCODE_PROFILES.get(codec, {}).get(video.get('profile'))
+    level = video.get('level') or 0
+    if profile is None or level < 10 or not video.get('pix_fmt'):
+        return None
+    if codec == 'h264':
+        if not has_encoder('libx264'):
+            return None
+        args = ["-c:v", "libx264", "-preset", preset, "-profile:v", profile, "-level", f"{level / 10:.1f}"]
+    else:
+        if not has_encoder('libx265'):
+            return None
+        # HEVC 的 level 在码流中为 30 × 级别号
+        args = ["-c:v", "libx265", "-preset", preset, "-profile:v", profile,
+                "-x265-params", f"level-idc={level / 30:.1f}"]
+    args += ["-pix_fmt", video['pix_fmt']]
+    if video.get('r_frame_rate') not in (None, '0/0'):
+        args += ["-r", video['r_frame_rate']]
+    return args
+
+def probe_video_stream(path):
+    """中转分段的视频流参数（临时文件，不经过媒体信息缓存）"""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_streams", "-of", "json", str(path)]
+    streams = json.loads(run(cmd).stdout).get('streams', [])
+    return streams[0] if streams else {}
+
+def audio_args(converter, audio_stream):
+    """PR兼容模式沿用转换器的音频参数（AAC源直接复制），快速模式直接复制"""
+    return converter._pr_audio_args(audio_stream) if converter.config['pr_compat_mode'] else ["-c:a", "copy"]
+
+def part_command(input_path, path, start, end, video_args):
+    """把 [start, end)（相对文件起点）的视频写成MPEG-TS分段：参数集随关键帧带在码流中，可以直接拼接"""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{start:.6f}", "-i", str(input_path)]
+    if end is not None:
+        cmd += ["-t", f"{end - start:.6f}"]
+    return cmd + ["-map", "0:v:0", "-an"] + video_args + ["-f", "mpegts", str(path)]
+
+def concat_parts(tmp_dir, paths):
+    """concat demuxer 的文件列表"""
+    list_path = Path(tmp_dir) / "parts.txt"
+    list_path.write_text(
+        ''.join("file '{}'\n".format(path.as_posix().replace("'", "'\\''")) for path in paths),
+        encoding='utf-8'
+    )
+    return list_path
+
+def stitch(converter, input_path, output_path, plan, video, audio, edge_args, on_progress=None):
+    """复制中间的完整GOP、按源参数重新编码两端，再无损拼接；重新编码的分段与源参数不一致时返回 False"""
+    start, end = plan[0][0], plan[-1][1]
+    with tempfile.TemporaryDirectory(dir=Path(output_path).parent) as tmp_dir:
+        paths = [Path(tmp_dir) / f"part_{i:02d}.ts" for i in range(len(plan))]
+        # 开头与结尾的GOP编码和中间的复制互不依赖，并发执行
+        with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, run,
+                            part_command(input_path, path, s, e, edge_args if reencode else ["-c:v", "copy"]),
+                            ENCODE if reencode else REMUX)
+                for path, (s, e, reencode) in zip(paths, plan)
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if on_progress:
+                    on_progress(done / (len(plan) + 1))
+
+        source = video_signature(video)
+        if any(video_signature(probe_video_stream(path)) != source
+               for path, (_, _, reencode) in zip(paths, plan) if reencode):
+            return False
+
+        # 音频不分段，从源文件整体截取同一区间，避免分段边界的AAC填充间隙
+        cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", str(concat_parts(tmp_dir, paths)),
+               "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", str(input_path),
+               "-map", "0:v:0", "-c:v", "copy"]
+        if video['codec_name'] == 'hevc':
+            cmd += ["-tag:v", "hvc1"]
+        if audio is not None:
+            cmd += ["-map", "1:a:0"] + audio_args(converter, audio)
+        cmd += ["-movflags", "+faststart", "-max_muxing_queue_size", "9999", str(output_path)]
+        run(cmd, kind=REMUX)
+    return True
+
+def smart_cut(converter, input_path, output_path, start, end=None, snap=False, on_progress=None):
+    """按关键帧裁剪：关键帧之间的部分流复制，只重新编码切点所在的不完整GOP
+
+    start/end 为相对文件起点的秒数（与ffmpeg -ss 一致）。切点GOP按源码流的profile/level/像素格式/帧率
+    重新编码，才能与复制段拼接；源参数无法匹配或编码结果不一致时，整个区间按PR参数重新编码（仍只处理该区间）。
+    返回统计信息：裁剪时长、复制与重新编码的秒数、分段数与耗时。
+    """
+    begin = time.monotonic()
+    media_info = converter.get_media_info(input_path)
+    duration = converter.get_duration(media_info)
+    end = duration if end is None or (duration and end > duration) else end
+    if not 0 <= start < end:
+        raise ValueError(f"裁剪区间无效: {start} - {end}")
+    video = next((s for s in media_info['streams'] if s['codec_type'] == 'video'), None)
+    audio = next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+    if video is None:
+        raise RuntimeError("文件中未找到视频流")
+
+    keyframes = keyframes_for_cut(input_path, media_start_time(media_info), start, end, snap)
+    plan = cut_plan(keyframes, start, end, snap)
+    if len(plan) > 1:
+        edge_args = matching_video_args(video, converter.config.get('preset', 'medium'))
+        if edge_args is None or not stitch(converter, input_path, output_path, plan, video, audio, edge_args,
+                                           on_progress):
+            plan = [(start, end, True)]
+
+    if len(plan) == 1:
+        # 单个分段直接输出MP4，不需要中转与拼接
+        part_start, part_end, reencode = plan[0]
+        cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{part_start:.6f}", "-i", str(input_path),
+               "-t", f"{part_end - part_start:.6f}", "-map", "0:v:0"]
+        cmd += converter._pr_video_args() if reencode else ["-c:v", "copy"]
+        if audio is not None:
+            cmd += ["-map", "0:a:0"] + audio_args(converter, audio)
+        cmd += ["-movflags", "+faststart", "-avoid_negative_ts", "make_zero", str(output_path)]
+        run(cmd, kind=ENCODE if reencode else REMUX)
+
+    encoded = sum(e - s for s, e, reencode in plan if reencode)
+    return {
+        'start': round(plan[0][0], 3),
+        'duration': round(end - plan[0][0], 3),
+        'copied': round(sum(e - s for s, e, reencode in plan if not reencode), 3),
+        'encoded': round(encoded, 3),
+        'parts': len(plan),
+        'wall_time': round(time.monotonic() - begin, 2),
+    }
+
+# ==================== 分割 ====================
+def split_points(points, limit, total):
+    """贪心选择切点：每段在不超过 limit 的前提下尽量长，切点都在关键帧上
+
+    points 为按时间排序的 [(关键帧时间, 度量)]，度量是时间或字节偏移，total 为整个文件的度量；
+    单个GOP就超过 limit 时该段只包含这一个GOP。
+    """
+    cuts = []
+    base_time, base_metric = 0.0, 0.0
+    previous = None
+    for point_time, metric in list(points) + [(None, total)]:
+        if point_time is not None and point_time <= base_time:
+            continue
+        if metric - base_metric > limit:
+            if previous is not None and previous[0] > base_time:
+                base_time, base_metric = previous
+                cuts.append(base_time)
+            if point_time is not None and metric - base_metric > limit:
+                base_time, base_metric = point_time, metric
+                cuts.append(point_time)
+        previous = (point_time, metric)
+    return cuts
+
+def plan_split(input_path, duration, max_seconds=None, max_bytes=None, origin=0.0):
+    """按时长或大小计算关键帧切点（相对文件起点，origin 为容器起始时间戳）；字节偏移缺失时按平均码率估算"""
+    index = [[t - origin, pos] for t, pos in probe_keyframe_index(input_path)]
+    if max_seconds:
+        return split_points([(t, t) for t, _ in index], max_seconds, duration)
+    size = os.path.getsize(input_path)
+    points = [(t, pos if pos is not None else size * t / duration if duration else 0) for t, pos in index]
+    return split_points(points, max_bytes * SIZE_MARGIN, size)
+
+def split_command(input_path, output_dir, cuts, duration):
+    """一次流复制按切点写出多个MP4，每段时间戳从0开始且moov在文件开头"""
+    pattern = Path(output_dir) / f"{Path(input_path).stem}_%03d.mp4"
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(input_path), "-map", "0:v:0?", "-map", "0:a:0?", "-c", "copy",
+           "-f", "segment", "-reset_timestamps", "1", "-segment_format", "mp4",
+           "-segment_format_options", "movflags=+faststart"]
+    if cuts:
+        cmd += ["-segment_times", ",".join(f"{t:.6f}" for t in cuts)]
+    else:
+        cmd += ["-segment_time", f"{duration + 1:.0f}"]  # 不需要分割时也输出一个文件
+    return cmd + [str(pattern)]
+
+def split_outputs(input_path, output_dir):
+    return sorted(Path(output_dir).glob(f"{Path(input_path).stem}_[0-9][0-9][0-9].mp4"))
+
+# ==================== 命令行入口 ====================
+def converter_module():
+    """flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载"""
+    return importlib.import_module("core.convert.flv-to-mp4")
+
+def collect_inputs(paths):
+    video_extensions = {'.mp4', '.mov', '.mkv', '.flv'}
+    inputs = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            inputs += sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() in video_extensions)
+        else:
+            inputs.append(path)
+    return inputs
+
+def split_file(input_path, output_dir, max_seconds, max_bytes):
+    converter = converter_module().VideoConverter({'pr_compat_mode': False})
+    media_info = converter.get_media_info(str(input_path))
+    duration = converter.get_duration(media_info)
+    cuts = plan_split(str(input_path), duration, max_seconds, max_bytes, media_start_time(media_info))
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    run(split_command(input_path, output_dir, cuts, duration), kind=REMUX)
+    return split_outputs(input_path, output_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="按关键帧无损裁剪与分割")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    trim = commands.add_parser("trim", help="裁剪一个片段，只重新编码切点所在的不完整GOP")
+    trim.add_argument("input", help="输入文件")
+    trim.add_argument("--start", required=True, help="开始时间，如 1:02:03.5 或 3723.5")
+    trim.add_argument("--end", help="结束时间（默认到文件末尾）")
+    trim.add_argument("-o", "--output", help="输出文件（默认 <输入>_cut.mp4）")
+    trim.add_argument("--snap", action="store_true", help="开始位置移到之前的关键帧，全部流复制（不重新编码）")
+    trim.add_argument("--preset", default="medium", help="切点GOP重新编码的x264/x265预设")
+    trim.add_argument("--hw-encode", action="store_true", help="无法按源参数拼接、整段重新编码时优先使用硬件H.264编码器")
+
+    split = commands.add_parser("split", help="按时长或大小无损分割（批量归档）")
+    split.add_argument("inputs", nargs="+", help="输入文件或目录")
+    limit = split.add_mutually_exclusive_group(required=True)
+    limit.add_argument("--max-duration", help="每段最长时长，如 30m、1h、00:45:00")
+    limit.add_argument("--max-size", help="每段最大大小，如 700M、2G")
+    split.add_argument("-o", "--output-dir", help="输出目录（默认与输入文件同目录）")
+    split.add_argument("--jobs", type=int, default=4, help="同时分割的文件数")
+    args = parser.parse_args()
+
+    if args.command == "trim":
+        input_path = Path(args.input)
+        output_path = args.output or str(input_path.with_name(input_path.stem + "_cut.mp4"))
+        converter = converter_module().VideoConverter({
+            'pr_compat_mode': True, 'audio_bitrate': '320k', 'preset': args.preset,
+            'force_audio': False, 'hw_encode': args.hw_encode,
+        })
+        stats = smart_cut(converter, str(input_path), output_path, parse_timecode(args.start),
+                          parse_timecode(args.end) if args.end else None, snap=args.snap)
+        print(f"完成：{output_path}（{stats['duration']} 秒，复制 {stats['copied']} 秒，"
+              f"重新编码 {stats['encoded']} 秒，耗时 {stats['wall_time']}s）")
+        return 0
+
+    max_seconds = parse_timecode(args.max_duration) if args.max_duration else None
+    max_bytes = parse_size(args.max_size) if args.max_size else None
+    inputs = collect_inputs(args.inputs)
+    failed = 0
+    # 分割只做流复制，以I/O为主，多个文件并发
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(split_file, path, Path(args.output_dir or path.parent), max_seconds, max_bytes): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            try:
+                print(f"[ok] {futures[future].name} -> {len(future.result())} 段")
+            except Exception as e:
+                failed += 1
+                print(f"[failed] {futures[future].name}: {e}")
+    print(f"完成：成功 {len(inputs) - failed} 个，失败 {failed} 个")
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
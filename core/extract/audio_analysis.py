@@ -0,0 +1,205 @@
+import math
+
+import numpy as np
+import streamlit as st
+
+from core.cache.media_cache import media_cache
+from core.process.async_runner import stream, ENCODE
+from core.convert.segmented_encode import media_start_time
+from core.fix.slice_scan import probe_media_info, media_duration
+from core.staging.upload_staging import stage_upload
+from core.telemetry import job_metrics
+
+ANALYSIS_RATE = 8000      # 分析用的单声道采样率，波形与静音检测不需要更高
+WINDOW_SEC = 0.05         # 响度统计窗口(秒)
+WAVEFORM_POINTS = 800     # 波形图的点数上限
+SILENCE_DB = -50.0        # 低于该RMS响度(dBFS)的窗口视为静音
+MIN_SILENCE_SEC = 1.0     # 静音持续超过该时长才记为静音段
+KEEP_PADDING = 0.2        # 裁剪时在有声部分两侧保留的静音(秒)，避免切掉起音和尾音
+
+def to_db(value):
+    return round(20 * math.log10(value), 1) if value > 0 else -120.0
+
+# ==================== 分析 ====================
+def pcm_command(input_path):
+    """第一条音频流降为低采样率单声道16位PCM，从stdout输出"""
+    return ["ffmpeg", "-v", "error", "-i", str(input_path), "-map", "0:a:0", "-vn",
+            "-ac", "1", "-ar", str(ANALYSIS_RATE), "-f", "s16le", "pipe:1"]
+
+class LoudnessTracker:
+    """逐块统计响度：只保留不足一个窗口/一个波形点的余量，内存占用与音频时长无关"""
+
+    def __init__(self, duration, silence_db, min_silence):
+        self.window = int(ANALYSIS_RATE * WINDOW_SEC)
+        self.bin_windows = max(1, math.ceil(duration / WINDOW_SEC / WAVEFORM_POINTS)) if duration else 1
+        self.silence_db = silence_db
+        self.min_windows = math.ceil(min_silence / WINDOW_SEC)
+        self.leftover = np.zeros(0, dtype=np.float32)       # 不足一个窗口的采样
+        self.bin_carry = (np.zeros(0), np.zeros(0))         # 不足一个波形点的窗口 (峰值, 均方)
+        self.peaks, self.rms = [], []
+        self.windows = 0
+        self.sum_sq = 0.0
+        self.peak = 0.0
+        self.was_quiet = False
+        self.silence_start = None
+        self.silences = []
+
+    def feed(self, samples):
+        data = np.concatenate((self.leftover, samples))
+        usable = len(data) // self.window * self.window
+        self.leftover = data[usable:]
+        if not usable:
+            return
+        frames = data[:usable].reshape(-1, self.window)
+        peaks = np.abs(frames).max(axis=1)
+        mean_sq = np.square(frames, dtype=np.float64).mean(axis=1)
+        self.sum_sq += float(mean_sq.sum()) * self.window
+        self.peak = max(self.peak, float(peaks.max()))
+        self.track_silence(mean_sq)
+        self.windows += len(frames)
+        self.add_bins(peaks, mean_sq)
+
+    def track_silence(self, mean_sq):
+        """静音窗口的连续区间：只在状态切换处循环，次数与静音段数相当"""
+        quiet = 10 * np.log10(mean_sq + 1e-12) < self.silence_db
+        changes = np.flatnonzero(np.diff(np.concatenate(([self.was_quiet], quiet)).astype(np.int8)))
+        for i in changes.tolist():
+            if quiet[i]:
+                self.silence_start = self.windows + i
+            else:
+                self.close_silence(self.windows + i)
+        self.was_quiet = bool(quiet[-1])
+
+    def close_silence(self, end):
+        if self.silence_start is not None and end - self.silence_start >= self.min_windows:
+            self.silences.append([round(self.silence_start * WINDOW_SEC, 3), round(end * WINDOW_SEC, 3)])
+        self.silence_start = None
+
+    def add_bins(self, peaks, mean_sq):
+        peaks = np.concatenate((self.bin_carry[0], peaks))
+        mean_sq = np.concatenate((self.bin_carry[1], mean_sq))
+        usable = len(peaks) // self.bin_windows * self.bin_windows
+        self.bin_carry = (peaks[usable:], mean_sq[usable:])
+        if usable:
+            self.peaks += peaks[:usable].reshape(-1, self.bin_windows).max(axis=1).round(4).tolist()
+            self.rms += np.sqrt(mean_sq[:usable].reshape(-1, self.bin_windows).mean(axis=1)).round(4).tolist()
+
+    def finish(self, start_time=0.0):
+        if len(self.bin_carry[0]):
+            self.peaks.append(round(float(self.bin_carry[0].max()), 4))
+            self.rms.append(round(float(np.sqrt(self.bin_carry[1].mean())), 4))
+        if self.was_quiet:
+            self.close_silence(self.windows)
+        samples = self.windows * self.window + len(self.leftover)
+        return {
+            'duration': round(samples / ANALYSIS_RATE, 3),
+            'start_time': round(start_time, 6),
+            'peak_db': to_db(self.peak),
+            'rms_db': to_db(math.sqrt(self.sum_sq / samples)) if samples else -120.0,
+            'waveform': {'step': self.bin_windows * WINDOW_SEC, 'peak': self.peaks, 'rms': self.rms},
+            'silences': self.silences,
+        }
+
+def analyze(input_path, silence_db=SILENCE_DB, min_silence=MIN_SILENCE_SEC, on_progress=None):
+    """从ffmpeg管道逐块读取PCM，计算波形包络、峰值/RMS响度与静音段
+
+    返回 {'duration', 'start_time', 'peak_db', 'rms_db', 'waveform': {'step', 'peak', 'rms'}, 'silences': [[开始, 结束]]}，
+    静音段等时间从第一个音频采样起算；start_time 为该采样在ffmpeg滤镜中的时间（音频流相对容器起点的偏移）。
+    """
+    media_info = probe_media_info(input_path)
+    duration = media_duration(media_info)
+    audio = next((s for s in media_info.get('streams', []) if s.get('codec_type') == 'audio'), {})
+    try:
+        # ffmpeg 以容器起始时间为零点，音频流可能晚于（或因编码器延迟早于）容器起点
+        start_time = float(audio.get('start_time') or 0.0) - media_start_time(media_info)
+    except ValueError:
+        start_time = 0.0
+    tracker = LoudnessTracker(duration, silence_db, min_silence)
+    odd = b''  # 块边界可能切开一个16位采样
+    with stream(pcm_command(input_path), kind=ENCODE, merge_stderr=False, check=True, binary=True) as process:
+        for chunk in process:
+            data = odd + chunk
+            usable = len(data) // 2 * 2
+            odd = data[usable:]
+            tracker.feed(np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768)
+            if on_progress and duration:
+                on_progress(min(1.0, tracker.windows * WINDOW_SEC / duration))
+    return tracker.finish(start_time)
+
+def analyze_audio(input_path, silence_db=SILENCE_DB, min_silence=MIN_SILENCE_SEC, on_progress=None):
+    """同一文件、相同静音参数重复分析时直接复用结果"""
+    return media_cache.get_or_compute(
+        input_path, ["audio_analysis", 2, ANALYSIS_RATE, silence_db, min_silence],
+        lambda: analyze(input_path, silence_db, min_silence, on_progress)
+    )
+
+# ==================== 静音裁剪 ====================
+def trim_spans(analysis, internal=False, padding=KEEP_PADDING):
+    """要裁掉的区间：开头和结尾的静音，internal=True 时还包括中间的长静音
+
+    与有声部分相邻的一侧保留 padding 秒；整段都是静音时不裁剪。
+    """
+    duration = analysis['duration']
+    spans = []
+    for start, end in analysis['silences']:
+        head, tail = start <= WINDOW_SEC, end >= duration - WINDOW_SEC
+        if (head and tail) or not (head or tail or internal):
+            continue
+        cut_start = start if head else start + padding
+        cut_end = end if tail else end - padding
+        if cut_end - cut_start >= WINDOW_SEC:
+            spans.append([round(cut_start, 3), round(cut_end, 3)])
+    return spans
+
+def trim_filter(spans, start_time=0.0):
+    """在同一次编码中丢弃 spans 内的采样并重新生成时间戳，没有可裁剪区间时返回 None
+
+    spans 从第一个音频采样起算，aselect 的 t 是解码后的时间戳，两者相差分析结果中的 start_time。
+    """
+    if not spans:
+        return None
+    cut = '+'.join(f"between(t,{start + start_time:.6f},{end + start_time:.6f})" for start, end in spans)
+    return f"aselect='not({cut})',asetpts=N/SR/TB"
+
+# ==================== 页面组件 ====================
+def waveform_panel(uploaded_file):
+    """点击后分析音频并显示波形，返回用户选择的静音裁剪滤镜（不裁剪时为 None）"""
+    state_key = f"audio-analysis-{uploaded_file.file_id}"
+    if state_key not in st.session_state:
+        if not st.button("📈 分析音频波形与静音", key=f"{state_key}-button", use_container_width=True):
+            return None
+        progress_bar = st.progress(0.0, text="分析音频中...")
+        try:
+            input_path = stage_upload(uploaded_file)
+            with job_metrics.collect('audio_analysis', str(input_path)):
+                st.session_state[state_key] = analyze_audio(
+                    input_path, on_progress=lambda p: progress_bar.progress(p, text=f"分析音频中... {p:.0%}")
+                )
+        except Exception as e:
+            st.warning(f"音频分析失败: {e}")
+            return None
+        finally:
+            progress_bar.empty()
+
+    analysis = st.session_state[state_key]
+    waveform = analysis['waveform']
+    st.area_chart(
+        {"时间(秒)": [round(i * waveform['step'], 2) for i in range(len(waveform['peak']))],
+         "峰值": waveform['peak'], "RMS": waveform['rms']},
+        x="时间(秒)", height=180,
+    )
+    silent = sum(end - start for start, end in analysis['silences'])
+    st.caption(f"峰值 {analysis['peak_db']} dBFS · 平均响度(RMS) {analysis['rms_db']} dBFS · "
+               f"静音 {len(analysis['silences'])} 段，共 {silent:.1f} 秒")
+
+    mode = st.radio("静音裁剪", ["不裁剪", "裁掉首尾静音", "裁掉首尾及中间的长静音"],
+                    horizontal=True, key=f"{state_key}-trim")
+    if mode == "不裁剪":
+        return None
+    spans = trim_spans(analysis, internal=mode == "裁掉首尾及中间的长静音")
+    if not spans:
+        st.caption("未发现可裁剪的静音")
+        return None
+    removed = sum(end - start for start, end in spans)
+    st.caption(f"将在提取时裁掉 {len(spans)} 段共 {removed:.1f} 秒，输出约 {analysis['duration'] - removed:.1f} 秒")
+    return trim_filter(spans, analysis.get('start_time', 0.0))
@@ -1,7 +1,95 @@
-import subprocess
 import os
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.process.async_runner import run, stream, ProcessError, ENCODE
+from core.process.ffmpeg_capabilities import MP3_ENCODERS, pick_encoder
+
+STREAM_CHUNK = 256 * 1024  # 流式提取时每次写入stdin的块大小
+
+def mp3_copy_compatible(audio_stream, bitrate):
+    """源音频已经是目标比特率的MP3时可直接复制，无需重新编码"""
+    if not audio_stream or audio_stream.get('codec_name') != 'mp3':
+        return False
+    try:
+        source_kbps = round(int(audio_stream['bit_rate']) / 1000)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return source_kbps == int(bitrate.rstrip('kK'))
+
+def mp3_audio_args(bitrate='320k', audio_stream=None, audio_filter=None):
+    """单个MP3输出的音频参数（不含输入与输出路径）；带滤镜（如裁剪静音）时必须重新编码"""
+    if not audio_filter and mp3_copy_compatible(audio_stream, bitrate):
+        return ['-vn', '-c:a', 'copy']
+    encoder = pick_encoder(MP3_ENCODERS, "MP3")  # 优先LAME，缺失时提前报错而不是ffmpeg运行后才失败
+    args = [
+        '-vn',                    # 忽略视频流
+        '-acodec', encoder,
+        '-b:a', bitrate,          # 设置比特率
+    ]
+    if encoder == 'libmp3lame':
+        args += ['-q:a', '0']     # 最高质量（VBR模式）
+    if audio_filter:
+        args += ['-af', audio_filter]
+    return args
+
+def build_extract_command(input_path, output_path, bitrate='320k', audio_stream=None, audio_filter=None):
+    """构建MP3提取的FFmpeg命令，传入源音频流信息时可走流复制"""
+    return [
+        'ffmpeg',
+        '-y',                     # 覆盖已存在文件
+        '-i', str(input_path),
+        *mp3_audio_args(bitrate, audio_stream, audio_filter),
+        '-threads', '0',          # 自动多线程
+        '-loglevel', 'error',     # 仅显示错误信息
+        str(output_path)
+    ]
+
+def build_stream_extract_command(bitrate='320k', audio_filter=None):
+    """构建管道模式的提取命令：源数据从stdin读入，MP3帧写到stdout"""
+    return [
+        'ffmpeg',
+        '-loglevel', 'error',
+        '-i', 'pipe:0',
+        *mp3_audio_args(bitrate, audio_filter=audio_filter),
+        '-f', 'mp3',
+        'pipe:1'
+    ]
+
+def iter_source_chunks(source, chunk_size=STREAM_CHUNK):
+    """从文件对象或内存缓冲（bytes/memoryview）按块读取，不复制整个源"""
+    if hasattr(source, 'read'):
+        while chunk := source.read(chunk_size):
+            yield chunk
+        return
+    view = memoryview(source)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+def stream_extract(source, sink, bitrate='320k', on_progress=None, audio_filter=None, timeout=None):
+    """源数据经stdin送入ffmpeg，stdout产出的MP3帧边产生边写入 sink，全程不落临时文件
+
+    on_progress(已送入字节, 已写出字节) 在调用方线程中回调，抛出异常时终止ffmpeg；返回写出的总字节数。
+    """
+    fed = 0
+
+    def chunks():
+        nonlocal fed
+        for chunk in iter_source_chunks(source):
+            yield chunk
+            fed += len(chunk)
+
+    written = 0
+    with stream(build_stream_extract_command(bitrate, audio_filter), kind=ENCODE, timeout=timeout,
+                merge_stderr=False, check=True, stdin_chunks=chunks(), binary=True) as process:
+        for chunk in process:
+            sink.write(chunk)
+            written += len(chunk)
+            if on_progress:
+                on_progress(fed, written)
+    return written
+
 def main():
     # ==================== 用户配置区域 ====================
     # 输入文件路径（支持绝对路径或相对路径）
@@ -27,26 +115,15 @@ def main():
         print(f"已自动创建输出目录：{output_dir}")
 
     # FFmpeg转换命令
-    command = [
-        'ffmpeg',
-        '-y',                     # 覆盖已存在文件
-        '-i', input_video,
-        '-vn',                    # 忽略视频流
-        '-acodec', 'libmp3lame',  # 使用LAME编码器
-        '-b:a', audio_bitrate,    # 设置比特率
-        '-q:a', '0',              # 最高质量（VBR模式）
-        '-threads', '0',          # 自动多线程
-        '-loglevel', 'error',     # 仅显示错误信息
-        output_audio
-    ]
+    command = build_extract_command(input_video, output_audio, audio_bitrate)
 
     try:
         print(f"开始转换^_^~")
-        subprocess.run(command, check=True)
+        run(command, kind=ENCODE)
         print("转换成功！")
         print(f"输出文件大小：{os.path.getsize(output_audio)/1024/1024:.2f} MB")
-    except subprocess.CalledProcessError as e:
-        print(f"转换失败：{e.stderr.decode('utf-8')}")
+    except ProcessError as e:
+        print(f"转换失败：{e}")
     except Exception as e:
         print(f"发生未知错误：{str(e)}")
 
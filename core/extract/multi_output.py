@@ -0,0 +1,57 @@
+import importlib
+
+from core.extract.mp3_extract import mp3_audio_args, mp3_copy_compatible
+
+# flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载
+converter_module = importlib.import_module("core.convert.flv-to-mp4")
+
+MIME_TYPES = {'mp3': 'audio/mpeg', 'mp4': 'video/mp4'}
+
+# ==================== 输出规划 ====================
+def plan_outputs(output_dir, stem, bitrates=(), mp4_config=None, audio_filter=None):
+    """生成多输出任务的输出列表：每个比特率一个MP3，可选一个MP4
+
+    每项形如 {'format': 'mp3', 'bitrate': '320k', 'output_path': ...}
+    或 {'format': 'mp4', 'config': {...}, 'output_path': ...}；audio_filter 只作用于MP3。
+    """
+    outputs = [
+        {'format': 'mp3', 'bitrate': bitrate, 'output_path': str(output_dir / f"{stem}_{bitrate}.mp3")}
+        for bitrate in bitrates
+    ]
+    if audio_filter:
+        for output in outputs:
+            output['audio_filter'] = audio_filter
+    if mp4_config is not None:
+        suffix = "_PR.mp4" if mp4_config['pr_compat_mode'] else ".mp4"
+        outputs.append({'format': 'mp4', 'config': mp4_config, 'output_path': str(output_dir / f"{stem}{suffix}")})
+    return outputs
+
+def describe_output(output, media_info):
+    """单个输出的处理方式，用于任务摘要"""
+    if output['format'] == 'mp3':
+        audio_stream = next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+        if output.get('audio_filter'):
+            return f"MP3 {output['bitrate']}（已裁剪静音）"
+        if mp3_copy_compatible(audio_stream, output['bitrate']):
+            return f"MP3 {output['bitrate']}（直接复制音频流）"
+        return f"MP3 {output['bitrate']}"
+    return "MP4（PR兼容）" if output['config']['pr_compat_mode'] else "MP4（无损封装）"
+
+# ==================== 命令构建 ====================
+def build_multi_output_command(input_path, outputs, media_info):
+    """只解封装/解码一次，同时送入多个编码器和封装器
+
+    ffmpeg 对同一个输入流只创建一个解码器，各输出共享解码结果；
+    源音频已是目标比特率的MP3时该输出直接复制，不参与转码。
+    """
+    audio_stream = next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(input_path)]
+    for output in outputs:
+        if output['format'] == 'mp3':
+            cmd += mp3_audio_args(output['bitrate'], audio_stream, output.get('audio_filter'))
+        elif output['format'] == 'mp4':
+            cmd += converter_module.VideoConverter(output['config']).output_args(media_info)
+        else:
+            raise ValueError(f"不支持的输出格式: {output['format']}")
+        cmd.append(str(output['output_path']))
+    return cmd
@@ -0,0 +1,194 @@
+import bisect
+import heapq
+import statistics
+from collections import Counter
+
+from core.process.async_runner import stream, PROBE
+
+AAC_OBJECT_TYPES = {0x40, 0x66, 0x67, 0x68}  # esds 中 MPEG-4 / MPEG-2 AAC 的 objectTypeIndication
+MAX_ADTS_FRAME = 8191 - 7                    # ADTS帧长字段13位（含7字节头）
+PATTERN_SHARE = 0.99                         # 参考文件中至少这么多帧符合时才把该特征用于切分
+PREFIX_BYTES = 4                             # 比较帧开头这么多字节中所有参考帧都相同的位
+
+# ==================== 编码配置 ====================
+def read_descriptor(buf, pos):
+    """读取MPEG-4描述符头，返回 (标签, 内容开始, 长度)"""
+    tag, pos, length = buf[pos], pos + 1, 0
+    for _ in range(4):
+        byte, pos = buf[pos], pos + 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, pos, length
+
+def audio_specific_config(esds):
+    """esds 内容中的AAC AudioSpecificConfig；不是AAC时返回 None"""
+    try:
+        tag, pos, _ = read_descriptor(esds, 4)  # 跳过 version/flags
+        if tag != 0x03:
+            return None
+        flags, pos = esds[pos + 2], pos + 3
+        if flags & 0x80:
+            pos += 2
+        if flags & 0x40:
+            pos += 1 + esds[pos]
+        if flags & 0x20:
+            pos += 2
+        tag, pos, _ = read_descriptor(esds, pos)
+        if tag != 0x04 or esds[pos] not in AAC_OBJECT_TYPES:
+            return None
+        tag, pos, length = read_descriptor(esds, pos + 13)
+        return bytes(esds[pos:pos + length]) if tag == 0x05 and length >= 2 else None
+    except IndexError:
+        return None
+
+def adts_fields(config):
+    """ADTS头需要的 (profile, 采样率索引, 声道配置)；无法用ADTS表示时返回 None"""
+    object_type = config[0] >> 3
+    rate_index = ((config[0] & 7) << 1) | (config[1] >> 7)
+    channels = (config[1] >> 3) & 0x0F
+    if object_type in (5, 29):
+        object_type = 2  # HE-AAC：ADTS中按AAC-LC声明，SBR/PS由解码器隐式识别
+    if not 1 <= object_type <= 4 or rate_index > 12 or not 1 <= channels <= 7:
+        return None
+    return object_type - 1, rate_index, channels
+
+def frame_end_ok(buf, end):
+    """帧以 ID_END(111) 加补零字节对齐结束"""
+    word = (buf[end - 2] << 8) | buf[end - 1]
+    if not word & 0xFF:
+        return False  # 补零不超过7位，最后一个字节不会全为0
+    trailing = (word & -word).bit_length() - 1
+    return (word >> trailing) & 7 == 7
+
+# ==================== 帧切分 ====================
+class AacModel:
+    """从参考文件学习的AAC帧特征：帧开头的固定位（元素类型、保留位等）、帧尾对齐模式、帧大小分布与每块帧数
+
+    AAC帧没有同步字，只能靠这些特征在两个视频帧之间的数据中找出帧边界。
+    """
+
+    def __init__(self, mm, chunk_offsets, chunk_counts, sizes, config):
+        first_bytes, end_ok, total, frame = Counter(), 0, 0, 0
+        all_bits, any_bits = (1 << PREFIX_BYTES * 8) - 1, 0
+        for offset, count in zip(chunk_offsets, chunk_counts):
+            pos = offset
+            for size in sizes[frame:frame + count]:
+                if size < PREFIX_BYTES or pos + size > len(mm):
+                    break
+                first_bytes[mm[pos]] += 1
+                prefix = int.from_bytes(mm[pos:pos + PREFIX_BYTES], 'big')
+                all_bits &= prefix
+                any_bits |= prefix
+                end_ok += frame_end_ok(mm, pos + size)
+                total += 1
+                pos += size
+            frame += count
+        if not total:
+            raise ValueError("参考文件中没有可读取的音频帧")
+
+        self.first_bytes = set(first_bytes)
+        self.prefix_mask = ~(all_bits ^ any_bits) & ((1 << PREFIX_BYTES * 8) - 1)  # 所有参考帧都相同的位
+        self.prefix_value = all_bits & self.prefix_mask
+        self.check_end = end_ok >= total * PATTERN_SHARE
+        self.min_size = max(PREFIX_BYTES, min(sizes) // 2)  # 静音帧可能比参考文件中的帧小得多
+        self.max_size = min(MAX_ADTS_FRAME, max(sizes) * 3 // 2)
+        self.mean = statistics.fmean(sizes)
+        self.spread = max(1.0, statistics.pstdev(sizes))
+        self.max_count = max(chunk_counts) * 2  # 两个音频块之间可能没有视频帧
+        self.adts = adts_fields(config)
+
+    def is_frame_start(self, data, pos):
+        prefix = int.from_bytes(data[pos:pos + PREFIX_BYTES], 'big')
+        return data[pos] in self.first_bytes and prefix & self.prefix_mask == self.prefix_value
+
+    def is_boundary(self, data, pos):
+        return self.is_frame_start(data, pos) and (not self.check_end or frame_end_ok(data, pos))
+
+    def split(self, mm, start, end):
+        """把 [start, end) 切分为AAC帧，返回各帧大小；看起来不是完整的AAC帧序列时返回 None"""
+        found = self.segmentations(mm, start, end)
+        return found[0] if found else None
+
+    def segmentations(self, mm, start, end, limit=1):
+        """[start, end) 代价最小的前 limit 种AAC帧切分（各帧大小列表），不像完整的AAC帧序列时返回空列表
+
+        候选边界为符合帧开头固定位与上一帧帧尾特征的位置，代价为各帧大小与参考帧平均大小的偏差平方和。
+        """
+        length = end - start
+        if length < self.min_size or length > self.max_size * self.max_count:
+            return []
+        data = mm[start:end]
+        if not self.is_frame_start(data, 0) or (self.check_end and not frame_end_ok(data, length)):
+            return []
+
+        points = {0, length}
+        for value in self.first_bytes:
+            pos = data.find(value, self.min_size)
+            while 0 <= pos <= length - self.min_size:
+                if self.is_boundary(data, pos):
+                    points.add(pos)
+                pos = data.find(value, pos + 1)
+        points = sorted(points)
+
+        best = {0: [(0.0, None, 0, 0)]}  # 边界 -> [(代价, 上一个边界, 在上一个边界中的名次, 帧数)]
+        for point in points[1:]:
+            low = bisect.bisect_left(points, point - self.max_size)
+            high = bisect.bisect_right(points, point - self.min_size)
+            choices = []
+            for previous in points[low:high]:
+                step = ((point - previous - self.mean) / self.spread) ** 2
+                choices += [(cost + step, previous, rank, count + 1)
+                            for rank, (cost, _, _, count) in enumerate(best.get(previous, ()))]
+            if choices:
+                best[point] = heapq.nsmallest(limit, choices)
+
+        results = []
+        for rank, (_, _, _, count) in enumerate(best.get(length, ())):
+            if count > self.max_count:
+                continue
+            sizes, point = [], length
+            while point:
+                _, previous, previous_rank, _ = best[point][rank]
+                sizes.append(point - previous)
+                point, rank = previous, previous_rank
+            results.append(sizes[::-1])
+        return results
+
+    # ==================== 解码校验 ====================
+    def adts_header(self, size):
+        profile, rate_index, channels = self.adts
+        length = size + 7
+        return bytes((0xFF, 0xF1, (profile << 6) | (rate_index << 2) | (channels >> 2),
+                      ((channels & 3) << 6) | (length >> 11), (length >> 3) & 0xFF, ((length & 7) << 5) | 0x1F, 0xFC))
+
+    def verify(self, mm, chunks):
+        """chunks 为 [(块偏移, 各帧大小)]；给每帧加上ADTS头交给ffprobe解码
+
+        返回 {块序号: 解码失败的帧数}（只含有失败的块）；声道/采样率无法用ADTS表示时返回 None。
+        """
+        if self.adts is None:
+            return None
+        owners, pos = {}, 0  # ADTS流中的帧位置 -> 块序号
+        for i, (_, sizes) in enumerate(chunks):
+            for size in sizes:
+                owners[pos] = i
+                pos += size + 7
+        failures = Counter(owners.values())
+
+        def adts_chunks():
+            for offset, sizes in chunks:
+                parts = []
+                for size in sizes:
+                    parts += (self.adts_header(size), mm[offset:offset + size])
+                    offset += size
+                yield b''.join(parts)
+
+        cmd = ["ffprobe", "-v", "quiet", "-f", "aac", "-i", "pipe:0",
+               "-show_entries", "frame=pkt_pos", "-of", "csv=p=0"]
+        with stream(cmd, kind=PROBE, merge_stderr=False, stdin_chunks=adts_chunks()) as process:
+            for line in process:
+                value = line.strip().rstrip(b',')
+                if value.isdigit() and int(value) in owners:
+                    failures[owners.pop(int(value))] -= 1
+        return {i: count for i, count in failures.items() if count}
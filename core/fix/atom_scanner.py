@@ -0,0 +1,144 @@
+import mmap
+import os
+import struct
+
+# 可能出现在文件顶层的常见box类型，用于判断是否为ISO-BMFF(MP4/MOV)
+TOP_LEVEL_TYPES = {
+    b'ftyp', b'styp', b'moov', b'mdat', b'moof', b'mfra', b'free', b'skip',
+    b'wide', b'uuid', b'sidx', b'ssix', b'prft', b'emsg', b'meta', b'pdin',
+    b'pnot', b'junk',
+}
+
+# ==================== box 头解析 ====================
+def read_box_header(mm, offset, end):
+    """解析 offset 处的box头，返回 (类型, 总大小, 头长度)
+
+    size==1 时读取64位largesize，size==0 表示延伸到 end。
+    头部不完整时返回 None。
+    """
+    if end - offset < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', mm, offset)
+    header_len = 8
+    if size == 1:
+        if end - offset < 16:
+            return None
+        size, = struct.unpack_from('>Q', mm, offset + 8)
+        header_len = 16
+    elif size == 0:
+        size = end - offset
+    return box_type, size, header_len
+
+def is_printable_type(box_type):
+    return all(0x20 <= b <= 0x7e for b in box_type)
+
+def iter_boxes(mm, start, end):
+    """依次返回 [start, end) 范围内的 (类型, 偏移, 大小, 头长度)，遇到异常时停止"""
+    offset = start
+    while offset < end:
+        header = read_box_header(mm, offset, end)
+        if header is None:
+            return
+        box_type, size, header_len = header
+        yield box_type, offset, size, header_len
+        if size < header_len:
+            return
+        offset += size
+
+def stream_readable(buffer):
+    """ISO-BMFF文件能否顺序读取（管道输入）：moov必须出现在mdat之前
+
+    buffer 为文件开头的字节（bytes/memoryview），非ISO-BMFF格式一律返回 True。
+    """
+    end = len(buffer)
+    first = read_box_header(buffer, 0, end)
+    if first is None or first[0] not in TOP_LEVEL_TYPES:
+        return True
+    for box_type, offset, size, header_len in iter_boxes(buffer, 0, end):
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat' or size < header_len:
+            return False
+    return False
+
+# ==================== 结构扫描 ====================
+def finding(kind, message, offset=None):
+    return {'type': kind, 'message': message, 'offset': offset}
+
+def scan_mp4(path):
+    """只读取box头，检查MP4/MOV的容器结构
+
+    返回 {'is_isobmff', 'boxes', 'findings', 'fragments'}；
+    非ISO-BMFF文件 is_isobmff 为 False，findings 为空。
+    """
+    file_size = os.path.getsize(path)
+    report = {'is_isobmff': False, 'boxes': [], 'findings': [], 'fragments': 0}
+    if file_size < 8:
+        return report
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        first = read_box_header(mm, 0, file_size)
+        if first is None or first[0] not in TOP_LEVEL_TYPES:
+            return report
+        report['is_isobmff'] = True
+
+        boxes = report['boxes']
+        findings = report['findings']
+        offset = 0
+        for box_type, offset, size, header_len in iter_boxes(mm, 0, file_size):
+            name = box_type.decode('latin-1')
+            if not is_printable_type(box_type) or size < header_len:
+                findings.append(finding(
+                    'invalid box size',
+                    f"偏移 {offset} 处的box头无效（类型 {box_type!r}，大小 {size}）",
+                    offset
+                ))
+                break
+            if offset + size > file_size:
+                missing = offset + size - file_size
+                kind = 'truncated mdat' if box_type == b'mdat' else 'invalid box size'
+                findings.append(finding(
+                    kind,
+                    f"{name} box 声明 {size} 字节，但文件在其后缺少 {missing} 字节",
+                    offset
+                ))
+                boxes.append((name, offset, file_size - offset))
+                offset = file_size
+                break
+            boxes.append((name, offset, size))
+            offset += size
+        else:
+            if 0 < file_size - offset < 8:
+                findings.append(finding(
+                    'invalid box size',
+                    f"文件末尾有 {file_size - offset} 字节无法解析的残留数据",
+                    offset
+                ))
+
+        types = [b[0] for b in boxes]
+        report['fragments'] = types.count('moof')
+
+        if 'moov' not in types:
+            findings.append(finding('moov atom not found', "未找到 moov box（元数据缺失）"))
+        elif 'mdat' in types and types.index('moov') > types.index('mdat'):
+            moov_offset = boxes[types.index('moov')][1]
+            findings.append(finding(
+                'moov after mdat',
+                f"moov 位于 mdat 之后（偏移 {moov_offset}），需下载完整文件才能播放",
+                moov_offset
+            ))
+
+        if 'moov' in types:
+            _, moov_offset, moov_size = boxes[types.index('moov')]
+            header_len = read_box_header(mm, moov_offset, file_size)[2]
+            children = {t for t, *_ in iter_boxes(mm, moov_offset + header_len, moov_offset + moov_size)}
+            if b'mvex' in children or report['fragments']:
+                findings.append(finding(
+                    'fragmented mp4',
+                    f"分片MP4：{report['fragments']} 个 moof 片段，"
+                    f"{'有' if 'mfra' in types else '无'} mfra 随机访问索引"
+                ))
+            if b'trak' not in children:
+                findings.append(finding('invalid data', "moov 中没有任何 trak（轨道）", moov_offset))
+
+    return report
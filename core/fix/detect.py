@@ -0,0 +1,130 @@
+from core.cache.media_cache import media_cache
+from core.fix.atom_scanner import scan_mp4
+from core.fix import slice_scan
+from core.fix.timestamp_analyzer import analyze_timestamps
+
+# ==================== 错误分类 ====================
+ERROR_MAPPING = {
+    "moov atom not found": {
+        "description": "视频元数据损坏（moov原子缺失）",
+        "solution": "使用快速启动模式重新封装视频"
+    },
+    "invalid data": {
+        "description": "无效的视频数据",
+        "solution": "尝试重新编码视频流"
+    },
+    "corrupt": {
+        "description": "文件损坏",
+        "solution": "尝试修复容器格式"
+    },
+    "moov after mdat": {
+        "description": "moov位于文件末尾（非快速启动布局）",
+        "solution": "使用快速启动模式将moov移到文件开头"
+    },
+    "truncated mdat": {
+        "description": "媒体数据被截断（录制中断）",
+        "solution": "使用同设备录制的正常文件作为参考重建moov"
+    },
+    "invalid box size": {
+        "description": "容器结构损坏（box大小无效）",
+        "solution": "尝试修复容器格式"
+    },
+    "fragmented mp4": {
+        "description": "分片MP4（fMP4）布局",
+        "solution": "如需兼容旧播放器或剪辑软件，可重新封装为普通MP4"
+    },
+    "variable frame rate": {
+        "description": "可变帧率（VFR），剪辑软件中容易出现音画不同步",
+        "solution": "按平均帧率转换为恒定帧率（仅重新编码视频）"
+    },
+    "timestamp gap": {
+        "description": "时间戳断层（录制丢帧或信号中断）",
+        "solution": "视频按恒定帧率补帧，音频按时间戳补静音"
+    },
+    "duplicate timestamp": {
+        "description": "重复的时间戳",
+        "solution": "重新生成时间戳（视频按恒定帧率丢弃重复帧，音频重新对齐）"
+    },
+    "non-monotonic dts": {
+        "description": "解码时间戳倒退（非单调DTS）",
+        "solution": "重新生成时间戳（视频按恒定帧率重排，音频重新对齐）"
+    },
+    "av drift": {
+        "description": "音视频不同步（时长不一致或音频采样缺失）",
+        "solution": "音频按时间戳重新对齐，轻微的时钟漂移通过拉伸音频校正"
+    },
+    "bitrate spike": {
+        "description": "码率突增，可能导致播放卡顿或剪辑软件预览不流畅",
+        "solution": "以中位码率的2倍为上限重新编码视频"
+    }
+}
+
+UNKNOWN_ERROR = {"description": "未知错误", "solution": "建议重新录制或获取源文件"}
+
+# 可以通过重新封装（faststart）修复的错误类型
+REMUX_FIXABLE = {"moov atom not found", "moov after mdat"}
+
+# 录制中断导致moov缺失：需要参考文件重建moov（core/fix/moov_rebuild.py）
+REBUILD_FIXABLE = {"moov atom not found", "truncated mdat"}
+
+# 数据包时间戳分析发现的问题：只重新处理有问题的流（core/fix/timestamp_analyzer.py）
+TIMESTAMP_FIXABLE = {"variable frame rate", "timestamp gap", "duplicate timestamp", "non-monotonic dts",
+                     "av drift", "bitrate spike"}
+
+# ==================== 检测 ====================
+def detect_errors(input_path, max_errors=slice_scan.DEFAULT_MAX_ERRORS, on_progress=None):
+    """按关键帧切片并发完整解码检测视频错误，返回带时间与字节偏移的错误列表"""
+    def decode():
+        return slice_scan.deep_scan(input_path, max_errors=max_errors, on_progress=on_progress)['findings']
+
+    # 同一文件重复检测时直接复用结果，跳过整段解码
+    return media_cache.get_or_compute(input_path, ["deep_scan", 2, max_errors], decode)
+
+def classify_errors(findings):
+    """将ffmpeg错误输出按 ERROR_MAPPING 分类，保留时间、偏移与所在切片"""
+    processed_errors = []
+    for finding in findings:
+        err = finding['error']
+        key = next((key for key in ERROR_MAPPING if key in err.lower()), "unknown")
+        processed_errors.append({
+            "error": err.strip(),
+            "type": key,
+            "info": ERROR_MAPPING.get(key, UNKNOWN_ERROR),
+            "time": finding.get('time'),
+            "offset": finding.get('offset'),
+            "range": finding.get('range'),
+        })
+    return processed_errors
+
+def structural_errors(report):
+    """将box结构扫描结果映射为检测报告条目"""
+    return [{
+        "error": item['message'],
+        "type": item['type'],
+        "info": ERROR_MAPPING.get(item['type'], UNKNOWN_ERROR),
+        "offset": item.get('offset'),
+    } for item in report['findings']]
+
+def timestamp_errors(report):
+    """将数据包时间戳分析结果映射为检测报告条目，附带修复参数"""
+    return [{
+        "error": item['message'],
+        "type": item['type'],
+        "info": ERROR_MAPPING[item['type']],
+        "time": item.get('time'),
+        "repair": item['repair'],
+    } for item in report['findings']]
+
+def run_detection(input_path, deep_scan=False, max_errors=slice_scan.DEFAULT_MAX_ERRORS, on_progress=None,
+                  timestamps=False):
+    """结构扫描（毫秒级，仅MP4/MOV），可选完整解码的深度扫描与数据包时间戳分析
+
+    返回 (检测报告条目, 是否为MP4/MOV)
+    """
+    report = scan_mp4(input_path)
+    processed_errors = structural_errors(report)
+    if deep_scan:
+        processed_errors += classify_errors(detect_errors(input_path, max_errors, on_progress))
+    if timestamps:
+        processed_errors += timestamp_errors(analyze_timestamps(input_path, on_progress))
+    return processed_errors, report['is_isobmff']
@@ -0,0 +1,142 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from core.fix.atom_scanner import read_box_header, iter_boxes
+from core.process.async_runner import run, REMUX
+
+CHUNK_SIZE = 64 * 1024 * 1024  # 顺序复制/移动的块大小
+
+# 包含子box、需要递归查找 stco/co64 的容器类型
+CONTAINER_TYPES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+
+class FaststartUnsupported(Exception):
+    """文件布局无法原生处理，需要退回ffmpeg重新封装"""
+
+# ==================== 布局分析 ====================
+def find_layout(mm, file_size):
+    """返回 (第一个mdat偏移, moov偏移, moov大小)，moov已在mdat之前时返回None"""
+    boxes = []
+    for box_type, offset, size, header_len in iter_boxes(mm, 0, file_size):
+        if size < header_len or offset + size > file_size:
+            raise FaststartUnsupported(f"偏移 {offset} 处的 {box_type!r} box 大小无效")
+        boxes.append((box_type, offset, size))
+
+    types = [b[0] for b in boxes]
+    if b'moov' not in types or b'mdat' not in types:
+        raise FaststartUnsupported("缺少 moov 或 mdat")
+    if b'moof' in types:
+        raise FaststartUnsupported("分片MP4不适用")
+    if types.count(b'moov') > 1:
+        raise FaststartUnsupported("存在多个 moov")
+
+    _, moov_offset, moov_size = boxes[types.index(b'moov')]
+    mdat_offset = boxes[types.index(b'mdat')][1]
+    if moov_offset < mdat_offset:
+        return None
+    return mdat_offset, moov_offset, moov_size
+
+# ==================== 偏移修正 ====================
+def patch_chunk_offsets(moov, start, end, shift_begin, shift_end, delta):
+    """递归修正 moov 中所有 stco/co64 的块偏移
+
+    落在 [shift_begin, shift_end) 范围内的偏移加上 delta。
+    """
+    for box_type, offset, size, header_len in iter_boxes(moov, start, end):
+        if size < header_len or offset + size > end:
+            raise FaststartUnsupported(f"moov 内 {box_type!r} box 大小无效")
+        body = offset + header_len
+        if box_type in CONTAINER_TYPES:
+            patch_chunk_offsets(moov, body, offset + size, shift_begin, shift_end, delta)
+        elif box_type in (b'stco', b'co64'):
+            typecode, limit = ('I', 0xFFFFFFFF) if box_type == b'stco' else ('Q', 0xFFFFFFFFFFFFFFFF)
+            count, = struct.unpack_from('>I', moov, body + 4)
+            table_start = body + 8
+            table_end = table_start + count * array(typecode).itemsize
+            if table_end > offset + size:
+                raise FaststartUnsupported(f"{box_type!r} 条目数超出box范围")
+
+            entries = array(typecode, moov[table_start:table_end])
+            if sys.byteorder == 'little':
+                entries.byteswap()
+            for i, value in enumerate(entries):
+                if shift_begin <= value < shift_end:
+                    value += delta
+                    if value > limit:
+                        # stco 需要升级为 co64，会改变 moov 大小
+                        raise FaststartUnsupported("32位块偏移溢出")
+                    entries[i] = value
+            if sys.byteorder == 'little':
+                entries.byteswap()
+            moov[table_start:table_end] = entries.tobytes()
+
+def build_patched_moov(mm, mdat_offset, moov_offset, moov_size):
+    moov = bytearray(mm[moov_offset:moov_offset + moov_size])
+    header_len = read_box_header(moov, 0, moov_size)[2]
+    # [mdat_offset, moov_offset) 区间整体后移 moov_size 字节
+    patch_chunk_offsets(moov, header_len, moov_size, mdat_offset, moov_offset, moov_size)
+    return moov
+
+# ==================== 重定位 ====================
+def relocate_moov(input_path, output_path):
+    """将 moov 移到 mdat 之前并修正块偏移，不经过ffmpeg重新封装
+
+    按顺序大块写出新文件，原文件保持不变（原地移动在中途断电时会损坏原始录制）。
+    moov 已在前面时不做任何操作并返回 False。无法处理的布局抛出 FaststartUnsupported。
+    """
+    file_size = os.path.getsize(input_path)
+    if file_size < 8:
+        raise FaststartUnsupported("文件过小")
+
+    with open(input_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        layout = find_layout(mm, file_size)
+        if layout is None:
+            return False
+        mdat_offset, moov_offset, moov_size = layout
+        moov = build_patched_moov(mm, mdat_offset, moov_offset, moov_size)
+
+        view = memoryview(mm)
+        try:
+            with open(output_path, 'wb') as out:
+                segments = [(0, mdat_offset), None, (mdat_offset, moov_offset),
+                            (moov_offset + moov_size, file_size)]
+                for segment in segments:
+                    if segment is None:
+                        out.write(moov)
+                        continue
+                    for pos in range(segment[0], segment[1], CHUNK_SIZE):
+                        out.write(view[pos:min(pos + CHUNK_SIZE, segment[1])])
+        finally:
+            view.release()
+    return True
+
+# ==================== 修复入口 ====================
+def try_relocate(input_path, output_path):
+    """原生重定位，moov已在前面或布局无法处理时返回 False"""
+    try:
+        return relocate_moov(input_path, output_path)
+    except FaststartUnsupported:
+        return False
+
+def remux_command(input_path, output_path):
+    """原生重定位不适用时的ffmpeg重新封装命令"""
+    return [
+        "ffmpeg",
+        "-y",
+        "-i", str(input_path),
+        "-c", "copy",
+        "-movflags", "faststart",
+        str(output_path)
+    ]
+
+def fix_moov(input_path, output_path):
+    """修复moov原子缺失问题
+
+    moov 在 mdat 之后时原生重定位（只修正块偏移，不重新封装），
+    其余布局退回ffmpeg重新封装。
+    """
+    if try_relocate(input_path, output_path):
+        return
+    run(remux_command(input_path, output_path), kind=REMUX)  # 失败时抛出 ProcessError（RuntimeError 子类）
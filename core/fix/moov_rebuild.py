@@ -0,0 +1,599 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.fix.aac_frames import AacModel, audio_specific_config
+from core.fix.atom_scanner import iter_boxes
+from core.fix.picture_order import SLICE_HEADER_BYTES, frame_offsets, picture_order
+
+CHUNK_SIZE = 64 * 1024 * 1024     # 复制mdat时的块大小
+SCAN_LIMIT = 16 * 1024 * 1024     # 在非视频数据中向前搜索下一帧的最大距离
+PROGRESS_STEP = 64 * 1024 * 1024  # 每扫描多少字节回调一次进度
+AUDIO_FAILURE_LIMIT = 0.05        # 切分出的AAC帧解码失败超过这个比例时放弃音频
+AAC_ALTERNATIVES = 8              # 解码失败的音频块最多改用几种代价次优的切分重试
+
+VIDEO_CODECS = {b'avc1': False, b'avc3': False, b'hvc1': True, b'hev1': True}  # fourcc -> 是否HEVC
+
+class RebuildError(Exception):
+    """参考文件或损坏文件不满足重建条件"""
+
+# ==================== box 工具 ====================
+def find_box(buf, start, end, name):
+    """在 [start, end) 中查找第一个指定类型的box，返回 (偏移, 大小, 头长度)"""
+    for box_type, offset, size, header_len in iter_boxes(buf, start, end):
+        if box_type == name:
+            return offset, size, header_len
+        if size < header_len:
+            break
+    return None
+
+def find_path(buf, start, end, *names):
+    """按路径逐层查找，返回最后一层box的 (内容开始, 结束)"""
+    for name in names:
+        found = find_box(buf, start, end, name)
+        if found is None:
+            return None
+        offset, size, header_len = found
+        start, end = offset + header_len, offset + size
+    return start, end
+
+def raw_box(buf, start, end, name):
+    """返回box的完整字节（含头），不存在时返回 None"""
+    found = find_box(buf, start, end, name)
+    if found is None:
+        return None
+    offset, size, _ = found
+    return bytes(buf[offset:offset + size])
+
+def box(name, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+def full_box(name, version, flags, *payloads):
+    return box(name, struct.pack('>I', (version << 24) | flags), *payloads)
+
+def big_endian(values):
+    """array 转为大端字节（box中的表格均为大端）"""
+    values = array(values.typecode, values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values.tobytes()
+
+def read_table(buf, start, count, typecode):
+    values = array(typecode, buf[start:start + count * array(typecode).itemsize])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+# ==================== 参考文件 ====================
+class TrackModel:
+    """从参考文件学习到的单条轨道信息：编码配置、时间基准与样本布局"""
+
+    def __init__(self, moov, start, end):
+        tkhd_start, tkhd_end = find_path(moov, start, end, b'tkhd')
+        version = moov[tkhd_start]
+        self.tkhd_flags = struct.unpack_from('>I', moov, tkhd_start)[0] & 0xFFFFFF
+        self.track_id, = struct.unpack_from('>I', moov, tkhd_start + (20 if version else 12))
+        self.tkhd_rest = bytes(moov[tkhd_start + (36 if version else 24):tkhd_end])
+
+        mdia = find_path(moov, start, end, b'mdia')
+        mdhd_start, _ = find_path(moov, *mdia, b'mdhd')
+        version = moov[mdhd_start]
+        self.timescale, = struct.unpack_from('>I', moov, mdhd_start + (20 if version else 12))
+        self.language = bytes(moov[mdhd_start + (32 if version else 20):][:4])
+        self.hdlr = raw_box(moov, *mdia, b'hdlr')
+        self.handler = self.hdlr[16:20]  # 头8 + version/flags 4 + pre_defined 4
+
+        minf = find_path(moov, *mdia, b'minf')
+        self.media_header = raw_box(moov, *minf, b'vmhd') or raw_box(moov, *minf, b'smhd')
+        self.dinf = raw_box(moov, *minf, b'dinf')
+        stbl = find_path(moov, *minf, b'stbl')
+        self.stsd = raw_box(moov, *stbl, b'stsd')
+        self.codec = self.stsd[20:24]
+        self.has_ctts = find_path(moov, *stbl, b'ctts') is not None  # 有合成时间偏移（B帧）
+
+        stts_start, _ = find_path(moov, *stbl, b'stts')
+        count, = struct.unpack_from('>I', moov, stts_start + 4)
+        entries = read_table(moov, stts_start + 8, count * 2, 'I')
+        deltas = Counter({entries[i + 1]: entries[i] for i in range(0, len(entries), 2)})
+        self.sample_delta = deltas.most_common(1)[0][0] if deltas else 1
+
+        stsz_start, _ = find_path(moov, *stbl, b'stsz')
+        self.sample_size, sample_count = struct.unpack_from('>II', moov, stsz_start + 4)
+        sizes = read_table(moov, stsz_start + 12, sample_count, 'I') if self.sample_size == 0 else []
+        self.sample_sizes = sizes
+        self.max_sample_size = max(sizes) if sizes else self.sample_size
+
+        stsc_start, _ = find_path(moov, *stbl, b'stsc')
+        count, = struct.unpack_from('>I', moov, stsc_start + 4)
+        self.stsc = read_table(moov, stsc_start + 8, count * 3, 'I')
+
+        co = find_path(moov, *stbl, b'stco')
+        typecode = 'I'
+        if co is None:
+            co, typecode = find_path(moov, *stbl, b'co64'), 'Q'
+        count, = struct.unpack_from('>I', moov, co[0] + 4)
+        self.chunk_offsets = read_table(moov, co[0] + 8, count, typecode)
+
+        self.nal_length_size = None
+        self.codec_config = None
+        self.hevc = VIDEO_CODECS.get(self.codec)
+        if self.handler == b'vide' and self.hevc is not None:
+            self.codec_config = self._video_config()
+            self.nal_length_size = (self.codec_config[21 if self.hevc else 4] & 3) + 1
+
+    def _video_config(self):
+        """avcC/hvcC 的内容（NAL长度字段字节数与SPS/PPS）"""
+        entry_start = 16                     # stsd: 头8 + version/flags 4 + 条目数 4
+        children = entry_start + 8 + 78      # VisualSampleEntry 固定字段之后是子box
+        entry_end = entry_start + struct.unpack_from('>I', self.stsd, entry_start)[0]
+        config = find_path(self.stsd, children, entry_end, b'hvcC' if self.hevc else b'avcC')
+        if config is None:
+            raise RebuildError("参考文件缺少 avcC/hvcC 编码配置")
+        return self.stsd[config[0]:config[1]]
+
+    def audio_config(self):
+        """AAC的 AudioSpecificConfig；不是AAC时返回 None"""
+        if self.codec != b'mp4a':
+            return None
+        entry_start = 16
+        version, = struct.unpack_from('>H', self.stsd, entry_start + 16)
+        children = entry_start + {1: 52, 2: 72}.get(version, 36)  # QuickTime声音描述 v1/v2 的固定字段更长
+        entry_end = entry_start + struct.unpack_from('>I', self.stsd, entry_start)[0]
+        esds = (find_path(self.stsd, children, entry_end, b'esds')
+                or find_path(self.stsd, children, entry_end, b'wave', b'esds'))
+        return audio_specific_config(self.stsd[esds[0]:esds[1]]) if esds else None
+
+    def picture_order(self):
+        """新的POC计算器，无法从SPS/PPS解析时返回 None"""
+        return picture_order(self.codec_config, self.hevc)
+
+    def chunk_sample_counts(self):
+        """每个块包含的样本数（展开 stsc）"""
+        counts = []
+        entries = [tuple(self.stsc[i:i + 3]) for i in range(0, len(self.stsc), 3)]
+        for i, (first_chunk, per_chunk, _) in enumerate(entries):
+            last_chunk = entries[i + 1][0] - 1 if i + 1 < len(entries) else len(self.chunk_offsets)
+            counts += [per_chunk] * max(0, last_chunk - first_chunk + 1)
+        return counts
+
+class ReferenceModel:
+    """健康的参考文件（同一设备/编码器录制）：ftyp、mvhd 以及视频/音频轨道
+
+    video_only=True 时不恢复音频，参考文件的音频块大小只用于跳过音频数据。
+    音频为AAC时从参考文件的音频帧学习帧边界特征（见 AacModel）。
+    """
+
+    def __init__(self, path, video_only=False):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            self.ftyp = raw_box(mm, 0, size, b'ftyp')
+            moov = raw_box(mm, 0, size, b'moov')
+            mdat = find_box(mm, 0, size, b'mdat')
+        if moov is None or mdat is None:
+            raise RebuildError("参考文件必须是包含 moov 的完整MP4/MOV")
+        self.mdat_end = mdat[0] + mdat[1]
+
+        mvhd_start, mvhd_end = find_path(moov, 8, len(moov), b'mvhd')
+        version = moov[mvhd_start]
+        self.timescale, = struct.unpack_from('>I', moov, mvhd_start + (20 if version else 12))
+        self.mvhd_rest = bytes(moov[mvhd_start + (32 if version else 20):mvhd_end])
+
+        tracks = [TrackModel(moov, offset + header_len, offset + size)
+                  for box_type, offset, size, header_len in iter_boxes(moov, 8, len(moov)) if box_type == b'trak']
+        self.video = next((t for t in tracks if t.handler == b'vide'), None)
+        self.audio = next((t for t in tracks if t.handler == b'soun'), None)
+        if self.video is None or self.video.nal_length_size is None:
+            codec = self.video.codec.decode('latin-1') if self.video else '无'
+            raise RebuildError(f"参考文件的视频编码（{codec}）不支持，仅支持H.264/HEVC")
+        if self.video.has_ctts and self.video.picture_order() is None:
+            # 显示顺序要从切片头的POC推算，SPS缺失或POC类型为1时无法计算
+            raise RebuildError("参考文件的视频含B帧，但无法从编码配置的SPS/PPS推算显示顺序（仅支持POC类型0/2），暂不支持")
+
+        self.aac = None
+        if self.audio is not None and self.audio.sample_size == 0 and not video_only:
+            config = self.audio.audio_config()
+            if config is None:
+                codec = self.audio.codec.decode('latin-1')
+                raise RebuildError(f"参考文件的音频为非定长编码（{codec}），只支持AAC与PCM；可选择只恢复视频")
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                try:
+                    self.aac = AacModel(mm, self.audio.chunk_offsets, self.audio.chunk_sample_counts(),
+                                        self.audio.sample_sizes, config)
+                except ValueError as e:
+                    raise RebuildError(str(e))
+
+        self.video_only = video_only
+        self.audio_unit = None   # 每个音频样本的字节数，只有定长样本（PCM）可恢复
+        self.audio_hint = None   # 参考文件中最常见的音频块字节数，用于快速跳过音频块
+        self.audio_skip = 1      # 参考文件中最小的音频块字节数，搜索下一帧时从这里开始
+        if self.audio is not None:
+            self._learn_audio_layout(tracks)
+
+    def _learn_audio_layout(self, tracks):
+        """根据参考文件中音频块到下一个块的距离，推算音频块大小与（定长样本时）每个样本的字节数"""
+        boundaries = sorted({offset for t in tracks for offset in t.chunk_offsets} | {self.mdat_end})
+        units, chunk_bytes = Counter(), Counter()
+        for offset, count in zip(self.audio.chunk_offsets, self.audio.chunk_sample_counts()):
+            index = boundaries.index(offset)
+            if index + 1 < len(boundaries) and count:
+                length = boundaries[index + 1] - offset
+                chunk_bytes[length] += 1
+                if length % count == 0:
+                    units[length // count] += 1
+        if chunk_bytes:
+            self.audio_hint = chunk_bytes.most_common(1)[0][0]
+            self.audio_skip = max(1, min(chunk_bytes))
+        if units and self.audio.sample_size > 0 and not self.video_only:
+            self.audio_unit = units.most_common(1)[0][0]
+
+# ==================== 损坏文件扫描 ====================
+class VideoParser:
+    """解析长度前缀（AVCC/HVCC）格式的NAL单元，识别一帧的边界与是否关键帧"""
+
+    def __init__(self, track):
+        self.length_size = track.nal_length_size
+        self.hevc = track.hevc
+        self.max_nal = max(track.max_sample_size * 4, 1024 * 1024)
+
+    def nal_info(self, mm, pos):
+        """返回 (是否切片, 是否帧内第一个切片, 是否关键帧, 是否新访问单元的前缀NAL)，无效时返回 None"""
+        header = mm[pos]
+        if header & 0x80:
+            return None
+        if self.hevc:
+            nal_type = (header >> 1) & 0x3F
+            if nal_type > 40 or mm[pos + 1] & 0x07 == 0:
+                return None
+            is_slice = nal_type <= 21
+            return is_slice, is_slice and bool(mm[pos + 2] & 0x80), 16 <= nal_type <= 21, nal_type in (32, 33, 34, 35, 39)
+
+        nal_type, ref_idc = header & 0x1F, header & 0x60
+        if nal_type == 0 or nal_type >= 24:
+            return None
+        if (nal_type in (5, 7, 8) and not ref_idc) or (nal_type in (6, 9, 10, 11, 12) and ref_idc):
+            return None
+        is_slice = nal_type in (1, 5)
+        return is_slice, is_slice and bool(mm[pos + 1] & 0x80), nal_type == 5, nal_type in (6, 7, 8, 9)
+
+    def read_sample(self, mm, pos, end):
+        """从 pos 读取一帧，返回 (帧结束位置, 是否关键帧, 第一个切片NAL的(位置, 长度))；不是有效的视频帧时返回 (None, False, None)"""
+        n = self.length_size
+        cursor, seen_slice, keyframe, first_nal = pos, False, False, None
+        while cursor + n + 3 <= end:
+            length = int.from_bytes(mm[cursor:cursor + n], 'big')
+            if length < 3 or length > self.max_nal or cursor + n + length > end:
+                break
+            info = self.nal_info(mm, cursor + n)
+            if info is None:
+                break
+            is_slice, first_slice, is_key, starts_unit = info
+            if seen_slice and (first_slice or starts_unit):
+                break  # 下一帧开始
+            if not seen_slice and is_slice and not first_slice:
+                return None, False, None
+            if is_slice and not seen_slice:
+                first_nal = (cursor + n, length)
+            seen_slice = seen_slice or is_slice
+            keyframe = keyframe or is_key
+            cursor += n + length
+        return (cursor, keyframe, first_nal) if seen_slice else (None, False, None)
+
+    def is_sample_start(self, mm, pos, end, hint=None):
+        """pos 处是一帧的开头，且其后紧跟另一帧、一个参考大小的音频块后的帧或数据末尾（降低误判）"""
+        sample_end = self.read_sample(mm, pos, end)[0]
+        if sample_end is None:
+            return False
+        if sample_end >= end - self.length_size - 3 or self.read_sample(mm, sample_end, end)[0] is not None:
+            return True
+        return bool(hint) and self.read_sample(mm, sample_end + hint, end)[0] is not None
+
+    def find_next_sample(self, mm, pos, end, hint=None):
+        """逐字节向前搜索下一帧；NAL长度上限小于16MB时高位字节必为0，可用 find 快速跳过"""
+        limit = min(end, pos + SCAN_LIMIT)
+        fast = self.length_size == 4 and self.max_nal < 1 << 24
+        while pos < limit:
+            if fast:
+                pos = mm.find(b'\x00', pos, limit)
+                if pos < 0:
+                    return None
+            if self.is_sample_start(mm, pos, end, hint):
+                return pos
+            pos += 1
+        return None
+
+def locate_mdat(mm, file_size):
+    """返回损坏文件中mdat数据的 (开始, 结束)；录制中断时mdat大小常为0或未回写，按延伸到文件末尾处理"""
+    for box_type, offset, size, header_len in iter_boxes(mm, 0, file_size):
+        if box_type == b'mdat':
+            end = offset + size if header_len < size <= file_size - offset else file_size
+            return offset + header_len, end
+        if size < header_len or box_type == b'moov':
+            break
+    raise RebuildError("损坏文件中找不到 mdat 数据")
+
+def scan_mdat(mm, start, end, reference, on_progress=None):
+    """顺序扫描mdat，建立视频帧与音频块索引（只保存偏移与大小，内存与样本数成正比）
+
+    每帧顺带解析第一个切片头的POC，用于生成B帧的合成时间偏移（ctts）。
+    """
+    parser = VideoParser(reference.video)
+    order = reference.video.picture_order()
+    audio_unit, aac = reference.audio_unit, reference.aac
+    video_offsets, video_sizes, keyframes = array('Q'), array('I'), array('I')
+    pocs, poc_restarts = array('i'), array('I')
+    audio_offsets, audio_counts, audio_sizes = array('Q'), array('I'), array('I')
+    skipped = 0
+    data_end = start
+    next_report = start + PROGRESS_STEP
+
+    pos = start
+    while pos < end:
+        if on_progress and pos >= next_report:
+            on_progress((pos - start) / (end - start))
+            next_report = pos + PROGRESS_STEP
+
+        sample_end, keyframe, first_nal = parser.read_sample(mm, pos, end)
+        if sample_end is not None:
+            video_offsets.append(pos)
+            video_sizes.append(sample_end - pos)
+            if keyframe:
+                keyframes.append(len(video_offsets))  # stss 从1开始
+            if order is not None:
+                nal_pos, nal_length = first_nal
+                try:
+                    restart, poc = order.picture(mm[nal_pos:nal_pos + min(nal_length, SLICE_HEADER_BYTES)])
+                except (IndexError, KeyError, ValueError):
+                    restart, poc = False, (pocs[-1] + 1 if pocs else 0)  # 切片头无法解析：按解码顺序显示
+                if restart:
+                    poc_restarts.append(len(pocs))
+                pocs.append(poc)
+            pos = data_end = sample_end
+            continue
+
+        # 非视频数据（音频块或损坏数据）：先按参考文件的音频块大小跳转，
+        # 失败再从最小的音频块大小处开始逐字节搜索，不在音频块内部逐字节尝试
+        hint = reference.audio_hint
+        if hint and pos + hint <= end and (pos + hint == end or parser.read_sample(mm, pos + hint, end)[0]):
+            next_pos = pos + hint
+        else:
+            next_pos = parser.find_next_sample(mm, pos + reference.audio_skip, end, hint)
+        if next_pos is None:
+            break  # 剩余数据无法识别，通常是中断时写了一半的尾部
+
+        gap = next_pos - pos
+        if audio_unit and gap % audio_unit == 0:
+            audio_offsets.append(pos)
+            audio_counts.append(gap // audio_unit)
+            data_end = next_pos
+        elif aac is not None and (frames := aac.split(mm, pos, next_pos)) is not None:
+            audio_offsets.append(pos)
+            audio_counts.append(len(frames))
+            audio_sizes.extend(frames)
+            data_end = next_pos
+        else:
+            skipped += gap
+        pos = next_pos
+
+    # 末尾可能截断在一帧中间：最后一帧之后的数据不保留
+    return {
+        'video_offsets': video_offsets, 'video_sizes': video_sizes, 'keyframes': keyframes,
+        'pocs': pocs, 'poc_restarts': poc_restarts,
+        'audio_offsets': audio_offsets, 'audio_counts': audio_counts, 'audio_sizes': audio_sizes,
+        'data_end': data_end, 'skipped_bytes': skipped + (end - pos),
+    }
+
+# ==================== moov 生成 ====================
+def chunk_offset_box(offsets):
+    if offsets and max(offsets) > 0xFFFFFFFF:
+        return full_box(b'co64', 0, 0, struct.pack('>I', len(offsets)), big_endian(array('Q', offsets)))
+    return full_box(b'stco', 0, 0, struct.pack('>I', len(offsets)), big_endian(array('I', offsets)))
+
+def composition_box(index, sample_delta):
+    """按POC推算的显示顺序生成ctts，返回 (ctts, 显示延迟)；显示顺序与解码顺序相同时返回 (None, 0)
+
+    偏移统一加上最大的提前量使其非负（version 0），再由编辑列表把显示起点移回0。
+    """
+    offsets = frame_offsets(index['pocs'], index['poc_restarts'])
+    if not any(offsets):
+        return None, 0
+    delay = -min(offsets)
+    entries = array('I')
+    for offset in offsets:
+        value = (offset + delay) * sample_delta
+        if entries and entries[-1] == value:
+            entries[-2] += 1
+        else:
+            entries.extend((1, value))
+    return full_box(b'ctts', 0, 0, struct.pack('>I', len(entries) // 2), big_endian(entries)), delay * sample_delta
+
+def build_trak(track, movie_timescale, sample_count, stbl_tables, media_time=0):
+    """media_time 不为0时加编辑列表，从该媒体时间开始显示"""
+    media_duration = sample_count * track.sample_delta
+    movie_duration = media_duration * movie_timescale // track.timescale
+    stbl = box(b'stbl', track.stsd,
+               full_box(b'stts', 0, 0, struct.pack('>III', 1, sample_count, track.sample_delta)),
+               *stbl_tables)
+    edts = []
+    if media_time:
+        edts.append(box(b'edts', full_box(b'elst', 1, 0, struct.pack('>IQqhh', 1, movie_duration, media_time, 1, 0))))
+    return box(
+        b'trak',
+        full_box(b'tkhd', 1, track.tkhd_flags,
+                 struct.pack('>QQIIQ', 0, 0, track.track_id, 0, movie_duration), track.tkhd_rest),
+        *edts,
+        box(b'mdia',
+            full_box(b'mdhd', 1, 0, struct.pack('>QQIQ', 0, 0, track.timescale, media_duration), track.language),
+            track.hdlr,
+            box(b'minf', track.media_header, track.dinf, stbl)),
+    ), movie_duration
+
+def build_moov(reference, index, delta):
+    """按扫描结果生成新的moov，返回 (moov, 是否写入了ctts)；delta 为数据在新文件中的偏移变化"""
+    video = reference.video
+    count = len(index['video_sizes'])
+    offsets = array('Q', (o + delta for o in index['video_offsets']))
+    ctts, media_time = composition_box(index, video.sample_delta) if index['pocs'] else (None, 0)
+    tables = [ctts] if ctts else []
+    video_trak, duration = build_trak(video, reference.timescale, count, tables + [
+        full_box(b'stss', 0, 0, struct.pack('>I', len(index['keyframes'])), big_endian(index['keyframes'])),
+        full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, 1, 1)),
+        full_box(b'stsz', 0, 0, struct.pack('>II', 0, count), big_endian(index['video_sizes'])),
+        chunk_offset_box(offsets),
+    ], media_time)
+    traks = [video_trak]
+
+    audio_samples = sum(index['audio_counts'])
+    if audio_samples:
+        # 每块样本数变化时才新增一条 stsc
+        stsc = array('I')
+        for chunk, per_chunk in enumerate(index['audio_counts'], 1):
+            if not stsc or stsc[-2] != per_chunk:
+                stsc.extend((chunk, per_chunk, 1))
+        if index['audio_sizes']:  # AAC：逐帧大小
+            stsz = full_box(b'stsz', 0, 0, struct.pack('>II', 0, audio_samples), big_endian(index['audio_sizes']))
+        else:
+            stsz = full_box(b'stsz', 0, 0, struct.pack('>II', reference.audio.sample_size, audio_samples))
+        audio_trak, audio_duration = build_trak(reference.audio, reference.timescale, audio_samples, [
+            full_box(b'stsc', 0, 0, struct.pack('>I', len(stsc) // 3), big_endian(stsc)),
+            stsz,
+            chunk_offset_box(array('Q', (o + delta for o in index['audio_offsets']))),
+        ])
+        traks.append(audio_trak)
+        duration = max(duration, audio_duration)
+
+    mvhd = full_box(b'mvhd', 1, 0, struct.pack('>QQIQ', 0, 0, reference.timescale, duration), reference.mvhd_rest)
+    return box(b'moov', mvhd, *traks), ctts is not None
+
+def verify_audio(mm, reference, index):
+    """用ffprobe解码切分出的AAC帧，解码失败的块改用代价次优的切分再校验一次
+
+    返回最终解码失败的帧数（index 中的音频切分随之更新）；不是AAC或无法校验时返回 None。
+    """
+    aac = reference.aac
+    if aac is None or not index['audio_sizes']:
+        return None
+    chunks, frame = [], 0
+    for offset, count in zip(index['audio_offsets'], index['audio_counts']):
+        chunks.append((offset, index['audio_sizes'][frame:frame + count]))
+        frame += count
+    try:
+        failures = aac.verify(mm, chunks)
+        if failures is None:
+            return None
+        retries = []  # (块序号, 候选切分)
+        for i in failures:
+            offset, sizes = chunks[i]
+            retries += [(i, sizes) for sizes in aac.segmentations(mm, offset, offset + sum(sizes), AAC_ALTERNATIVES)[1:]]
+        retry_failures = aac.verify(mm, [(chunks[i][0], sizes) for i, sizes in retries]) if retries else {}
+    except OSError:  # 找不到ffprobe
+        return None
+
+    for k, (i, sizes) in enumerate(retries):
+        if i in failures and k not in retry_failures:
+            chunks[i] = (chunks[i][0], sizes)
+            del failures[i]
+    index['audio_counts'] = array('I', (len(sizes) for _, sizes in chunks))
+    index['audio_sizes'] = array('I', (size for _, sizes in chunks for size in sizes))
+    return sum(failures.values())
+
+# ==================== 重建入口 ====================
+def rebuild_moov(broken_path, reference_path, output_path, on_progress=None, video_only=False):
+    """用参考文件重建缺失moov的录制文件
+
+    通过mmap顺序扫描损坏文件的mdat，识别视频帧（H.264/HEVC）与音频块（PCM按定长样本，AAC按学习到的帧特征切分），
+    写出 ftyp + mdat(原始数据) + 新moov。内存占用只与样本数有关，与文件大小无关。
+    B帧的显示顺序由各帧切片头的POC推算（ctts + 编辑列表）。AAC帧切分后用ffprobe解码校验，
+    失败帧超过 AUDIO_FAILURE_LIMIT 时放弃音频（'audio' 为 'rejected'），只输出视频。
+    参考文件的SPS无法推算显示顺序，或音频为AAC/PCM之外的非定长编码且未指定 video_only 时，扫描前即抛出 RebuildError。
+    先写入同目录的临时文件，完成后原子替换到 output_path。
+    on_progress(比例) 可抛出异常以中止。返回恢复统计。
+    """
+    reference = ReferenceModel(reference_path, video_only)
+    file_size = os.path.getsize(broken_path)
+    if file_size < 16:
+        raise RebuildError("损坏文件过小")
+
+    with open(broken_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, end = locate_mdat(mm, file_size)
+        index = scan_mdat(mm, start, end, reference, on_progress)
+        if not index['video_sizes']:
+            raise RebuildError("未能在损坏文件中识别出视频帧，参考文件可能不是同一设备/编码设置录制的")
+
+        failed_frames = verify_audio(mm, reference, index)
+        rejected = failed_frames is not None and failed_frames > len(index['audio_sizes']) * AUDIO_FAILURE_LIMIT
+        if rejected:  # 帧边界找错了，输出的音频只会是噪声
+            for key in ('audio_offsets', 'audio_counts', 'audio_sizes'):
+                del index[key][:]
+
+        ftyp = reference.ftyp or b''
+        mdat_header_len = 16  # 总是使用64位大小，支持超过4GB的mdat
+        delta = len(ftyp) + mdat_header_len - start
+        moov, reordered = build_moov(reference, index, delta)
+
+        tmp_path = Path(output_path).with_name(f".{Path(output_path).name}.{os.getpid()}.tmp")
+        view = memoryview(mm)
+        try:
+            with open(tmp_path, 'wb') as out:
+                out.write(ftyp)
+                out.write(struct.pack('>I4sQ', 1, b'mdat', mdat_header_len + index['data_end'] - start))
+                for pos in range(start, index['data_end'], CHUNK_SIZE):
+                    out.write(view[pos:min(pos + CHUNK_SIZE, index['data_end'])])
+                out.write(moov)
+            os.replace(tmp_path, output_path)  # 中途失败不会留下不完整的输出
+        finally:
+            view.release()
+            tmp_path.unlink(missing_ok=True)
+
+    video = reference.video
+    audio_samples = sum(index['audio_counts'])
+    if reference.audio is None:
+        audio_status = 'none'
+    elif rejected:
+        audio_status = 'rejected'
+    else:
+        audio_status = 'recovered' if audio_samples else 'dropped'
+    if on_progress:
+        on_progress(1.0)
+    return {
+        'recovered_seconds': round(len(index['video_sizes']) * video.sample_delta / video.timescale, 2),
+        'video_frames': len(index['video_sizes']),
+        'keyframes': len(index['keyframes']),
+        'reordered': reordered,
+        'audio_samples': audio_samples,
+        'audio': audio_status,
+        'audio_failed_frames': failed_frames,
+        'skipped_bytes': index['skipped_bytes'],
+        'output_size': os.path.getsize(output_path),
+    }
+
+# ==================== 命令行入口 ====================
+def main():
+    parser = argparse.ArgumentParser(description="用参考文件重建录制中断（缺失moov）的MP4/MOV")
+    parser.add_argument("broken", help="损坏的录制文件")
+    parser.add_argument("reference", help="同一设备/编码设置录制的完好文件")
+    parser.add_argument("-o", "--output", help="输出路径（默认在损坏文件旁生成 _rebuilt 文件）")
+    parser.add_argument("--video-only", action="store_true", help="只恢复视频，不恢复音频")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.broken).with_name(Path(args.broken).stem + "_rebuilt.mp4"))
+    try:
+        stats = rebuild_moov(args.broken, args.reference, output,
+                             on_progress=lambda p: print(f"\r扫描进度 {p:.0%}", end='', flush=True),
+                             video_only=args.video_only)
+    except RebuildError as e:
+        print(f"\n重建失败：{e}")
+        return 1
+    failed = f"，{stats['audio_failed_frames']} 个AAC帧解码失败" if stats['audio_failed_frames'] else ""
+    print(f"\n已恢复 {stats['recovered_seconds']} 秒（{stats['video_frames']} 帧，{stats['keyframes']} 个关键帧），"
+          f"音频: {stats['audio']}{failed}，输出: {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+from array import array
+
+SLICE_HEADER_BYTES = 64  # 解析POC只需要切片头开头的这些字节
+
+# ==================== 位读取 ====================
+def rbsp(data):
+    """去除防竞争字节（00 00 03 -> 00 00）"""
+    return bytes(data).replace(b'\x00\x00\x03', b'\x00\x00')
+
+class BitReader:
+    """按位读取RBSP，越界时抛出 IndexError"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u(self, bits):
+        value = 0
+        for _ in range(bits):
+            value = (value << 1) | ((self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self):
+        """无符号指数哥伦布码"""
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("无效的指数哥伦布码")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+    def skip(self, bits):
+        self.pos += bits
+
+# ==================== 编码配置中的参数集 ====================
+def avcc_parameter_sets(config):
+    """avcC 内容中的 (SPS列表, PPS列表)"""
+    pos, sets = 5, []
+    for mask in (0x1F, 0xFF):
+        count, pos = config[pos] & mask, pos + 1
+        units = []
+        for _ in range(count):
+            length = int.from_bytes(config[pos:pos + 2], 'big')
+            units.append(bytes(config[pos + 2:pos + 2 + length]))
+            pos += 2 + length
+        sets.append(units)
+    return sets
+
+def hvcc_parameter_sets(config):
+    """hvcC 内容中的参数集，按NAL类型分组"""
+    pos, sets = 23, {}
+    for _ in range(config[22]):
+        nal_type, count = config[pos] & 0x3F, int.from_bytes(config[pos + 1:pos + 3], 'big')
+        pos += 3
+        for _ in range(count):
+            length = int.from_bytes(config[pos:pos + 2], 'big')
+            sets.setdefault(nal_type, []).append(bytes(config[pos + 2:pos + 2 + length]))
+            pos += 2 + length
+    return sets
+
+def next_msb(lsb, prev_lsb, prev_msb, max_lsb):
+    """POC高位：低位回绕时进位或借位（H.264 8.2.1.1 / HEVC 8.3.1）"""
+    if lsb < prev_lsb and prev_lsb - lsb >= max_lsb // 2:
+        return prev_msb + max_lsb
+    if lsb > prev_lsb and lsb - prev_lsb > max_lsb // 2:
+        return prev_msb - max_lsb
+    return prev_msb
+
+# ==================== H.264 ====================
+def skip_scaling_list(reader, size):
+    last = next_scale = 8
+    for _ in range(size):
+        if next_scale:
+            next_scale = (last + reader.se() + 256) % 256
+        last = next_scale or last
+
+class AvcOrder:
+    """从H.264切片头的 pic_order_cnt_lsb 计算每帧的POC"""
+
+    def __init__(self, sps):
+        r = BitReader(rbsp(sps[1:]))
+        profile = r.u(8)
+        r.skip(16)
+        r.ue()
+        self.separate_colour_plane = False
+        if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+            chroma_format = r.ue()
+            if chroma_format == 3:
+                self.separate_colour_plane = bool(r.u(1))
+            r.ue()
+            r.ue()
+            r.skip(1)
+            if r.u(1):
+                for i in range(12 if chroma_format == 3 else 8):
+                    if r.u(1):
+                        skip_scaling_list(r, 16 if i < 6 else 64)
+        self.log2_max_frame_num = r.ue() + 4
+        self.poc_type = r.ue()
+        if self.poc_type == 1:
+            raise ValueError("pic_order_cnt_type 1 不支持")
+        self.log2_max_poc_lsb = r.ue() + 4 if self.poc_type == 0 else 0
+        r.ue()
+        r.skip(1)
+        r.ue()
+        r.ue()
+        self.frame_mbs_only = bool(r.u(1))
+        self.prev_msb = self.prev_lsb = 0
+        self.count = 0
+
+    def picture(self, nal):
+        """传入一帧第一个切片的NAL，返回 (是否POC重新开始, POC)"""
+        nal_type, is_reference = nal[0] & 0x1F, bool(nal[0] & 0x60)
+        if self.poc_type == 2:  # 显示顺序与解码顺序相同
+            self.count = 0 if nal_type == 5 else self.count + 1
+            return nal_type == 5, self.count
+
+        r = BitReader(rbsp(nal[1:SLICE_HEADER_BYTES]))
+        r.ue()
+        r.ue()
+        r.ue()
+        if self.separate_colour_plane:
+            r.skip(2)
+        r.skip(self.log2_max_frame_num)
+        if not self.frame_mbs_only and r.u(1):
+            r.skip(1)
+        if nal_type == 5:
+            r.ue()
+            self.prev_msb = self.prev_lsb = 0
+        lsb = r.u(self.log2_max_poc_lsb)
+        msb = next_msb(lsb, self.prev_lsb, self.prev_msb, 1 << self.log2_max_poc_lsb)
+        if is_reference:
+            self.prev_msb, self.prev_lsb = msb, lsb
+        return nal_type == 5, msb + lsb
+
+# ==================== HEVC ====================
+class HevcOrder:
+    """从HEVC切片头的 slice_pic_order_cnt_lsb 计算每帧的POC"""
+
+    def __init__(self, sps, pps_list):
+        r = BitReader(rbsp(sps[2:]))
+        r.skip(4)
+        max_sub_layers = r.u(3)
+        r.skip(1)
+        # profile_tier_level
+        r.skip(96)
+        present = [(r.u(1), r.u(1)) for _ in range(max_sub_layers)]
+        if max_sub_layers:
+            r.skip(2 * (8 - max_sub_layers))
+        for profile_present, level_present in present:
+            r.skip(88 * profile_present + 8 * level_present)
+        r.ue()
+        self.separate_colour_plane = r.ue() == 3 and bool(r.u(1))
+        r.ue()
+        r.ue()
+        if r.u(1):
+            for _ in range(4):
+                r.ue()
+        r.ue()
+        r.ue()
+        self.log2_max_poc_lsb = r.ue() + 4
+
+        self.pps = {}  # pps_id -> (output_flag_present, num_extra_slice_header_bits)
+        for pps in pps_list:
+            r = BitReader(rbsp(pps[2:]))
+            pps_id = r.ue()
+            r.ue()
+            r.skip(1)
+            self.pps[pps_id] = (r.u(1), r.u(3))
+        self.prev_msb = self.prev_lsb = 0
+        self.first = True
+
+    def picture(self, nal):
+        """传入一帧第一个切片的NAL，返回 (是否POC重新开始, POC)"""
+        nal_type, temporal_id = (nal[0] >> 1) & 0x3F, (nal[1] & 7) - 1
+        r = BitReader(rbsp(nal[2:SLICE_HEADER_BYTES]))
+        r.skip(1)  # first_slice_segment_in_pic_flag
+        if 16 <= nal_type <= 23:
+            r.skip(1)
+        output_flag_present, extra_bits = self.pps[r.ue()]
+        r.skip(extra_bits)
+        r.ue()
+        if output_flag_present:
+            r.skip(1)
+        if self.separate_colour_plane:
+            r.skip(2)
+
+        if nal_type in (19, 20):  # IDR
+            restart, msb, lsb = True, 0, 0
+        else:
+            lsb = r.u(self.log2_max_poc_lsb)
+            restart = 16 <= nal_type <= 18 or (nal_type == 21 and self.first)  # BLA，或作为起点的CRA
+            msb = 0 if restart else next_msb(lsb, self.prev_lsb, self.prev_msb, 1 << self.log2_max_poc_lsb)
+        self.first = False
+        # 只有时间层0、且不是RASL/RADL/子层非参考帧的图像作为下一帧推算高位的依据
+        if temporal_id == 0 and not 6 <= nal_type <= 9 and not (nal_type <= 14 and nal_type % 2 == 0):
+            self.prev_msb, self.prev_lsb = msb, lsb
+        return restart, msb + lsb
+
+# ==================== 显示顺序 ====================
+def picture_order(config, hevc):
+    """按 avcC/hvcC 内容创建POC计算器；缺少参数集或不支持的POC类型时返回 None"""
+    try:
+        if hevc:
+            sets = hvcc_parameter_sets(config)
+            return HevcOrder(sets[33][0], sets.get(34, []))
+        sps_list, _ = avcc_parameter_sets(config)
+        return AvcOrder(sps_list[0])
+    except (IndexError, KeyError, ValueError):
+        return None
+
+def frame_offsets(pocs, restarts):
+    """每帧的 显示序号 - 解码序号（单位为帧）
+
+    restarts 为POC重新开始（IDR等）的帧序号；两次重新开始之间按POC排序得到显示顺序，
+    之前的帧总是先于之后的帧显示。
+    """
+    offsets = array('i', bytes(4 * len(pocs)))
+    bounds = sorted(set(restarts) | {0, len(pocs)})
+    for start, stop in zip(bounds, bounds[1:]):
+        for rank, i in enumerate(sorted(range(start, stop), key=pocs.__getitem__)):
+            offsets[i] = start + rank - i
+    return offsets
@@ -0,0 +1,214 @@
+import bisect
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from core.cache.media_cache import media_cache
+from core.process.async_runner import run, stream, ENCODE, REMUX
+from core.process.ffmpeg_capabilities import AAC_ENCODERS, pick_encoder
+from core.convert.segmented_encode import media_start_time, plan_segments, probe_keyframe_index
+from core.convert.smart_cut import (concat_parts, matching_video_args, part_command, probe_video_stream,
+                                    video_signature)
+
+MIN_SLICE_SEC = 10         # 切片的最短时长，太短时进程启动开销占比过高
+DEFAULT_MAX_ERRORS = 50    # 深度扫描发现这么多错误后提前停止
+DECODE_DELAY_SEC = 0.5     # 解码器与输出之间的延迟余量：错误所在的包可能领先于进度报告的输出时间
+OFFSET_PATTERN = re.compile(r'offset (0x[0-9a-fA-F]+|\d+)')
+
+# ==================== 媒体信息 ====================
+def probe_media_info(input_path):
+    """与转换器相同的ffprobe命令，共用媒体信息缓存"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", "-show_format", str(input_path)]
+    return media_cache.get_or_compute(input_path, cmd[:-1], lambda: json.loads(run(cmd).stdout))
+
+def media_duration(media_info):
+    candidates = [media_info.get('format', {}).get('duration')]
+    candidates += [s.get('duration') for s in media_info.get('streams', [])]
+    for value in candidates:
+        try:
+            if value and float(value) > 0:
+                return float(value)
+        except ValueError:
+            continue
+    return 0.0
+
+def offset_at(index, time):
+    """time 之前最近一个关键帧的字节偏移（近似定位）"""
+    i = bisect.bisect_right([t for t, _ in index], time) - 1
+    return index[i][1] if i >= 0 else None
+
+def keyframe_range(keyframes, earliest, latest, limit):
+    """把 [earliest, latest] 向外扩展到关键帧：开始取之前最近的关键帧，结束取之后第一个关键帧（没有时到 limit）"""
+    i = bisect.bisect_right(keyframes, earliest) - 1
+    j = bisect.bisect_right(keyframes, latest)
+    return [keyframes[i] if i >= 0 else 0.0, keyframes[j] if j < len(keyframes) else limit]
+
+# ==================== 切片扫描 ====================
+def slice_command(input_path, start, end):
+    cmd = ["ffmpeg", "-v", "error", "-progress", "pipe:1", "-nostats", "-ss", f"{start:.6f}", "-i", str(input_path)]
+    if end is not None:
+        cmd += ["-t", f"{end - start:.6f}"]
+    return cmd + ["-f", "null", "-"]
+
+def scan_slice(input_path, start, end, on_error, stop):
+    """解码一个切片，错误行用前后两次进度时间夹住；stop 被设置时终止ffmpeg
+
+    ffmpeg的错误信息不带时间戳，-progress 约每0.5秒（墙钟时间）报告一次输出时间，解码很快时两次报告之间
+    可能相隔数秒媒体时间。因此错误先暂存，等到下一次报告再以 on_error(行, 最早, 最晚) 回调；
+    切片结束时仍未报告的错误以切片结束（end 为 None 时为 None）为最晚时间。
+    """
+    previous, pending = start, []
+
+    def flush(latest):
+        for line in pending:
+            on_error(line, previous, latest)
+        pending.clear()
+
+    with stream(slice_command(input_path, start, end), kind=ENCODE) as process:
+        for output in process:
+            if stop.is_set():
+                break  # 退出 with 时终止子进程
+            line = output.decode('utf-8', errors='replace').strip()
+            key, sep, value = line.partition('=')
+            if sep and key in ('out_time_us', 'out_time_ms'):
+                if value.isdigit():
+                    current = start + int(value) / 1_000_000  # out_time_ms 实际也是微秒
+                    flush(current)
+                    previous = current
+            elif sep and re.fullmatch(r'[a-z_0-9]+', key):
+                continue  # 其他进度字段
+            elif line:
+                pending.append(line)
+    flush(end)
+
+def deep_scan(input_path, workers=None, max_errors=DEFAULT_MAX_ERRORS, on_progress=None):
+    """按关键帧切片并发完整解码，发现 max_errors 个错误后提前停止
+
+    返回 {'findings': [{'error', 'time', 'offset', 'range'}], 'slices', 'duration', 'stopped_early'}，
+    findings 按时间排序；时间均相对文件起点（与ffmpeg -ss 一致）。time 为错误可能出现的最早时间，
+    精度取决于进度报告间隔（见 scan_slice）；offset 优先取ffmpeg报告的偏移，否则为 time 之前关键帧的偏移；
+    range 为包含错误的 [开始, 结束]，向外扩展到关键帧（含解码延迟余量），可直接用于局部重新编码。
+    """
+    workers = workers or os.cpu_count() or 1
+    media_info = probe_media_info(input_path)
+    duration = media_duration(media_info)
+    origin = media_start_time(media_info)
+    index = [(t - origin, pos) for t, pos in probe_keyframe_index(input_path)]
+    keyframes = [t for t, _ in index]
+    count = max(1, min(workers * 2, int(duration // MIN_SLICE_SEC)))
+    slices = plan_segments(keyframes, duration, count) if duration else [(0.0, None)]
+
+    findings = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def on_error(line, earliest, latest):
+        match = OFFSET_PATTERN.search(line)
+        offset = int(match.group(1), 0) if match else offset_at(index, earliest)
+        latest = duration if latest is None else min(latest + DECODE_DELAY_SEC, duration or latest)
+        finding = {'error': line, 'time': round(earliest, 3), 'offset': offset,
+                   'range': keyframe_range(keyframes, earliest, latest, duration)}
+        with lock:
+            findings.append(finding)
+            if max_errors and len(findings) >= max_errors:
+                stop.set()
+
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(slices)))
+    try:
+        futures = [
+            # 复制上下文，切片进程的资源占用计入当前任务的指标
+            pool.submit(contextvars.copy_context().run, scan_slice, input_path, start, end, on_error, stop)
+            for start, end in slices
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if on_progress:
+                on_progress(done / len(slices))
+            if stop.is_set():
+                break
+    finally:
+        stop.set()  # 异常或提前停止时终止仍在运行的切片
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    findings.sort(key=lambda f: f['time'])
+    return {
+        'findings': findings[:max_errors] if max_errors else findings,
+        'slices': [[start, end if end is not None else duration] for start, end in slices],
+        'duration': duration,
+        'stopped_early': bool(max_errors) and len(findings) >= max_errors,
+    }
+
+def affected_ranges(findings):
+    """包含错误的区间（关键帧对齐），重叠或相邻的区间合并，返回 [[开始, 结束]]"""
+    ranges = []
+    for start, end in sorted({tuple(f['range']) for f in findings if f.get('range')}):
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return ranges
+
+# ==================== 局部重新编码 ====================
+def repair_plan(ranges, duration):
+    """把整个时长划分为 [(开始, 结束, 是否重新编码)]，受损区间之外只复制"""
+    plan, cursor = [], 0.0
+    for start, end in ranges:
+        if start > cursor:
+            plan.append((cursor, start, False))
+        if end >= duration:
+            plan.append((start, None, True))  # 最后一段编码到文件末尾
+        else:
+            plan.append((start, end, True))
+        cursor = end
+    if cursor < duration:
+        plan.append((cursor, None, False))
+    return plan
+
+def repair_ranges(input_path, output_path, ranges, on_progress=None):
+    """只重新编码受损区间，其余部分无损复制，再用concat demuxer拼接
+
+    分段以MPEG-TS中转（参数集随关键帧带在码流中）；重新编码段按源码流的profile/level/像素格式/帧率编码，
+    编码后与源参数核对，不一致时复制段与重编码段无法拼接，改为提示完整重新编码。
+    音频不分段，从源文件整体编码为AAC，避免分段边界的间隙。返回重新编码的总时长（秒）。
+    """
+    media_info = probe_media_info(input_path)
+    video = next((s for s in media_info['streams'] if s['codec_type'] == 'video'), None)
+    video_args = matching_video_args(video) if video else None
+    if video_args is None:
+        codec = f"{video.get('codec_name')} {video.get('profile')}" if video else "无视频"
+        raise RuntimeError(f"无法按源码流参数重新编码（当前: {codec}），请使用完整重新编码")
+    has_audio = any(s['codec_type'] == 'audio' for s in media_info['streams'])
+    audio_encoder = pick_encoder(AAC_ENCODERS, "AAC") if has_audio else None
+
+    plan = repair_plan(ranges, media_duration(media_info))
+    with tempfile.TemporaryDirectory(dir=Path(output_path).parent) as tmp_dir:
+        segment_paths = []
+        for i, (start, end, reencode) in enumerate(plan):
+            path = Path(tmp_dir) / f"part_{i:04d}.ts"
+            run(part_command(input_path, path, start, end, video_args if reencode else ["-c:v", "copy"]),
+                kind=ENCODE if reencode else REMUX)
+            segment_paths.append(path)
+            if on_progress:
+                on_progress((i + 1) / (len(plan) + 1))
+
+        source = video_signature(video)
+        for path, (start, _, reencode) in zip(segment_paths, plan):
+            if reencode and video_signature(probe_video_stream(path)) != source:
+                raise RuntimeError(f"{start:.2f}秒处重新编码的片段与源码流参数不一致，无法拼接，请使用完整重新编码")
+
+        cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0",
+               "-i", str(concat_parts(tmp_dir, segment_paths)), "-i", str(input_path),
+               "-map", "0:v:0", "-c:v", "copy"]
+        if video['codec_name'] == 'hevc':
+            cmd += ["-tag:v", "hvc1"]
+        if audio_encoder:
+            cmd += ["-map", "1:a:0", "-c:a", audio_encoder, "-b:a", "192k"]
+        cmd += ["-movflags", "+faststart", "-max_muxing_queue_size", "9999", str(output_path)]
+        run(cmd, kind=REMUX)
+
+    return round(sum(end - start for start, end in ranges), 2)
@@ -0,0 +1,305 @@
+from collections import Counter
+
+import numpy as np
+
+from core.cache.media_cache import media_cache
+from core.process.async_runner import stream, PROBE
+from core.process.ffmpeg_capabilities import H264_ENCODERS, AAC_ENCODERS, pick_encoder
+from core.fix.slice_scan import probe_media_info, media_duration
+
+BATCH_PACKETS = 50_000   # 每批解析的包数，内存占用与文件时长无关
+MAX_SAMPLES = 5          # 每类问题在报告中列出的位置数量
+EPSILON = 1e-6           # 时间戳相等的判定精度(秒)
+GAP_FACTOR = 3.0         # 间隔超过包时长的多少倍视为断层
+GAP_MIN_SEC = 0.1        # 断层的最短时长(秒)
+VFR_RATIO = 0.05         # 偏离标称帧间隔的帧超过该比例视为可变帧率
+SPIKE_FACTOR = 3.0       # 每秒码率超过中位数的多少倍视为突增
+MIN_SPIKE_BPS = 2_000_000
+DRIFT_SEC = 0.1          # 音视频时长差超过该值视为不同步
+MAX_TEMPO_DRIFT = 0.01   # 1%以内的时长差按时钟漂移处理（拉伸音频），更大时只按时间戳重新对齐
+
+# ffprobe按内部字段顺序输出：stream_index, pts_time, dts_time, duration_time, size, flags
+PROBE_FIELDS = "stream_index,pts_time,dts_time,duration_time,size,flags"
+
+# ==================== 解析 ====================
+def packet_command(input_path):
+    """紧凑的CSV包列表（不带节名），比 -show_packets 的JSON小一个数量级且可以流式解析"""
+    return ["ffprobe", "-v", "error", "-show_entries", f"packet={PROBE_FIELDS}", "-of", "csv=p=0", str(input_path)]
+
+def parse_batch(lines):
+    """一批CSV行 -> (流序号, PTS, DTS, 时长, 大小) 数组，N/A 转为 NaN"""
+    rows = [line.split(b',') for line in lines]
+    rows = [row[:5] for row in rows if len(row) >= 6]
+    if not rows:
+        return None
+    table = np.array(rows, dtype=np.bytes_)
+    values = np.where(table == b'N/A', b'nan', table).astype(np.float64)
+    return values[:, 0].astype(np.int64), values[:, 1], values[:, 2], values[:, 3], values[:, 4]
+
+def iter_batches(input_path):
+    """流式读取ffprobe输出，每 BATCH_PACKETS 个包产出一批数组"""
+    pending, partial, parsed = [], b'', 0
+    with stream(packet_command(input_path), kind=PROBE, merge_stderr=False, binary=True) as process:
+        for chunk in process:
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            pending.extend(lines)
+            if len(pending) >= BATCH_PACKETS:
+                batch = parse_batch(pending)
+                pending = []
+                if batch:
+                    parsed += len(batch[0])
+                    yield batch
+    pending.append(partial)
+    batch = parse_batch(pending)
+    if batch:
+        parsed += len(batch[0])
+        yield batch
+    if process.returncode != 0 and not parsed:
+        raise RuntimeError(f"ffprobe读取数据包失败（返回码 {process.returncode}）")
+
+# ==================== 单流统计 ====================
+class StreamTimeline:
+    """单个流的增量统计：跨批次只保留上一个包的时间戳，其余为计数、直方图与少量位置样本"""
+
+    def __init__(self, info):
+        self.index = info['index']
+        self.codec_type = info['codec_type']
+        self.frame_rate = info.get('avg_frame_rate') or info.get('r_frame_rate')
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.duration_sum = 0.0
+        self.last = None            # 上一批最后一个包的DTS
+        self.last_max = None        # 此前出现过的最大DTS
+        self.last_duration = np.nan
+        self.issues = {key: {'count': 0, 'samples': [], 'max': 0.0} for key in ('non_monotonic', 'duplicate', 'gap')}
+        self.intervals = Counter()  # 帧间隔(毫秒) -> 次数，用于判断可变帧率
+        self.bytes_per_sec = np.zeros(0)
+
+    def record(self, key, mask, times, deltas):
+        issue = self.issues[key]
+        count = int(mask.sum())
+        if not count:
+            return
+        issue['count'] += count
+        issue['max'] = max(issue['max'], float(np.abs(deltas[mask]).max()))
+        room = MAX_SAMPLES - len(issue['samples'])
+        if room > 0:
+            issue['samples'] += [[round(float(t), 3), round(float(d), 3)]
+                                 for t, d in zip(times[mask][:room], deltas[mask][:room])]
+
+    def feed(self, pts, dts, duration, size):
+        times = np.where(np.isnan(dts), pts, dts)  # 解码顺序用DTS判断单调性，缺失时退回PTS
+        valid = ~np.isnan(times)
+        times, pts, duration, size = times[valid], pts[valid], duration[valid], size[valid]
+        if not len(times):
+            return
+        self.count += len(times)
+        shown = np.where(np.isnan(pts), times, pts)
+        ends = shown + np.nan_to_num(duration)
+        self.start = float(shown.min()) if self.start is None else min(self.start, float(shown.min()))
+        self.end = float(ends.max()) if self.end is None else max(self.end, float(ends.max()))
+        self.duration_sum += float(np.nansum(duration))
+
+        # 与前一个包的间隔，第一批的第一个包没有前驱
+        if self.last is None:
+            previous, prev_duration, current = times[:-1], duration[:-1], times[1:]
+            reached = np.fmax.accumulate(previous)
+        else:
+            previous = np.concatenate(([self.last], times[:-1]))
+            prev_duration = np.concatenate(([self.last_duration], duration[:-1]))
+            current = times
+            reached = np.fmax.accumulate(np.concatenate(([self.last_max], times[:-1])))
+        deltas = current - previous
+        advance = current - reached  # 相对已到达的最大时间戳，倒退后回到原位不算断层
+        positive = deltas[deltas > EPSILON]
+        fallback = np.median(positive) if len(positive) else np.nan
+        expected = np.where(prev_duration > 0, prev_duration, fallback)
+
+        gaps = advance > np.fmax(expected * GAP_FACTOR, GAP_MIN_SEC)
+        self.record('non_monotonic', deltas < -EPSILON, current, deltas)
+        self.record('duplicate', np.abs(deltas) <= EPSILON, current, deltas)
+        self.record('gap', gaps, current, advance)
+
+        if self.codec_type == 'video':
+            regular = deltas[(deltas > EPSILON) & ~gaps]
+            values, counts = np.unique(np.round(regular * 1000).astype(np.int64), return_counts=True)
+            self.intervals.update(dict(zip(values.tolist(), counts.tolist())))
+            seconds = np.clip(times, 0, None).astype(np.int64)
+            bins = np.bincount(seconds, weights=np.nan_to_num(size))
+            if len(bins) > len(self.bytes_per_sec):
+                self.bytes_per_sec = np.pad(self.bytes_per_sec, (0, len(bins) - len(self.bytes_per_sec)))
+            self.bytes_per_sec[:len(bins)] += bins
+
+        self.last = float(times[-1])
+        self.last_max = float(times.max()) if self.last_max is None else max(self.last_max, float(times.max()))
+        self.last_duration = float(duration[-1])
+
+    # ---------- 结论 ----------
+    def label(self):
+        return f"{'视频' if self.codec_type == 'video' else '音频'}流 #{self.index}"
+
+    def timestamp_findings(self):
+        messages = {
+            'non_monotonic': ("non-monotonic dts", "处时间戳倒退，最大回退 {max:.3f} 秒"),
+            'duplicate': ("duplicate timestamp", "个包的时间戳与前一个包相同"),
+            'gap': ("timestamp gap", "处时间戳断层，最长 {max:.3f} 秒"),
+        }
+        findings = []
+        for key, (kind, text) in messages.items():
+            issue = self.issues[key]
+            if not issue['count']:
+                continue
+            where = "、".join(f"{t:.3f}s" for t, _ in issue['samples'])
+            findings.append({
+                'type': kind,
+                'stream': self.index,
+                'message': f"{self.label()}：{issue['count']} {text.format(max=issue['max'])}（位于 {where}）",
+                'time': issue['samples'][0][0],
+                'repair': self.repair(),
+            })
+        return findings
+
+    def repair(self):
+        """视频按标称帧率重新生成恒定帧率，音频按时间戳重新对齐"""
+        return {'cfr': self.target_rate()} if self.codec_type == 'video' else {'resync': True}
+
+    def target_rate(self):
+        """ffprobe统计的平均帧率（分数形式），无效时由最常见的帧间隔推算"""
+        if self.frame_rate and not self.frame_rate.startswith('0'):
+            return self.frame_rate
+        nominal = self.intervals.most_common(1)[0][0] if self.intervals else 40
+        return f"{1000 / nominal:.3f}"
+
+    def vfr_finding(self):
+        total = sum(self.intervals.values())
+        if self.codec_type != 'video' or total < 2:
+            return None
+        values = np.array(list(self.intervals.keys()), dtype=np.float64)
+        counts = np.array(list(self.intervals.values()), dtype=np.float64)
+        order = np.argsort(values)
+        values, counts = values[order], counts[order]
+        nominal = values[np.searchsorted(np.cumsum(counts), total / 2)]  # 加权中位数
+        tolerance = max(1.5, nominal * 0.1)  # 容忍毫秒级时间基的取整抖动（如33/34ms交替）
+        irregular = counts[np.abs(values - nominal) > tolerance].sum()
+        if irregular / total <= VFR_RATIO:
+            return None
+        return {
+            'type': "variable frame rate",
+            'stream': self.index,
+            'message': (f"{self.label()}：{irregular / total:.0%} 的帧间隔偏离标称值 {nominal:.0f}ms，"
+                        f"帧率在 {1000 / values.max():.1f}～{1000 / max(values.min(), 1):.1f} fps 之间变化"),
+            'time': None,
+            'repair': self.repair(),
+        }
+
+    def bitrate_finding(self):
+        bins = self.bytes_per_sec[:-1] * 8  # 最后一秒通常不完整
+        active = bins[bins > 0]
+        if self.codec_type != 'video' or len(active) < 10:
+            return None
+        median = float(np.median(active))
+        spikes = np.flatnonzero((bins > median * SPIKE_FACTOR) & (bins > MIN_SPIKE_BPS))
+        if not len(spikes):
+            return None
+        where = "、".join(f"{s}s" for s in spikes[:MAX_SAMPLES].tolist())
+        return {
+            'type': "bitrate spike",
+            'stream': self.index,
+            'message': (f"{self.label()}：{len(spikes)} 秒的码率超过中位数 {median / 1e6:.1f} Mbps 的 "
+                        f"{SPIKE_FACTOR:.0f} 倍，峰值 {bins.max() / 1e6:.1f} Mbps（位于 {where}）"),
+            'time': float(spikes[0]),
+            'repair': {'maxrate': int(median * 2)},
+        }
+
+# ==================== 分析 ====================
+def drift_finding(video, audio):
+    """音视频时长差：1%以内视为录制设备时钟漂移，拉伸音频；否则只按时间戳重新对齐"""
+    if not video or not audio or video.start is None or audio.start is None:
+        return None
+    video_span, audio_span = video.end - video.start, audio.end - audio.start
+    drift = audio_span - video_span
+    # 音频包时长之和与其时间线不符，说明中间丢失或多出采样
+    missing = audio_span - audio.duration_sum if audio.duration_sum else 0.0
+    if abs(drift) <= DRIFT_SEC and abs(missing) <= DRIFT_SEC:
+        return None
+    repair = {'resync': True}
+    if abs(drift) > DRIFT_SEC and video_span > 0 and abs(drift) / video_span <= MAX_TEMPO_DRIFT:
+        repair['tempo'] = round(audio_span / video_span, 6)
+    message = f"音频时长比视频{'长' if drift > 0 else '短'} {abs(drift):.3f} 秒"
+    if abs(missing) > DRIFT_SEC:
+        message += f"，音频时间线中有 {abs(missing):.3f} 秒{'缺失' if missing > 0 else '重叠'}的采样"
+    return {'type': "av drift", 'stream': audio.index, 'message': message, 'time': None, 'repair': repair}
+
+def analyze(input_path, on_progress=None):
+    """逐批读取数据包时间戳，向量化检测时间戳倒退/重复/断层、可变帧率、码率突增与音视频不同步
+
+    返回 {'findings': [{'type', 'stream', 'message', 'time', 'repair'}], 'packets', 'duration'}。
+    """
+    media_info = probe_media_info(input_path)
+    duration = media_duration(media_info)
+    timelines = {s['index']: StreamTimeline(s) for s in media_info['streams']
+                 if s['codec_type'] in ('video', 'audio')}
+
+    packets = 0
+    for index, pts, dts, packet_duration, size in iter_batches(input_path):
+        packets += len(index)
+        for stream_index, timeline in timelines.items():
+            mask = index == stream_index
+            if mask.any():
+                timeline.feed(pts[mask], dts[mask], packet_duration[mask], size[mask])
+        if on_progress and duration:
+            on_progress(min(1.0, float(np.nanmax(dts)) / duration) if not np.isnan(dts).all() else 0.0)
+
+    findings = []
+    for timeline in timelines.values():
+        findings += timeline.timestamp_findings()
+        findings += [f for f in (timeline.vfr_finding(), timeline.bitrate_finding()) if f]
+    video = next((t for t in timelines.values() if t.codec_type == 'video'), None)
+    audio = next((t for t in timelines.values() if t.codec_type == 'audio'), None)
+    drift = drift_finding(video, audio)
+    if drift:
+        findings.append(drift)
+    return {'findings': findings, 'packets': packets, 'duration': duration}
+
+def analyze_timestamps(input_path, on_progress=None):
+    """同一文件重复分析时直接复用结果"""
+    return media_cache.get_or_compute(input_path, ["packet_timestamps"], lambda: analyze(input_path, on_progress))
+
+# ==================== 修复 ====================
+def merge_repairs(errors):
+    """合并各条检测结果的修复参数：{'cfr', 'maxrate', 'resync', 'tempo'}"""
+    repair = {}
+    for error in errors:
+        repair.update(error.get('repair') or {})
+    return repair
+
+def repair_command(input_path, output_path, repair, media_info):
+    """只处理有问题的流：视频需要恒定帧率或限制码率时重新编码，音频需要对齐时重新编码，其余复制"""
+    video = next((s for s in media_info['streams'] if s['codec_type'] == 'video'), None)
+    cmd = ["ffmpeg", "-y", "-v", "error", "-fflags", "+genpts", "-i", str(input_path),
+           "-map", "0:v:0?", "-map", "0:a:0?"]
+
+    if video and (repair.get('cfr') or repair.get('maxrate')):
+        encoder = pick_encoder(H264_ENCODERS, "H.264", allow_hardware=False)
+        if repair.get('cfr'):
+            cmd += ["-vf", f"fps={repair['cfr']}"]  # 按时间戳补帧/丢帧，断层处重复上一帧
+        cmd += ["-c:v", encoder, "-pix_fmt", "yuv420p"]
+        if encoder == "libx264":
+            cmd += ["-crf", "18", "-preset", "veryfast"]
+        if repair.get('maxrate'):
+            cmd += ["-maxrate", str(repair['maxrate']), "-bufsize", str(repair['maxrate'] * 2)]
+    else:
+        cmd += ["-c:v", "copy"]
+        if video and video.get('codec_name') == 'hevc':
+            cmd += ["-tag:v", "hvc1"]
+
+    if repair.get('resync') or repair.get('tempo'):
+        filters = ["aresample=async=1000:first_pts=0"]  # 按时间戳补静音/裁掉重叠
+        if repair.get('tempo'):
+            filters.append(f"atempo={repair['tempo']}")
+        cmd += ["-af", ",".join(filters), "-c:a", pick_encoder(AAC_ENCODERS, "AAC"), "-b:a", "192k"]
+    else:
+        cmd += ["-c:a", "copy"]
+    return cmd + ["-movflags", "+faststart", str(output_path)]
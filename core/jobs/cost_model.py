@@ -0,0 +1,131 @@
+import importlib
+import os
+import sqlite3
+
+from core.extract.mp3_extract import mp3_copy_compatible
+from core.telemetry import job_metrics
+
+HISTORY_WINDOW = 50   # 每个画像取最近多少条成功记录
+MIN_HISTORY = 3       # 至少有这么多条记录才使用历史速度
+STARTUP_SEC = 0.5     # 进程启动与探测的固定开销(秒)
+
+# 没有历史记录时的默认值：编码类按倍实时速度，封装/修复类按输入吞吐量(MB/s)
+DEFAULT_SPEED = {
+    ('encode', 'sd'): 8.0, ('encode', 'hd'): 4.0, ('encode', 'fhd'): 1.5, ('encode', 'uhd'): 0.4,
+    ('audio', None): 40.0,
+}
+DEFAULT_MBPS = 150.0
+
+# ==================== 特征 ====================
+def converter_module():
+    """flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载；
+    它本身依赖 job_panel，放在函数内加载以避免循环导入"""
+    return importlib.import_module("core.convert.flv-to-mp4")
+
+def resolution_bucket(height):
+    if not height:
+        return None
+    for limit, name in ((576, 'sd'), (720, 'hd'), (1080, 'fhd')):
+        if height <= limit:
+            return name
+    return 'uhd'
+
+def probe(input_path):
+    """返回 (媒体信息, 时长)，探测失败时返回 (None, 0)"""
+    converter = converter_module().VideoConverter({'pr_compat_mode': False})
+    try:
+        media_info = converter.get_media_info(input_path)
+    except Exception:
+        return None, 0.0
+    return media_info, converter.get_duration(media_info)
+
+def job_features(kind, params):
+    """任务的成本特征：处理方式(encode/audio/copy)、分辨率档位、媒体时长、输入大小"""
+    input_path = params['input_path']
+    input_bytes = os.path.getsize(input_path) if os.path.isfile(input_path) else 0
+    features = {'kind': kind, 'mode': 'copy', 'bucket': None, 'duration': 0.0, 'input_bytes': input_bytes}
+    if kind == 'trim':
+        # 主体是关键帧之间的流复制，耗时与所裁区间的数据量成正比
+        _, duration = probe(input_path)
+        if duration:
+            end = min(params.get('end') or duration, duration)
+            features['input_bytes'] = int(input_bytes * max(0.0, end - params['start']) / duration)
+        return features
+    if kind not in ('convert', 'extract', 'multi'):
+        return features  # 修复/重建只做封装层面的读写，耗时与文件大小成正比
+
+    media_info, duration = probe(input_path)
+    if media_info is None:
+        return features
+    video = next((s for s in media_info['streams'] if s['codec_type'] == 'video'), None)
+    audio = next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+    features['duration'] = duration
+
+    if kind == 'convert':
+        configs = [params['config']]
+    elif kind == 'multi':
+        configs = [o['config'] for o in params['outputs'] if o['format'] == 'mp4']
+    else:
+        configs = []
+    reencode = video is not None and any(
+        c.get('pr_compat_mode') and converter_module().VideoConverter(c).needs_video_encode(media_info) for c in configs
+    )
+    if reencode:
+        features['mode'] = 'encode'
+        features['bucket'] = resolution_bucket(video.get('height'))
+    elif kind == 'extract' and (params.get('audio_filter') or not mp3_copy_compatible(audio, params['bitrate'])):
+        features['mode'] = 'audio'
+    elif kind == 'multi' and any(
+            o['format'] == 'mp3' and (o.get('audio_filter') or not mp3_copy_compatible(audio, o['bitrate']))
+            for o in params['outputs']):
+        features['mode'] = 'audio'
+    return features
+
+def profile_name(features):
+    """历史记录的分组键，如 convert:encode:fhd"""
+    return ':'.join(p for p in (features['kind'], features['mode'], features['bucket']) if p)
+
+# ==================== 历史速度 ====================
+def history(profile):
+    """同一画像最近成功任务的速度(倍实时)与吞吐量(MB/s)中位数"""
+    if not job_metrics.DB_PATH.exists():
+        return None, None
+    try:
+        conn = job_metrics.connect()
+        try:
+            rows = conn.execute(
+                "SELECT speed, wall_sec, input_bytes FROM metrics WHERE profile = ? AND status = 'ok' "
+                "AND result_cache_hit = 0 ORDER BY id DESC LIMIT ?", (profile, HISTORY_WINDOW)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None, None
+    if len(rows) < MIN_HISTORY:
+        return None, None
+    return (job_metrics.percentile([r['speed'] for r in rows], 0.5),
+            job_metrics.percentile([job_metrics.throughput(r) for r in rows], 0.5))
+
+# ==================== 估算 ====================
+def estimate(kind, params):
+    """预计耗时(秒)与画像；编码类按 时长/速度，封装类按 大小/吞吐量，优先使用历史记录"""
+    features = job_features(kind, params)
+    profile = profile_name(features)
+    speed, mbps = history(profile)
+    source = 'history' if speed or mbps else 'default'
+
+    if features['mode'] in ('encode', 'audio') and features['duration']:
+        speed = speed or DEFAULT_SPEED.get((features['mode'], features['bucket']), DEFAULT_SPEED[('encode', 'fhd')])
+        seconds = features['duration'] / speed
+    else:
+        seconds = features['input_bytes'] / 1024 / 1024 / (mbps or DEFAULT_MBPS)
+    return {'seconds': round(seconds + STARTUP_SEC, 1), 'profile': profile, 'source': source}
+
+def format_eta(seconds):
+    if seconds is None:
+        return "未知"
+    if seconds < 60:
+        return f"{seconds:.0f}秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}分钟"
+    return f"{seconds / 3600:.1f}小时"
@@ -0,0 +1,107 @@
+import functools
+import os
+import uuid
+
+import streamlit as st
+
+from core.cache import result_cache
+from core.jobs import job_queue
+from core.jobs.cost_model import estimate, format_eta
+from core.staging.upload_staging import offer_download
+from core.telemetry import job_metrics
+
+STATUS_LABELS = {
+    job_queue.QUEUED: "⏳ 排队中",
+    job_queue.RUNNING: "🚀 运行中",
+    job_queue.DONE: "✅ 已完成",
+    job_queue.FAILED: "❌ 失败",
+    job_queue.CANCELLED: "🚫 已取消",
+}
+
+# ==================== worker 与客户端标识 ====================
+@st.cache_resource
+def ensure_worker_service():
+    """在Streamlit服务进程内启动一次worker池（VIDEOTOOL_EMBEDDED_WORKER=0 时改用独立进程）"""
+    if os.environ.get("VIDEOTOOL_EMBEDDED_WORKER", "1") == "0":
+        return None
+    from core.jobs.worker import WorkerService
+    return WorkerService().start()
+
+def client_id():
+    """保存在URL参数中的客户端标识，刷新浏览器后仍能找回自己的任务"""
+    cid = st.session_state.get('client_id') or st.query_params.get('client') or uuid.uuid4().hex
+    st.session_state.client_id = cid
+    if st.query_params.get('client') != cid:
+        st.query_params['client'] = cid
+    return cid
+
+def submit_job(kind, params, label):
+    """页面只负责提交任务，实际执行由worker完成
+
+    相同输入与参数已有缓存结果时直接记录为已完成，不再排队。
+    排队的任务带上预计耗时，worker按短作业优先调度。
+    """
+    cached = result_cache.lookup(kind, params)
+    if cached is not None:
+        job_metrics.record_cache_hit(kind, params['input_path'],
+                                     *[o['output_path'] for o in cached.get('outputs') or [cached]])
+        return job_queue.record_done(kind, params, client_id(), label, cached)
+    ensure_worker_service()
+    try:
+        cost = estimate(kind, params)
+    except Exception:
+        cost = {'seconds': None, 'profile': None}  # 估算失败不影响提交
+    return job_queue.enqueue(kind, params, client_id(), label, cost=cost['seconds'], profile=cost['profile'])
+
+def record_result(kind, params, label, result):
+    """页面内直接完成的任务（如流式提取）也记录到任务列表，统一提供下载"""
+    return job_queue.record_done(kind, params, client_id(), label, result)
+
+# ==================== 任务面板 ====================
+def render_jobs(kinds):
+    """显示当前客户端的任务：进度、取消、结果下载"""
+    ensure_worker_service()
+    jobs = job_queue.list_jobs(client_id(), kinds, limit=10)
+    if not jobs:
+        return
+
+    st.markdown("---")
+    st.subheader("📋 任务")
+    for job in jobs:
+        with st.container(border=True):
+            st.markdown(f"**{job['label']}** · {STATUS_LABELS[job['status']]}")
+
+            if job['status'] in job_queue.ACTIVE_STATES:
+                if job['status'] == job_queue.QUEUED and job.get('cost') is not None:
+                    st.caption(f"⏱️ 预计耗时 {format_eta(job['cost'])}（短任务优先执行）")
+                st.progress(min(job['progress'], 1.0), text=job['message'] or None)
+                if st.button("取消", key=f"cancel-{job['id']}"):
+                    job_queue.request_cancel(job['id'])
+                    st.rerun(scope="fragment")
+            elif job['status'] == job_queue.DONE:
+                result = job['result']
+                hit_marker = "⚡ 缓存命中 · " if result.get('cache_hit') else ""
+                st.success(hit_marker + result['summary'])
+                # 多输出任务逐个提供下载
+                outputs = result.get('outputs') or [result]
+                for i, output in enumerate(outputs):
+                    if len(outputs) > 1:
+                        st.caption(output['summary'])
+                    if os.path.exists(output['output_path']):
+                        offer_download(
+                            output['output_path'],
+                            label="⬇️ 下载" if len(outputs) == 1 else f"⬇️ 下载 {os.path.basename(output['output_path'])}",
+                            mime=output['mime'],
+                            key=f"download-{job['id']}-{i}",
+                            use_container_width=True
+                        )
+            elif job['status'] == job_queue.FAILED:
+                st.error(job['error'][-2000:])
+
+@functools.lru_cache(maxsize=None)
+def polling_fragment(refresh_interval):
+    return st.fragment(render_jobs, run_every=refresh_interval)
+
+def job_panel(kinds, refresh_interval=1.0):
+    """按 refresh_interval 秒轮询任务状态；只刷新面板本身，不会重跑整个页面"""
+    polling_fragment(float(refresh_interval))(list(kinds))
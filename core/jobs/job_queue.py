@@ -0,0 +1,225 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from core.cache.media_cache import CACHE_ROOT
+
+DB_PATH = Path(os.environ.get("VIDEOTOOL_JOBS_DB", CACHE_ROOT / "jobs.sqlite3"))
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    heartbeat_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    cost REAL,
+    profile TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs(owner, created_at);
+"""
+
+# 旧数据库缺少的列：(列名, 定义)
+MIGRATIONS = [('cost', 'REAL'), ('profile', 'TEXT')]
+
+HEARTBEAT_TIMEOUT = 60  # 超过该秒数未心跳的运行中任务视为worker已退出
+
+# 短作业优先：按预计耗时排序，等待时间按 AGING_RATE 抵扣预计耗时，
+# 等待超过 MAX_WAIT_SEC 的任务无条件优先，长任务不会被源源不断的短任务饿死
+AGING_RATE = float(os.environ.get("VIDEOTOOL_AGING_RATE", 1.0))
+MAX_WAIT_SEC = float(os.environ.get("VIDEOTOOL_MAX_WAIT_SEC", 1800))
+UNKNOWN_COST = 60.0  # 没有估算的任务按该耗时排序
+
+# ==================== 数据库连接 ====================
+_initialized = set()  # 本进程已建表/迁移的数据库路径
+_init_lock = threading.Lock()
+
+def init_db(db_path=DB_PATH):
+    """建表、补齐旧库缺少的列并开启WAL（WAL写入数据库文件，持久生效）；每个进程每个数据库只执行一次"""
+    db_path = Path(db_path)
+    with _init_lock:
+        if db_path in _initialized:
+            return
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # 检查与 ALTER 在同一个写事务中，多个进程同时首次打开旧库时不会重复添加列
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for name, definition in MIGRATIONS:
+                    if name not in columns:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        _initialized.add(db_path)
+
+@contextmanager
+def connect(db_path=DB_PATH):
+    """每次操作单独建立连接（自动提交）；WAL模式下读写互不阻塞"""
+    init_db(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        yield conn
+    finally:
+        conn.close()
+
+def row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+# ==================== 提交与查询 ====================
+def enqueue(kind, params, owner, label='', db_path=DB_PATH, cost=None, profile=None):
+    """提交任务，返回任务ID；cost 为预计耗时(秒)，用于短作业优先调度"""
+    job_id = uuid.uuid4().hex
+    with connect(db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, owner, label, params, status, created_at, cost, profile) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, owner, label, json.dumps(params, ensure_ascii=False), QUEUED, time.time(), cost, profile)
+        )
+    return job_id
+
+def record_done(kind, params, owner, label, result, db_path=DB_PATH):
+    """直接记录一个已完成的任务（如结果缓存命中），返回任务ID"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with connect(db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, owner, label, params, status, progress, result, "
+            "created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?)",
+            (job_id, kind, owner, label, json.dumps(params, ensure_ascii=False), DONE,
+             json.dumps(result, ensure_ascii=False), now, now, now)
+        )
+    return job_id
+
+def get_job(job_id, db_path=DB_PATH):
+    with connect(db_path) as conn:
+        return row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+def list_jobs(owner, kinds=None, limit=20, db_path=DB_PATH):
+    """按提交时间倒序列出某个客户端的任务"""
+    query = "SELECT * FROM jobs WHERE owner = ?"
+    args = [owner]
+    if kinds:
+        query += f" AND kind IN ({','.join('?' * len(kinds))})"
+        args += list(kinds)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    args.append(limit)
+    with connect(db_path) as conn:
+        return [row_to_job(row) for row in conn.execute(query, args)]
+
+def request_cancel(job_id, db_path=DB_PATH):
+    """排队中的任务直接取消；运行中的任务由worker检查标记后终止"""
+    with connect(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, time.time(), job_id, QUEUED)
+        )
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+# ==================== worker 侧操作 ====================
+def claim_next(limits, max_running, db_path=DB_PATH):
+    """原子地领取下一个可运行的任务，遵守全局与按类型的并发上限
+
+    按短作业优先并带老化（见 AGING_RATE / MAX_WAIT_SEC）选择任务。没有可运行任务时返回 None。
+    """
+    with connect(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            running = dict(conn.execute(
+                "SELECT kind, COUNT(*) FROM jobs WHERE status = ? GROUP BY kind", (RUNNING,)
+            ).fetchall())
+            allowed = [kind for kind, limit in limits.items() if running.get(kind, 0) < limit]
+            row = None
+            now = time.time()
+            if sum(running.values()) < max_running and allowed:
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status = ? AND kind IN ({','.join('?' * len(allowed))}) "
+                    "ORDER BY created_at >= ?, COALESCE(cost, ?) - (? - created_at) * ?, created_at LIMIT 1",
+                    [QUEUED] + allowed + [now - MAX_WAIT_SEC, UNKNOWN_COST, now, AGING_RATE]
+                ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, worker_pid = ? WHERE id = ?",
+                    (RUNNING, now, now, os.getpid(), row['id'])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    job = row_to_job(row)
+    if job is not None:
+        job['status'] = RUNNING
+    return job
+
+def update_progress(job_id, progress, message='', db_path=DB_PATH):
+    """更新进度与心跳，返回是否已请求取消"""
+    with connect(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE id = ?",
+            (progress, message, time.time(), job_id)
+        )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return bool(row and row['cancel_requested'])
+
+def heartbeat(job_ids, db_path=DB_PATH):
+    """长时间没有进度输出的任务也需要定期心跳"""
+    if not job_ids:
+        return
+    with connect(db_path) as conn:
+        conn.execute(
+            f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({','.join('?' * len(job_ids))})",
+            [time.time()] + list(job_ids)
+        )
+
+def finish(job_id, status, result=None, error=None, db_path=DB_PATH):
+    with connect(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+            "progress = CASE WHEN ? = ? THEN 1 ELSE progress END WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+             error, time.time(), status, DONE, job_id)
+        )
+
+def requeue_orphans(db_path=DB_PATH):
+    """worker进程退出后遗留的运行中任务（心跳超时）重新排队"""
+    with connect(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker_pid = NULL, progress = 0, message = '' "
+            "WHERE status = ? AND COALESCE(heartbeat_at, 0) < ?",
+            (QUEUED, RUNNING, time.time() - HEARTBEAT_TIMEOUT)
+        )
@@ -0,0 +1,378 @@
+import argparse
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.cache import result_cache
+from core.jobs import job_queue
+from core.process.async_runner import stream, ENCODE, REMUX
+from core.telemetry import job_metrics
+from core.fix.detect import run_detection
+from core.fix.faststart import remux_command, try_relocate
+from core.fix.moov_rebuild import rebuild_moov
+from core.fix.slice_scan import repair_ranges
+from core.fix.timestamp_analyzer import repair_command
+from core.extract.mp3_extract import build_extract_command, stream_extract
+from core.extract.multi_output import MIME_TYPES, build_multi_output_command, describe_output
+from core.convert.segmented_encode import media_start_time, segmented_encode, single_process_encode
+from core.convert.smart_cut import smart_cut, plan_split, split_command, split_outputs
+
+# flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载
+converter_module = importlib.import_module("core.convert.flv-to-mp4")
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0   # 进度写回数据库的最小间隔(秒)
+HEARTBEAT_INTERVAL = 15   # 运行中任务的心跳间隔(秒)
+# 单个任务的默认超时(秒)，任务参数中的 timeout 优先；为空表示不限制
+JOB_TIMEOUT = float(os.environ["VIDEOTOOL_JOB_TIMEOUT"]) if os.environ.get("VIDEOTOOL_JOB_TIMEOUT") else None
+
+class JobCancelled(Exception):
+    """用户请求取消任务"""
+
+def default_limits(cores=None):
+    """按CPU核数给出各类任务的并发上限"""
+    cores = cores or os.cpu_count() or 1
+    return {
+        'convert': max(1, cores // 4),
+        'extract': max(1, cores // 2),
+        'multi': max(1, cores // 4),
+        'fix': 2,
+        'rebuild': 1,
+        'trim': 2,
+        'split': 2,
+    }
+
+# ==================== ffmpeg 执行 ====================
+def run_tracked(job_id, cmd, duration, kind=ENCODE, timeout=None):
+    """运行ffmpeg并把 -progress 输出写回任务进度，请求取消或超时时终止子进程"""
+    cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    tracker = converter_module.ProgressTracker(duration)
+    log_lines = deque(maxlen=50)
+    last_update = 0.0
+    with stream(cmd, kind=kind, timeout=timeout) as process:
+        for output in process:
+            line = output.decode('utf-8', errors='replace')
+            if not tracker.feed(line):
+                log_lines.append(line)
+
+            now = time.monotonic()
+            if now - last_update >= PROGRESS_INTERVAL:
+                last_update = now
+                if job_queue.update_progress(job_id, tracker.percent / 100, tracker.summary()):
+                    raise JobCancelled()  # 退出 with 时终止子进程
+
+    job_metrics.observe_progress(tracker)
+    if process.returncode != 0:
+        raise RuntimeError(''.join(log_lines)[-2000:])
+
+def job_timeout(job):
+    return job['params'].get('timeout') or JOB_TIMEOUT
+
+def probe_media(input_path):
+    """返回 (媒体信息, 时长)"""
+    converter = converter_module.VideoConverter({'pr_compat_mode': False})
+    media_info = converter.get_media_info(input_path)
+    return media_info, converter.get_duration(media_info)
+
+def first_audio_stream(media_info):
+    return next((s for s in media_info['streams'] if s['codec_type'] == 'audio'), None)
+
+# ==================== 任务处理 ====================
+def handle_convert(job):
+    params = job['params']
+    input_path, output_path = params['input_path'], params['output_path']
+    converter = converter_module.VideoConverter(params['config'])
+
+    if converter.try_native_faststart(input_path, output_path):
+        summary = "moov已原生移动到文件开头，无需ffmpeg重新封装"
+    elif converter.use_segmented_encode(input_path):
+        def on_segment_done(done, total):
+            if job_queue.update_progress(job['id'], done / total, f"已完成分段 {done}/{total}"):
+                raise JobCancelled()
+
+        stats = segmented_encode(converter, input_path, output_path,
+                                 count=params['config']['parallel_segments'],
+                                 on_segment_done=on_segment_done)
+        summary = (f"{stats['segments']} 个分段并行编码，耗时 {stats['wall_time']}s，"
+                   f"平均并行度 {stats['parallelism']}")
+        if params['config'].get('measure_speedup'):
+            reference = Path(output_path).with_name(Path(output_path).stem + "_single.mp4")
+            single_time = single_process_encode(converter, input_path, str(reference))
+            reference.unlink(missing_ok=True)
+            summary += f"，单进程耗时 {single_time:.2f}s，实际加速比 {single_time / stats['wall_time']:.2f}x"
+    else:
+        cmd = converter.build_command(converter.safe_path(input_path), converter.safe_path(output_path))
+        run_tracked(job['id'], cmd, converter.duration, converter.process_kind(cmd), job_timeout(job))
+        summary = "文件转换成功完成！"
+
+    result = {'output_path': output_path, 'mime': 'video/mp4', 'summary': summary}
+    if params['config']['pr_compat_mode']:
+        try:
+            passed, video_info = converter.verify_output(output_path)
+        except Exception as e:
+            result['summary'] += f" PR兼容性验证未完成: {e}"  # 转换本身已成功，验证失败不影响结果
+        else:
+            result['summary'] += " PR兼容性验证通过" if passed else (
+                f" 可能存在兼容性问题: {video_info['codec_name']} / {video_info['profile']} / {video_info['pix_fmt']}"
+            )
+    return result
+
+def handle_extract(job):
+    params = job['params']
+    media_info, duration = probe_media(params['input_path'])
+    cmd = build_extract_command(params['input_path'], params['output_path'], params['bitrate'],
+                                first_audio_stream(media_info), params.get('audio_filter'))
+    run_tracked(job['id'], cmd, duration, timeout=job_timeout(job))
+    size = os.path.getsize(params['output_path']) / 1024 / 1024
+    return {'output_path': params['output_path'], 'mime': 'audio/mpeg', 'summary': f"✅ Done！文件大小: {size:.2f} MB"}
+
+def handle_multi(job):
+    """一次解码产出多个MP3/MP4；已缓存或可原生faststart的输出不进入ffmpeg"""
+    params = job['params']
+    input_path = params['input_path']
+    media_info, duration = probe_media(input_path)
+
+    results = [None] * len(params['outputs'])
+    pending = []
+    for i, ((kind, single), output) in enumerate(zip(result_cache.output_equivalents(params), params['outputs'])):
+        cached = result_cache.lookup(kind, single)
+        if cached is not None:
+            results[i] = dict(cached, format=output['format'])
+        elif output['format'] == 'mp4' and converter_module.VideoConverter(output['config']).try_native_faststart(
+                input_path, output['output_path']):
+            results[i] = {'output_path': output['output_path'], 'format': 'mp4', 'mime': MIME_TYPES['mp4'],
+                          'summary': "moov已原生移动到文件开头，无需ffmpeg重新封装"}
+        else:
+            pending.append(i)
+
+    if pending:
+        outputs = [params['outputs'][i] for i in pending]
+        run_tracked(job['id'], build_multi_output_command(input_path, outputs, media_info), duration,
+                    timeout=job_timeout(job))
+        for i, output in zip(pending, outputs):
+            size = os.path.getsize(output['output_path']) / 1024 / 1024
+            results[i] = {'output_path': output['output_path'], 'format': output['format'],
+                          'mime': MIME_TYPES[output['format']],
+                          'summary': f"{describe_output(output, media_info)} · {size:.2f} MB"}
+
+    reused = len(results) - len(pending)
+    summary = f"✅ 单次解码完成 {len(pending)} 个输出" if pending else "✅ 全部输出复用已有结果"
+    if pending and reused:
+        summary += f"，{reused} 个复用已有结果"
+    return {'outputs': results, 'summary': summary}
+
+def handle_fix(job):
+    params = job['params']
+    summary = ""
+    if params.get('fix_type') == 'ranges':
+        def on_progress(fraction):
+            if job_queue.update_progress(job['id'], fraction, "正在重新编码受损片段"):
+                raise JobCancelled()
+
+        seconds = repair_ranges(params['input_path'], params['output_path'], params['ranges'], on_progress)
+        summary = f"（仅重新编码 {seconds} 秒）"
+    elif params.get('fix_type') == 'timestamps':
+        media_info, duration = probe_media(params['input_path'])
+        cmd = repair_command(params['input_path'], params['output_path'], params['repair'], media_info)
+        run_tracked(job['id'], cmd, duration, timeout=job_timeout(job))
+    elif not try_relocate(params['input_path'], params['output_path']):
+        # 原生重定位不适用时以ffmpeg重新封装，与其他任务一样可取消、受超时限制
+        if job_queue.update_progress(job['id'], 0.0, "正在以ffmpeg重新封装"):
+            raise JobCancelled()
+        try:
+            duration = probe_media(params['input_path'])[1]
+        except Exception:
+            duration = 0.0  # moov损坏时可能探测不到时长，只是不显示百分比
+        run_tracked(job['id'], remux_command(params['input_path'], params['output_path']), duration,
+                    kind=REMUX, timeout=job_timeout(job))
+    remaining = len(run_detection(params['output_path'], params.get('deep_scan', False),
+                                  timestamps=params.get('timestamps', False))[0])
+    fixed = remaining < params['error_count']
+    return {
+        'output_path': params['output_path'],
+        'mime': 'video/mp4',
+        'fixed': fixed,
+        'summary': ("🎉 修复成功！" if fixed else "⚠️ 部分问题未能完全修复") + summary,
+    }
+
+def handle_rebuild(job):
+    """用参考文件重建录制中断文件的moov，扫描进度写回任务"""
+    params = job['params']
+
+    def on_progress(fraction):
+        if job_queue.update_progress(job['id'], fraction, f"正在扫描媒体数据 {fraction:.0%}"):
+            raise JobCancelled()
+
+    stats = rebuild_moov(params['input_path'], params['reference_path'], params['output_path'], on_progress,
+                         video_only=params.get('video_only', False))
+    audio = {
+        'recovered': "音频已恢复",
+        'dropped': "未恢复音频（只恢复视频）" if params.get('video_only') else "未找到可恢复的音频",
+        'rejected': "音频帧解码校验未通过，未恢复音频",
+        'none': "无音频",
+    }[stats['audio']]
+    if stats['audio'] == 'recovered' and stats['audio_failed_frames']:
+        audio += f"（{stats['audio_failed_frames']} 个音频帧解码失败）"
+    return {
+        'output_path': params['output_path'],
+        'mime': 'video/mp4',
+        'stats': stats,
+        'summary': f"🎉 已恢复 {stats['recovered_seconds']} 秒（{stats['video_frames']} 帧），{audio}",
+    }
+
+def handle_trim(job):
+    """按关键帧裁剪：PR兼容模式下重新编码切点所在的GOP，快速模式下切点对齐到关键帧"""
+    params = job['params']
+    converter = converter_module.VideoConverter(params['config'])
+
+    def on_progress(fraction):
+        if job_queue.update_progress(job['id'], fraction, "正在裁剪"):
+            raise JobCancelled()
+
+    stats = smart_cut(converter, params['input_path'], params['output_path'], params['start'], params.get('end'),
+                      snap=not params['config']['pr_compat_mode'], on_progress=on_progress)
+    return {
+        'output_path': params['output_path'],
+        'mime': 'video/mp4',
+        'stats': stats,
+        'summary': (f"✂️ 已裁剪 {stats['duration']} 秒：{stats['copied']} 秒无损复制，"
+                    f"{stats['encoded']} 秒重新编码，耗时 {stats['wall_time']}s"),
+    }
+
+def handle_split(job):
+    """按时长或大小在关键帧处无损分割，一次流复制写出全部分段"""
+    params = job['params']
+    media_info, duration = probe_media(params['input_path'])
+    cuts = plan_split(params['input_path'], duration, params.get('max_seconds'), params.get('max_bytes'),
+                      media_start_time(media_info))
+    run_tracked(job['id'], split_command(params['input_path'], params['output_dir'], cuts, duration), duration,
+                kind=REMUX, timeout=job_timeout(job))
+    outputs = [{'output_path': str(path), 'format': 'mp4', 'mime': 'video/mp4',
+                'summary': f"{path.name} · {path.stat().st_size / 1024 / 1024:.2f} MB"}
+               for path in split_outputs(params['input_path'], params['output_dir'])]
+    return {'outputs': outputs, 'summary': f"✅ 已在关键帧处无损分割为 {len(outputs)} 段"}
+
+HANDLERS = {
+    'convert': handle_convert,
+    'extract': handle_extract,
+    'multi': handle_multi,
+    'fix': handle_fix,
+    'rebuild': handle_rebuild,
+    'trim': handle_trim,
+    'split': handle_split,
+}
+
+# ==================== worker 服务 ====================
+class WorkerService:
+    """从SQLite队列领取任务的后台worker池，与Streamlit脚本重跑无关"""
+
+    def __init__(self, max_workers=None, limits=None, poll_interval=1.0):
+        self.limits = limits or default_limits()
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 1) // 2)
+        self.poll_interval = poll_interval
+        self.active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        job_queue.requeue_orphans()
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._work_loop, name=f"videotool-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name="videotool-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                active = list(self.active)
+            job_queue.heartbeat(active)
+            job_queue.requeue_orphans()
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            job = job_queue.claim_next(self.limits, self.max_workers)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        with self._lock:
+            self.active.add(job['id'])
+        try:
+            with job_metrics.collect(job['kind'], job['params'].get('input_path'), job.get('profile')) as metrics:
+                try:
+                    result = HANDLERS[job['kind']](job)
+                except JobCancelled:
+                    metrics.status = job_queue.CANCELLED
+                    raise
+                metrics.observe_outputs(*[o['output_path'] for o in result.get('outputs') or [result]])
+            # 先写缓存再标记完成：提交方（如监视目录）看到完成后可能立即移走输出文件
+            if result.get('fixed', True) and not self.cache_result(job, result):
+                result['summary'] += "（结果缓存写入失败，相同任务下次会重新处理）"
+            job_queue.finish(job['id'], job_queue.DONE, result=result)
+        except JobCancelled:
+            job_queue.finish(job['id'], job_queue.CANCELLED)
+        except Exception as e:
+            job_queue.finish(job['id'], job_queue.FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self.active.discard(job['id'])
+
+    def cache_result(self, job, result):
+        """写入结果缓存，成功时返回 True；缓存失败不影响任务本身，记录日志并在结果摘要中注明"""
+        try:
+            result_cache.store(job['kind'], job['params'], result)
+        except Exception:
+            logger.exception("任务 %s 的结果缓存写入失败", job['id'])
+            return False
+        return True
+
+# ==================== 命令行入口 ====================
+def main():
+    parser = argparse.ArgumentParser(description="视频任务worker服务")
+    parser.add_argument("--workers", type=int, help="同时运行的任务总数上限")
+    parser.add_argument("--convert", type=int, help="转换任务并发上限")
+    parser.add_argument("--extract", type=int, help="提取任务并发上限")
+    parser.add_argument("--fix", type=int, help="修复任务并发上限")
+    parser.add_argument("--multi", type=int, help="多输出任务并发上限")
+    parser.add_argument("--rebuild", type=int, help="moov重建任务并发上限")
+    parser.add_argument("--trim", type=int, help="裁剪任务并发上限")
+    parser.add_argument("--split", type=int, help="分割任务并发上限")
+    args = parser.parse_args()
+
+    limits = default_limits()
+    for kind in limits:
+        if getattr(args, kind):
+            limits[kind] = getattr(args, kind)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    service = WorkerService(max_workers=args.workers, limits=limits).start()
+    print(f"worker已启动：{service.max_workers} 个并发，上限 {limits}，数据库 {job_queue.DB_PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("正在停止worker，等待运行中的任务完成...")
+        service.stop()
+
+if __name__ == "__main__":
+    main()
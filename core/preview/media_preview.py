@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from core.cache.media_cache import CACHE_ROOT, content_hash
+from core.process.async_runner import run, REMUX, ENCODE, ProcessError
+from core.process.ffmpeg_capabilities import AAC_ENCODERS, H264_ENCODERS, pick_encoder, MissingCapability
+from core.fix.slice_scan import probe_media_info, media_duration
+from core.staging.upload_staging import stage_upload
+
+PREVIEW_ROOT = CACHE_ROOT / "previews"
+MAX_ENTRIES = 200     # 预览缓存条目上限，超过时按最近访问时间淘汰
+THUMB_COUNT = 8       # 缩略图数量
+THUMB_WIDTH = 320
+PROXY_SEC = 10        # 代理片段时长(秒)
+PROXY_HEIGHT = 240
+
+_lock = threading.Lock()
+
+# ==================== 生成 ====================
+def thumbnail_command(input_path, time, output_path):
+    """只解码 time 之前最近的一个关键帧（-skip_frame nokey + 非精确seek）"""
+    return ["ffmpeg", "-y", "-v", "error", "-skip_frame", "nokey", "-noaccurate_seek",
+            "-ss", f"{time:.3f}", "-i", str(input_path),
+            "-frames:v", "1", "-vf", f"scale={THUMB_WIDTH}:-2", "-q:v", "5", str(output_path)]
+
+def proxy_command(input_path, output_path):
+    """开头 PROXY_SEC 秒的低分辨率、低码率代理片段"""
+    encoder = pick_encoder(H264_ENCODERS, "H.264", allow_hardware=False)
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(input_path), "-t", str(PROXY_SEC),
+           "-map", "0:v:0", "-map", "0:a:0?",
+           "-vf", f"scale=-2:{PROXY_HEIGHT}", "-pix_fmt", "yuv420p", "-c:v", encoder]
+    if encoder == "libx264":
+        cmd += ["-preset", "ultrafast", "-crf", "32"]
+    cmd += ["-maxrate", "400k", "-bufsize", "800k",
+            "-c:a", pick_encoder(AAC_ENCODERS, "AAC"), "-b:a", "64k", "-ac", "1",
+            "-movflags", "+faststart", str(output_path)]
+    return cmd
+
+def generate(input_path, entry_dir):
+    """在 entry_dir 中生成缩略图与代理片段，返回 meta；单个缩略图失败时跳过"""
+    media_info = probe_media_info(input_path)
+    duration = media_duration(media_info)
+    if not any(s['codec_type'] == 'video' for s in media_info['streams']):
+        return {'duration': duration, 'thumbnails': [], 'proxy': None}
+
+    times = [duration * (i + 0.5) / THUMB_COUNT for i in range(THUMB_COUNT)] if duration else [0.0]
+
+    def thumbnail(i, time):
+        name = f"thumb_{i:02d}.jpg"
+        result = run(thumbnail_command(input_path, time, entry_dir / name), kind=REMUX, check=False)
+        return {'time': round(time, 2), 'file': name} if result.returncode == 0 and (entry_dir / name).exists() else None
+
+    # 每张缩略图一个ffmpeg，只seek并解码一帧，可以并发
+    with ThreadPoolExecutor(max_workers=THUMB_COUNT) as pool:
+        thumbnails = [t for t in pool.map(thumbnail, range(len(times)), times) if t]
+
+    proxy = "proxy.mp4"
+    try:
+        run(proxy_command(input_path, entry_dir / proxy), kind=ENCODE)
+    except (ProcessError, MissingCapability):
+        proxy = None
+    if not thumbnails and proxy is None:
+        raise RuntimeError("无法解码视频关键帧")  # 不缓存失败结果
+    return {'duration': duration, 'thumbnails': thumbnails, 'proxy': proxy}
+
+def evict(max_entries=MAX_ENTRIES):
+    entries = sorted((p for p in PREVIEW_ROOT.iterdir() if p.is_dir() and not p.name.endswith('.tmp')),
+                     key=lambda p: p.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - max_entries)]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+def build_preview(input_path):
+    """按内容哈希缓存的预览：{'duration', 'thumbnails': [{'time', 'path'}], 'proxy': 路径或 None}"""
+    entry = PREVIEW_ROOT / content_hash(input_path)
+    meta_path = entry / "preview.json"
+    try:
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        os.utime(entry)  # 记录最近访问时间
+    except (OSError, ValueError):
+        tmp_entry = entry.with_name(entry.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        tmp_entry.mkdir(parents=True)
+        try:
+            meta = generate(input_path, tmp_entry)
+            (tmp_entry / "preview.json").write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+            with _lock:
+                shutil.rmtree(entry, ignore_errors=True)
+                os.replace(tmp_entry, entry)
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        evict()
+
+    return {
+        'duration': meta['duration'],
+        'thumbnails': [{'time': t['time'], 'path': str(entry / t['file'])} for t in meta['thumbnails']],
+        'proxy': str(entry / meta['proxy']) if meta['proxy'] else None,
+    }
+
+# ==================== 页面组件 ====================
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}"
+
+def preview_panel(uploaded_file, auto=True):
+    """关键帧缩略图条 + 低码率代理片段，浏览器只需下载几百KB，而不是整个上传文件
+
+    auto=False 时点击按钮后才生成（避免为预览把上传文件写入磁盘，如MP3流式提取）。
+    """
+    state_key = f"preview-{uploaded_file.file_id}"
+    if not auto and not st.session_state.get(state_key):
+        if not st.button("🎞️ 生成预览", key=f"{state_key}-button", use_container_width=True):
+            return
+        st.session_state[state_key] = True
+
+    try:
+        with st.spinner("正在生成预览..."):
+            preview = build_preview(stage_upload(uploaded_file))
+    except Exception as e:
+        st.warning(f"预览生成失败: {e}")
+        return
+
+    if preview['thumbnails']:
+        st.image([t['path'] for t in preview['thumbnails']],
+                 caption=[format_time(t['time']) for t in preview['thumbnails']],
+                 width=THUMB_WIDTH // 2)
+    if preview['proxy']:
+        st.video(preview['proxy'])
+        st.caption(f"预览为开头 {PROXY_SEC} 秒的低码率代理片段，总时长 {format_time(preview['duration'])}")
+    elif not preview['thumbnails']:
+        st.info("该文件没有视频流，无法预览")
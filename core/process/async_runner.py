@@ -0,0 +1,317 @@
+import asyncio
+import inspect
+import os
+import queue
+import subprocess
+import threading
+import time
+
+# 进程类别：探测类(ffprobe)轻量可高并发，封装类以I/O为主，编码/解码类占满CPU需要限流
+PROBE, REMUX, ENCODE = "probe", "remux", "encode"
+
+PROBE_TIMEOUT = 60          # 探测类默认超时(秒)
+STREAM_LIMIT = 1024 * 1024  # 单行输出上限，超长行不会让读取失败
+CHUNK_SIZE = 256 * 1024     # 按块读取二进制输出时的块大小
+STREAM_QUEUE_SIZE = 64      # 流式读取时缓冲的行/块数上限，调用方读得慢时暂停读取子进程输出
+USAGE_INTERVAL = 0.25       # 采样子进程CPU时间与峰值内存的间隔(秒)
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def default_limits(cores=None):
+    """各类进程的全局并发上限，可用环境变量覆盖"""
+    cores = cores or os.cpu_count() or 1
+    return {
+        PROBE: int(os.environ.get("VIDEOTOOL_PROBE_CONCURRENCY", max(4, cores * 2))),
+        REMUX: int(os.environ.get("VIDEOTOOL_REMUX_CONCURRENCY", max(1, min(cores * 2, 16)))),
+        ENCODE: int(os.environ.get("VIDEOTOOL_ENCODE_CONCURRENCY", max(1, cores))),
+    }
+
+class ProcessError(RuntimeError):
+    """子进程以非零状态退出；消息为stderr末尾，便于直接展示"""
+
+    def __init__(self, cmd, returncode, stderr=b''):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        message = stderr.decode('utf-8', errors='replace')[-2000:] if stderr else ''
+        super().__init__(message or f"{cmd[0]} 退出码 {returncode}")
+
+class ProcessTimeout(ProcessError):
+    """超过超时时间，子进程已被终止"""
+
+class ProcessResult:
+    def __init__(self, cmd, returncode, stdout, stderr, wall_sec=None, cpu_sec=None, peak_rss_kb=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_sec = wall_sec
+        self.cpu_sec = cpu_sec          # 仅Linux：最后一次采样的累计CPU时间
+        self.peak_rss_kb = peak_rss_kb  # 仅Linux：VmHWM
+
+    def text(self, stream='stdout'):
+        return getattr(self, stream).decode('utf-8', errors='replace')
+
+def read_proc_usage(pid):
+    """读取子进程累计CPU时间(秒)与峰值RSS(KB)；非Linux或进程已退出时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            peak_rss = next((int(line.split()[1]) for line in f if line.startswith('VmHWM:')), None)
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK, peak_rss
+    except (OSError, ValueError, IndexError):
+        return None
+
+async def discard(reader):
+    while await reader.read(CHUNK_SIZE):
+        pass
+
+# ==================== 事件循环 ====================
+class AsyncRunner:
+    """在后台线程的事件循环中运行ffmpeg/ffprobe
+
+    按类别用有界信号量限制全局并发，支持超时与取消（取消时终止子进程），
+    stdout/stderr 以流的方式读取，不会因管道写满而阻塞子进程。
+    同步代码（Streamlit页面、worker线程）通过 run / stream 调用。
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or default_limits()
+        self._loop = None
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.listeners = []  # 同步接口完成一个进程后以 ProcessResult 回调（在调用方线程中）
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="videotool-process-loop", daemon=True).start()
+                self._semaphores = {kind: asyncio.BoundedSemaphore(limit) for kind, limit in self.limits.items()}
+                self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """把协程提交到后台事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def run_async(self, cmd, kind=PROBE, timeout=None, on_line=None, merge_stderr=False, check=True,
+                        stdin_chunks=None, on_chunk=None):
+        """运行命令直到结束
+
+        传入 on_line / on_chunk 时逐行 / 按块回调stdout（不再保留stdout），回调可以是协程函数，
+        等待期间不再读取stdout（背压）；回调抛出的异常会终止子进程并向上传播。
+        stdin_chunks 为可迭代的字节块，在线程池中逐块取出（可能读磁盘）后依次写入stdin。
+        """
+        async with self._semaphores[kind]:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.DEVNULL if stdin_chunks is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                limit=STREAM_LIMIT,
+            )
+            stdout, stderr = bytearray(), bytearray()
+            started = time.monotonic()
+            usage = [None, None]
+
+            async def deliver(callback, data):
+                result = callback(data)
+                if inspect.isawaitable(result):
+                    await result
+
+            async def read_stdout():
+                if on_chunk is not None:
+                    while chunk := await process.stdout.read(CHUNK_SIZE):
+                        await deliver(on_chunk, chunk)
+                elif on_line is not None:
+                    async for line in process.stdout:
+                        await deliver(on_line, line)
+                else:
+                    stdout.extend(await process.stdout.read())
+
+            async def read_stderr():
+                stderr.extend(await process.stderr.read())
+
+            async def write_stdin():
+                loop = asyncio.get_running_loop()
+                chunks = iter(stdin_chunks)
+                try:
+                    # 取块可能阻塞（读文件、读上传缓冲），放到线程池中，不占用事件循环
+                    while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()  # 背压：子进程读得慢时等待
+                    process.stdin.close()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 子进程提前退出，错误由返回码体现
+
+            async def sample_usage():
+                while process.returncode is None:
+                    sample = read_proc_usage(process.pid)
+                    if sample is None:
+                        return
+                    usage[0] = sample[0]
+                    usage[1] = max(usage[1] or 0, sample[1] or 0) or None
+                    await asyncio.sleep(USAGE_INTERVAL)
+
+            readers = [read_stdout()] if merge_stderr else [read_stdout(), read_stderr()]
+            if stdin_chunks is not None:
+                readers.append(write_stdin())
+            sampler = asyncio.ensure_future(sample_usage())
+            try:
+                await asyncio.wait_for(asyncio.gather(*readers, process.wait()), timeout)
+            except asyncio.TimeoutError:
+                raise ProcessTimeout(cmd, None, bytes(stderr) or f"超过 {timeout} 秒未完成".encode('utf-8'))
+            finally:
+                # 超时、取消或回调异常时终止子进程
+                sampler.cancel()
+                if process.returncode is None:
+                    process.kill()
+                    # 读取因背压暂停时管道不会关闭，wait() 会一直等待；丢弃剩余输出直到EOF
+                    pipes = [pipe for pipe in (process.stdout, process.stderr) if pipe is not None]
+                    await asyncio.gather(process.wait(), *(discard(pipe) for pipe in pipes))
+
+        result = ProcessResult(cmd, process.returncode, bytes(stdout), bytes(stderr),
+                               time.monotonic() - started, usage[0], usage[1])
+        if check and result.returncode != 0:
+            raise ProcessError(cmd, result.returncode, result.stderr or result.stdout[-4000:])
+        return result
+
+    # ==================== 同步接口 ====================
+    def run(self, cmd, kind=PROBE, timeout=None, merge_stderr=False, check=True):
+        """阻塞运行并返回 ProcessResult；探测类默认带超时"""
+        if timeout is None and kind == PROBE:
+            timeout = PROBE_TIMEOUT
+        future = self.submit(self.run_async(cmd, kind, timeout, merge_stderr=merge_stderr, check=check))
+        try:
+            result = future.result()
+        except BaseException:
+            future.cancel()  # 调用方被中断时一并终止子进程
+            raise
+        self.notify(result)
+        return result
+
+    def run_all(self, cmds, kind=ENCODE, timeout=None):
+        """并发运行多条命令，按完成顺序产出 (序号, ProcessResult)
+
+        任一命令失败、调用方中断或提前关闭生成器时，终止其余子进程并等待它们退出后再返回。
+        """
+        finished = queue.Queue()
+        started, stopped = threading.Event(), threading.Event()
+
+        async def supervise():
+            started.set()
+            tasks = [asyncio.ensure_future(self.run_async(cmd, kind, timeout)) for cmd in cmds]
+            for i, task in enumerate(tasks):
+                task.add_done_callback(lambda task, i=i: finished.put((i, task)))
+            try:
+                # 出错的结果经队列交给调用方，这里只负责在首个失败后停止其余进程
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # 清理途中自身也可能被取消，直到所有子进程都已退出才算结束
+                while not all(task.done() for task in tasks):
+                    try:
+                        await asyncio.wait(tasks)
+                    except asyncio.CancelledError:
+                        continue
+                for task in tasks:
+                    if not task.cancelled():
+                        task.exception()  # 已由调用方或队列处理，避免 "never retrieved" 警告
+                stopped.set()
+
+        future = self.submit(supervise())
+        try:
+            for _ in cmds:
+                i, task = finished.get()
+                if task.cancelled():
+                    raise ProcessError(cmds[i], None, "进程被取消".encode('utf-8'))
+                result = task.result()
+                self.notify(result)
+                yield i, result
+        finally:
+            future.cancel()
+            if started.is_set():
+                stopped.wait()
+
+    def notify(self, result):
+        for listener in self.listeners:
+            listener(result)
+
+    def stream(self, cmd, kind=ENCODE, timeout=None, merge_stderr=True, check=False, stdin_chunks=None, binary=False):
+        """逐行（binary=True 时按块）读取输出的进程；需在 with 语句中使用，提前退出时子进程会被终止"""
+        return ProcessStream(self, cmd, kind, timeout, merge_stderr, check, stdin_chunks, binary)
+
+_DONE = object()
+
+class ProcessStream:
+    """在调用方线程中迭代子进程输出，迭代结束后 result 为 ProcessResult
+
+    输出经有界的 asyncio.Queue 交给调用方：队列满时事件循环暂停读取stdout，
+    管道写满后ffmpeg随之等待，调用方处理得慢也不会在内存中堆积输出。
+    """
+
+    def __init__(self, runner, cmd, kind, timeout, merge_stderr, check, stdin_chunks=None, binary=False):
+        self.cmd = cmd
+        self.result = None
+        self._runner = runner
+        self._loop = runner._ensure_loop()
+        self._lines = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._closed = False
+        callbacks = {'on_chunk': self._lines.put} if binary else {'on_line': self._lines.put}
+        self._future = runner.submit(self._produce(
+            runner.run_async(cmd, kind, timeout, merge_stderr=merge_stderr, check=check,
+                             stdin_chunks=stdin_chunks, **callbacks)
+        ))
+
+    async def _produce(self, coro):
+        try:
+            return await coro
+        finally:
+            if not self._closed:  # 调用方已关闭时没有人再读取，不再等待队列空位
+                await self._lines.put(_DONE)
+
+    async def _next_batch(self):
+        """等待至少一项，并取走队列中已有的其余项，减少跨线程往返"""
+        batch = [await self._lines.get()]
+        while not self._lines.empty():
+            batch.append(self._lines.get_nowait())
+        return batch
+
+    def __iter__(self):
+        while True:
+            future = asyncio.run_coroutine_threadsafe(self._next_batch(), self._loop)
+            try:
+                batch = future.result()
+            except BaseException:
+                future.cancel()
+                raise
+            for line in batch:
+                if line is _DONE:
+                    self.result = self._future.result()
+                    self._runner.notify(self.result)
+                    return
+                yield line
+
+    @property
+    def returncode(self):
+        return self.result.returncode if self.result else None
+
+    def close(self):
+        """取消仍在运行的子进程"""
+        self._closed = True
+        if not self._future.done():
+            self._future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# 进程内共享的运行器
+runner = AsyncRunner()
+run = runner.run
+run_all = runner.run_all
+stream = runner.stream
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from core.cache.media_cache import CACHE_ROOT
+from core.process.async_runner import run, ProcessError
+
+# 可单独指定，让使用临时缓存目录的进程（如基准测试）共用同一份探测结果
+CAPABILITIES_PATH = Path(os.environ.get("VIDEOTOOL_CAPABILITIES_PATH", CACHE_ROOT / "ffmpeg_capabilities.json"))
+
+# 按速度从快到慢排列的候选编码器；硬件编码器需要实际试编码一帧才算可用
+H264_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf", "libx264"]
+HARDWARE_ENCODERS = {"h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf"}
+MP3_ENCODERS = ["libmp3lame", "mp3_mf", "libshine"]
+AAC_ENCODERS = ["aac", "libfdk_aac", "aac_mf", "aac_at"]
+
+class MissingCapability(RuntimeError):
+    """安装的ffmpeg缺少所需的编码器/封装器等"""
+
+# ==================== 探测 ====================
+def parse_codec_list(text):
+    """解析 -encoders / -decoders 输出：分隔线之后每行为 '标志 名称 描述'"""
+    names, started = set(), False
+    for line in text.splitlines():
+        if line.strip().startswith('------'):
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2:
+            names.add(parts[1])
+    return names
+
+def parse_muxers(text):
+    """解析 -muxers 输出：'--' 分隔线之后每行为 '标志 名称[,别名] 描述'"""
+    names, started = set(), False
+    for line in text.splitlines():
+        if line.strip() == '--':
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2 and 'E' in parts[0]:
+            names.update(parts[1].split(','))
+    return names
+
+def parse_hwaccels(text):
+    return [line.strip() for line in text.splitlines()[1:] if line.strip()]
+
+def encoder_works(encoder):
+    """用lavfi生成几帧试编码，确认硬件编码器在本机真正可用（驱动/GPU存在）"""
+    cmd = ["ffmpeg", "-hide_banner", "-v", "error",
+           "-f", "lavfi", "-i", "color=size=256x256:rate=30:duration=0.2",
+           "-c:v", encoder, "-f", "null", "-"]
+    try:
+        return run(cmd, timeout=20, check=False).returncode == 0
+    except (OSError, ProcessError):
+        return False
+
+def probe_capabilities():
+    """运行ffmpeg查询版本、编解码器、硬件加速与封装器"""
+    def query(flag):
+        return run(["ffmpeg", "-hide_banner", flag]).text()
+
+    encoders = parse_codec_list(query("-encoders"))
+    version = query("-version").splitlines()
+    return {
+        'version': version[0] if version else None,
+        'encoders': sorted(encoders),
+        'decoders': sorted(parse_codec_list(query("-decoders"))),
+        'hwaccels': parse_hwaccels(query("-hwaccels")),
+        'muxers': sorted(parse_muxers(query("-muxers"))),
+        'working_hw_encoders': [e for e in H264_ENCODERS if e in HARDWARE_ENCODERS and e in encoders
+                                and encoder_works(e)],
+    }
+
+def binary_key():
+    """ffmpeg可执行文件的路径、大小与修改时间，升级ffmpeg后自动重新探测"""
+    path = shutil.which("ffmpeg")
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+def capabilities():
+    """每个进程只探测一次（加锁，多个线程同时首次调用时不会重复探测），找不到ffmpeg时返回空能力"""
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None:
+            _capabilities = load_capabilities()
+        return _capabilities
+
+def load_capabilities():
+    """读取磁盘缓存，ffmpeg可执行文件变化或没有缓存时重新探测"""
+    key = binary_key()
+    if key is None:
+        return {'version': None, 'encoders': [], 'decoders': [], 'hwaccels': [], 'muxers': [],
+                'working_hw_encoders': []}
+
+    try:
+        cached = json.loads(CAPABILITIES_PATH.read_text(encoding='utf-8'))
+        if cached.get('key') == key:
+            return cached['capabilities']
+    except (OSError, ValueError):
+        pass
+
+    caps = probe_capabilities()
+    CAPABILITIES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CAPABILITIES_PATH.with_name(CAPABILITIES_PATH.name + f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({'key': key, 'capabilities': caps}, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp_path, CAPABILITIES_PATH)
+    return caps
+
+# ==================== 查询 ====================
+def has_encoder(name):
+    return name in capabilities()['encoders']
+
+def has_muxer(name):
+    return name in capabilities()['muxers']
+
+def pick_encoder(candidates, what, allow_hardware=True):
+    """从候选中选第一个可用的编码器（最快的在前），都不可用时提前报错"""
+    caps = capabilities()
+    for name in candidates:
+        if name in HARDWARE_ENCODERS:
+            if allow_hardware and name in caps['working_hw_encoders']:
+                return name
+        elif name in caps['encoders']:
+            return name
+    if caps['version'] is None:
+        raise MissingCapability("未找到ffmpeg，请先安装并加入PATH")
+    raise MissingCapability(f"安装的ffmpeg缺少{what}编码器（需要以下之一: {', '.join(candidates)}）")
+
+def require_muxer(name):
+    if not has_muxer(name):
+        raise MissingCapability(f"安装的ffmpeg缺少 {name} 封装器")
+
+def hwaccel_args():
+    """有可用的硬件解码方式时才传 -hwaccel auto"""
+    return ["-hwaccel", "auto"] if capabilities()['hwaccels'] else []
@@ -0,0 +1,171 @@
+import gc
+import hashlib
+import html
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+
+import streamlit as st
+import tornado.web
+
+from core.cache.media_cache import write_full_hash
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKSPACE_ROOT = Path(os.environ.get("VIDEOTOOL_WORKSPACE", ROOT_DIR / "workspace"))
+# 发布的下载文件；由注册在Streamlit Tornado服务上的下载路由分块发送
+DOWNLOAD_ROOT = ROOT_DIR / "static" / "downloads"
+DOWNLOAD_ROUTE = "videotool/downloads"
+# 找不到Tornado服务时退回Streamlit静态文件服务（需在 .streamlit/config.toml 中开启 enableStaticServing）：
+# 它对超过 200MB 的文件直接返回404，非图片/PDF/文本类的扩展名统一以 text/plain + nosniff 发送
+STATIC_URL_PREFIX = "app/static/downloads"
+STATIC_SERVING_LIMIT = 200 * 1024 * 1024
+
+MAX_AGE_SEC = 24 * 3600  # 工作区与下载文件的保留时长
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# ==================== 会话工作区 ====================
+def purge_expired(root, max_age=MAX_AGE_SEC):
+    """删除超过保留时长的子目录"""
+    if not root.exists():
+        return
+    deadline = time.time() - max_age
+    for entry in root.iterdir():
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < deadline:
+                shutil.rmtree(entry, ignore_errors=True)
+        except OSError:
+            continue
+
+def session_workspace():
+    """当前会话的工作目录，整个会话内复用"""
+    workspace = st.session_state.get('workspace')
+    if workspace is None or not Path(workspace).exists():
+        purge_expired(WORKSPACE_ROOT)
+        workspace = WORKSPACE_ROOT / uuid.uuid4().hex
+        workspace.mkdir(parents=True, exist_ok=True)
+        st.session_state.workspace = workspace
+        st.session_state.staged_uploads = {}
+    return Path(workspace)
+
+def stage_upload(uploaded_file):
+    """将上传文件写入会话工作区一次，之后检测/修复/转换都复用同一路径"""
+    workspace = session_workspace()
+    staged = st.session_state.staged_uploads
+    path = staged.get(uploaded_file.file_id)
+    if path is not None and Path(path).exists():
+        return Path(path)
+
+    upload_dir = workspace / uploaded_file.file_id
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    path = upload_dir / Path(uploaded_file.name).name
+    buffer = uploaded_file.getbuffer()  # memoryview，不产生额外的内存副本
+    with open(path, 'wb') as f:
+        f.write(buffer)
+    # 数据已在内存中，顺便算出完整内容哈希供结果缓存使用，之后无需再读一遍文件
+    write_full_hash(path, hashlib.blake2b(buffer, digest_size=16).hexdigest())
+    staged[uploaded_file.file_id] = path
+    return path
+
+def new_output_path(input_path, file_name):
+    """为每个任务分配独立的输出目录，并发任务与已发布的下载互不覆盖"""
+    output_dir = Path(input_path).parent / f"out-{uuid.uuid4().hex[:8]}"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir / file_name
+
+# ==================== 磁盘流式下载 ====================
+class DownloadHandler(tornado.web.StaticFileHandler):
+    """从 DOWNLOAD_ROOT 分块发送结果文件，支持 Range 请求（断点续传），不整体读入内存"""
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        # 默认实现为计算ETag读完整个文件；发布的文件不会被修改，大小与mtime即可
+        stat = os.stat(abspath)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def set_extra_headers(self, path):
+        self.set_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(Path(path).name)}")
+        self.set_header("X-Content-Type-Options", "nosniff")
+
+_route_lock = threading.Lock()
+_route_registered = None
+
+def register_download_route():
+    """在Streamlit的Tornado服务上注册下载路由（每个进程一次），找不到服务时返回 False"""
+    global _route_registered
+    with _route_lock:
+        if _route_registered is None:
+            # Streamlit 没有公开其 Tornado Application，从已创建的对象中找到它
+            app = next((o for o in gc.get_objects() if isinstance(o, tornado.web.Application)), None)
+            if app is not None:
+                base = (st.get_option("server.baseUrlPath") or "").strip("/")
+                pattern = "/" + (re.escape(base) + "/" if base else "") + re.escape(DOWNLOAD_ROUTE) + "/(.*)"
+                # add_handlers 的规则排在Streamlit自身的路由之前
+                app.add_handlers(r".*", [(pattern, DownloadHandler, {"path": str(DOWNLOAD_ROOT)})])
+            _route_registered = app is not None
+        return _route_registered
+
+_published = {}  # (路径, mtime, 文件名, URL前缀) -> (发布的文件, URL)，避免页面重跑时重复发布
+
+def publish_download(path, file_name=None, url_prefix=DOWNLOAD_ROUTE):
+    """将结果文件发布到下载目录，返回可下载的相对URL
+
+    优先硬链接（同一文件系统上零拷贝），否则在磁盘上分块复制。
+    """
+    file_name = file_name or Path(path).name
+    memo_key = (str(path), os.stat(path).st_mtime_ns, file_name, url_prefix)
+    if memo_key in _published and _published[memo_key][0].exists():
+        return _published[memo_key][1]
+
+    purge_expired(DOWNLOAD_ROOT)
+    token = uuid.uuid4().hex
+    target = DOWNLOAD_ROOT / token / file_name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, target)
+    except OSError:
+        with open(path, 'rb') as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    url = f"{url_prefix}/{token}/{quote(file_name)}"
+    _published[memo_key] = (target, url)
+    return url
+
+def offer_download(path, label, mime, file_name=None, key=None, use_container_width=False):
+    """显示下载入口，文件由服务器直接从磁盘分块发送
+
+    优先使用下载路由（任意大小）；找不到Tornado服务时，200MB以内的文件经静态文件服务发送，
+    未开启静态服务时退回 st.download_button（文件会整体读入服务器内存）；更大的文件只显示服务器路径。
+    """
+    file_name = file_name or Path(path).name
+    small = os.path.getsize(path) <= STATIC_SERVING_LIMIT
+    if register_download_route():
+        url = publish_download(path, file_name)
+    elif small and st.get_option("server.enableStaticServing"):
+        url = publish_download(path, file_name, STATIC_URL_PREFIX)
+    elif small:
+        with open(path, 'rb') as f:
+            st.download_button(
+                label=label,
+                data=f,
+                file_name=file_name,
+                mime=mime,
+                key=key,
+                use_container_width=use_container_width
+            )
+        return
+    else:
+        st.warning(f"下载服务不可用，大文件不经内存发送，请从服务器路径获取: {path}")
+        return
+
+    width = "width: 100%; " if use_container_width else ""
+    st.markdown(
+        f'<a class="download-link" href="{url}" download="{html.escape(file_name)}" '
+        f'style="{width}display: inline-block; text-align: center; padding: 0.4rem 0.8rem; '
+        f'border: 1px solid rgba(49, 51, 63, 0.2); border-radius: 0.5rem; '
+        f'text-decoration: none;">{label}</a>',
+        unsafe_allow_html=True
+    )
@@ -0,0 +1,428 @@
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from core.cache.media_cache import CACHE_ROOT, media_cache
+from core.process.async_runner import runner
+
+METRICS_DIR = Path(os.environ.get("VIDEOTOOL_METRICS_DIR", CACHE_ROOT / "metrics"))
+DB_PATH = METRICS_DIR / "metrics.sqlite3"
+LOG_PATH = METRICS_DIR / "jobs.jsonl"
+PROM_PATH = Path(os.environ.get("VIDEOTOOL_PROM_FILE", METRICS_DIR / "videotool.prom"))
+
+MAX_LOG_BYTES = 50 * 1024 * 1024  # JSONL超过该大小时轮转为 .1
+QUANTILE_WINDOW = 1000            # Prometheus分位数取每类操作最近多少条记录
+QUANTILES = (0.5, 0.9, 0.99)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation TEXT NOT NULL,
+    status TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    wall_sec REAL,
+    cpu_sec REAL,
+    peak_rss_kb INTEGER,
+    speed REAL,
+    fps REAL,
+    media_sec REAL,
+    input_bytes INTEGER,
+    output_bytes INTEGER,
+    result_cache_hit INTEGER NOT NULL DEFAULT 0,
+    media_cache_hits INTEGER NOT NULL DEFAULT 0,
+    media_cache_misses INTEGER NOT NULL DEFAULT 0,
+    processes INTEGER NOT NULL DEFAULT 0,
+    profile TEXT
+);
+CREATE INDEX IF NOT EXISTS metrics_operation ON metrics(operation, finished_at);
+CREATE TABLE IF NOT EXISTS totals (
+    operation TEXT NOT NULL,
+    status TEXT NOT NULL,
+    jobs INTEGER NOT NULL DEFAULT 0,
+    wall_sec REAL NOT NULL DEFAULT 0,
+    cpu_sec REAL NOT NULL DEFAULT 0,
+    input_bytes INTEGER NOT NULL DEFAULT 0,
+    output_bytes INTEGER NOT NULL DEFAULT 0,
+    result_cache_hits INTEGER NOT NULL DEFAULT 0,
+    media_cache_hits INTEGER NOT NULL DEFAULT 0,
+    media_cache_misses INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (operation, status)
+);
+"""
+
+# Prometheus summary 的 _sum/_count：成功且未命中结果缓存的任务的累计值（与分位数的取样范围一致）
+OBSERVATIONS_SCHEMA = """
+CREATE TABLE observations (
+    operation TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    total REAL NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (operation, metric)
+)
+"""
+
+# 旧数据库缺少的列：(列名, 定义)
+MIGRATIONS = [('profile', 'TEXT')]
+
+# 导出为Prometheus summary的指标：(指标名, metrics表中的列（None为输入吞吐量）, 说明)
+SUMMARIES = [
+    ('videotool_job_speed', 'speed', "ffmpeg报告的处理速度(倍实时)"),
+    ('videotool_job_throughput_mbps', None, "输入吞吐量(MB/s)"),
+    ('videotool_job_wall_seconds', 'wall_sec', "单个任务耗时"),
+    ('videotool_job_peak_rss_kb', 'peak_rss_kb', "ffmpeg子进程峰值内存(KB)"),
+]
+THROUGHPUT_SQL = "CASE WHEN input_bytes > 0 AND wall_sec > 0 THEN input_bytes / 1048576.0 / wall_sec END"
+
+_current = contextvars.ContextVar('videotool_job_metrics', default=None)
+_write_lock = threading.Lock()
+_initialized = set()  # 本进程已建表/迁移的数据库路径
+_init_lock = threading.Lock()
+
+# ==================== 采集 ====================
+class JobMetrics:
+    """单个任务的指标；在 collect() 范围内自动汇总该线程启动的ffmpeg进程与缓存查询"""
+
+    def __init__(self, operation, input_path=None, profile=None):
+        self.operation = operation
+        self.profile = profile  # 成本模型的画像（如 convert:encode:fhd），用于按画像统计历史速度
+        self.status = None
+        self.started = time.monotonic()
+        self.cpu_sec = None
+        self.peak_rss_kb = None
+        self.processes = 0
+        self.speed = None
+        self.fps = None
+        self.media_sec = None
+        self.input_bytes = os.path.getsize(input_path) if input_path and os.path.isfile(input_path) else None
+        self.output_bytes = None
+        self.result_cache_hit = False
+        self.media_cache_hits = 0
+        self.media_cache_misses = 0
+        self._lock = threading.Lock()  # 分段编码等场景下多个线程同时汇总
+
+    def observe_process(self, result):
+        with self._lock:
+            self._add_process(result)
+
+    def _add_process(self, result):
+        self.processes += 1
+        if result.cpu_sec is not None:
+            self.cpu_sec = (self.cpu_sec or 0) + result.cpu_sec
+        if result.peak_rss_kb is not None:
+            self.peak_rss_kb = max(self.peak_rss_kb or 0, result.peak_rss_kb)
+
+    def observe_progress(self, tracker):
+        """记录ffmpeg -progress 报告的最终速度与fps"""
+        if tracker.speed > 0:
+            self.speed = tracker.speed
+        try:
+            self.fps = float(tracker.values.get('fps', '')) or self.fps
+        except ValueError:
+            pass
+        if tracker.out_time:
+            self.media_sec = tracker.out_time
+
+    def observe_outputs(self, *paths):
+        sizes = [os.path.getsize(p) for p in paths if p and os.path.isfile(p)]
+        if sizes:
+            self.output_bytes = sum(sizes)
+
+    def to_record(self):
+        wall = time.monotonic() - self.started
+        speed = self.speed
+        if speed is None and self.media_sec and wall > 0:
+            speed = self.media_sec / wall
+        return {
+            'operation': self.operation,
+            'status': self.status or 'ok',
+            'finished_at': time.time(),
+            'wall_sec': round(wall, 4),
+            'cpu_sec': round(self.cpu_sec, 3) if self.cpu_sec is not None else None,
+            'peak_rss_kb': self.peak_rss_kb,
+            'speed': round(speed, 3) if speed else None,
+            'fps': self.fps,
+            'media_sec': self.media_sec,
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+            'result_cache_hit': int(self.result_cache_hit),
+            'media_cache_hits': self.media_cache_hits,
+            'media_cache_misses': self.media_cache_misses,
+            'processes': self.processes,
+            'profile': self.profile,
+        }
+
+@contextmanager
+def collect(operation, input_path=None, profile=None):
+    """采集一次操作的指标，结束时写入；异常退出且未设置状态时记为 failed"""
+    metrics = JobMetrics(operation, input_path, profile)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    except BaseException:
+        metrics.status = metrics.status or 'failed'
+        raise
+    finally:
+        _current.reset(token)
+        try:
+            record(metrics.to_record())
+        except (OSError, sqlite3.Error):
+            logger.exception("%s 的指标写入失败", operation)  # 指标失败不影响任务本身
+
+def current():
+    """当前线程正在采集的任务指标，没有时返回 None"""
+    return _current.get()
+
+def observe_progress(tracker):
+    metrics = current()
+    if metrics is not None:
+        metrics.observe_progress(tracker)
+
+def _on_process(result):
+    metrics = current()
+    if metrics is not None:
+        metrics.observe_process(result)
+
+def _on_media_cache(hit):
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.media_cache_hits += 1
+        else:
+            metrics.media_cache_misses += 1
+
+runner.listeners.append(_on_process)
+media_cache.listeners.append(_on_media_cache)
+
+def record_cache_hit(operation, input_path=None, *output_paths):
+    """结果缓存命中的任务：不运行ffmpeg，只记录一次命中"""
+    with collect(operation, input_path) as metrics:
+        metrics.result_cache_hit = True
+        metrics.observe_outputs(*output_paths)
+
+# ==================== 存储与导出 ====================
+def init_db(db_path=DB_PATH):
+    """建表、迁移并开启WAL；每个进程每个数据库只执行一次
+
+    迁移在 BEGIN IMMEDIATE 事务中检查并执行，多个进程同时首次打开旧库时不会重复 ALTER TABLE。
+    """
+    db_path = Path(db_path)
+    with _init_lock:
+        if db_path in _initialized:
+            return
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(metrics)")}
+                for name, definition in MIGRATIONS:
+                    if name not in columns:
+                        conn.execute(f"ALTER TABLE metrics ADD COLUMN {name} {definition}")
+                conn.execute("CREATE INDEX IF NOT EXISTS metrics_profile ON metrics(profile, id)")
+                if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'observations'").fetchone():
+                    conn.execute(OBSERVATIONS_SCHEMA)
+                    # 从已有明细回填累计值
+                    for name, column, _ in SUMMARIES:
+                        expression = column or THROUGHPUT_SQL
+                        conn.execute(
+                            f"INSERT INTO observations (operation, metric, total, count) "
+                            f"SELECT operation, ?, SUM({expression}), COUNT({expression}) FROM metrics "
+                            f"WHERE status = 'ok' AND result_cache_hit = 0 AND {expression} IS NOT NULL "
+                            f"GROUP BY operation",
+                            (name,)
+                        )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        _initialized.add(db_path)
+
+def connect():
+    init_db(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def record(entry):
+    """写入SQLite明细与累计值，追加JSONL，并刷新Prometheus文本文件"""
+    with _write_lock:
+        conn = connect()
+        try:
+            columns = ', '.join(entry)
+            conn.execute(f"INSERT INTO metrics ({columns}) VALUES ({', '.join('?' * len(entry))})",
+                         list(entry.values()))
+            conn.execute(
+                "INSERT INTO totals (operation, status) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                (entry['operation'], entry['status'])
+            )
+            conn.execute(
+                "UPDATE totals SET jobs = jobs + 1, wall_sec = wall_sec + ?, cpu_sec = cpu_sec + ?, "
+                "input_bytes = input_bytes + ?, output_bytes = output_bytes + ?, "
+                "result_cache_hits = result_cache_hits + ?, media_cache_hits = media_cache_hits + ?, "
+                "media_cache_misses = media_cache_misses + ? WHERE operation = ? AND status = ?",
+                (entry['wall_sec'], entry['cpu_sec'] or 0, entry['input_bytes'] or 0, entry['output_bytes'] or 0,
+                 entry['result_cache_hit'], entry['media_cache_hits'], entry['media_cache_misses'],
+                 entry['operation'], entry['status'])
+            )
+            if entry['status'] == 'ok' and not entry['result_cache_hit']:
+                for name, column, _ in SUMMARIES:
+                    value = throughput(entry) if column is None else entry[column]
+                    if value is not None:
+                        conn.execute(
+                            "INSERT INTO observations (operation, metric, total, count) VALUES (?, ?, ?, 1) "
+                            "ON CONFLICT (operation, metric) DO UPDATE SET "
+                            "total = total + excluded.total, count = count + 1",
+                            (entry['operation'], name, value)
+                        )
+            write_prometheus(conn)
+        finally:
+            conn.close()
+
+        if LOG_PATH.exists() and LOG_PATH.stat().st_size > MAX_LOG_BYTES:
+            os.replace(LOG_PATH, LOG_PATH.with_suffix('.jsonl.1'))
+        with open(LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def percentile(values, q):
+    """线性插值分位数，values 为空时返回 None"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def throughput(row):
+    """输入吞吐量(MB/s)，缺少数据时返回 None"""
+    if row['input_bytes'] and row['wall_sec']:
+        return row['input_bytes'] / 1024 / 1024 / row['wall_sec']
+    return None
+
+def recent_rows(conn, operation, since=None, limit=QUANTILE_WINDOW):
+    query = "SELECT * FROM metrics WHERE operation = ? AND status = 'ok' AND result_cache_hit = 0"
+    args = [operation]
+    if since is not None:
+        query += " AND finished_at >= ?"
+        args.append(since)
+    query += " ORDER BY id DESC LIMIT ?"
+    args.append(limit)
+    return conn.execute(query, args).fetchall()
+
+def write_prometheus(conn):
+    """导出Prometheus文本格式（供node_exporter textfile收集器读取），原子替换"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+
+    totals = conn.execute("SELECT * FROM totals ORDER BY operation, status").fetchall()
+    counters = [
+        ('videotool_jobs_total', 'jobs', "任务数"),
+        ('videotool_job_wall_seconds_total', 'wall_sec', "累计耗时"),
+        ('videotool_job_cpu_seconds_total', 'cpu_sec', "ffmpeg子进程累计CPU时间"),
+        ('videotool_job_input_bytes_total', 'input_bytes', "累计输入字节"),
+        ('videotool_job_output_bytes_total', 'output_bytes', "累计输出字节"),
+        ('videotool_result_cache_hits_total', 'result_cache_hits', "结果缓存命中次数"),
+        ('videotool_media_cache_hits_total', 'media_cache_hits', "媒体信息缓存命中次数"),
+        ('videotool_media_cache_misses_total', 'media_cache_misses', "媒体信息缓存未命中次数"),
+    ]
+    for name, column, help_text in counters:
+        metric(name, 'counter', help_text,
+               [({'operation': r['operation'], 'status': r['status']}, round(r[column], 4)) for r in totals])
+
+    operations = sorted({r['operation'] for r in totals})
+    observed = {(r['operation'], r['metric']): r for r in conn.execute("SELECT * FROM observations")}
+    rows = {op: recent_rows(conn, op) for op in operations}
+    for name, column, help_text in SUMMARIES:
+        samples = []
+        for op in operations:
+            values = [throughput(r) if column is None else r[column] for r in rows[op]]
+            for q in QUANTILES:
+                value = percentile(values, q)
+                if value is not None:
+                    samples.append(({'operation': op, 'quantile': q}, round(value, 4)))
+        metric(name, 'summary', help_text, samples)
+        for op in operations:
+            row = observed.get((op, name))
+            lines.append(f'{name}_sum{{operation="{op}"}} {round(row["total"], 4) if row else 0}')
+            lines.append(f'{name}_count{{operation="{op}"}} {row["count"] if row else 0}')
+
+    PROM_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = PROM_PATH.with_name(PROM_PATH.name + f".{os.getpid()}.tmp")
+    tmp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    os.replace(tmp_path, PROM_PATH)
+
+# ==================== 查询 ====================
+def operation_summary(since=None):
+    """按操作汇总：任务数、成功率、缓存命中率，以及速度/吞吐量/耗时的分位数"""
+    if not DB_PATH.exists():
+        return []
+    conn = connect()
+    try:
+        query = ("SELECT operation, COUNT(*) AS jobs, SUM(status = 'ok') AS ok, "
+                 "SUM(result_cache_hit) AS cache_hits, AVG(cpu_sec) AS cpu_sec, "
+                 "SUM(media_cache_hits) AS media_hits, SUM(media_cache_misses) AS media_misses "
+                 "FROM metrics")
+        args = []
+        if since is not None:
+            query += " WHERE finished_at >= ?"
+            args.append(since)
+        query += " GROUP BY operation ORDER BY operation"
+
+        summary = []
+        for group in conn.execute(query, args).fetchall():
+            rows = recent_rows(conn, group['operation'], since)
+            speeds = [r['speed'] for r in rows]
+            mbps = [throughput(r) for r in rows]
+            walls = [r['wall_sec'] for r in rows]
+            lookups = (group['media_hits'] or 0) + (group['media_misses'] or 0)
+            entry = {
+                'operation': group['operation'],
+                'jobs': group['jobs'],
+                'success_rate': round(group['ok'] / group['jobs'], 3),
+                'result_cache_hit_rate': round(group['cache_hits'] / group['jobs'], 3),
+                'media_cache_hit_rate': round(group['media_hits'] / lookups, 3) if lookups else None,
+                'avg_cpu_sec': round(group['cpu_sec'], 2) if group['cpu_sec'] is not None else None,
+            }
+            for q in QUANTILES:
+                tag = f"p{int(q * 100)}"
+                for key, values in (('speed', speeds), ('mbps', mbps), ('wall_sec', walls)):
+                    value = percentile(values, q)
+                    entry[f"{key}_{tag}"] = round(value, 2) if value is not None else None
+            summary.append(entry)
+        return summary
+    finally:
+        conn.close()
+
+def recent_records(limit=50, since=None):
+    if not DB_PATH.exists():
+        return []
+    conn = connect()
+    try:
+        query = "SELECT * FROM metrics"
+        args = []
+        if since is not None:
+            query += " WHERE finished_at >= ?"
+            args.append(since)
+        query += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        return [dict(r) for r in conn.execute(query, args).fetchall()]
+    finally:
+        conn.close()
@@ -0,0 +1,255 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from core.cache import result_cache
+from core.jobs import job_queue
+from core.jobs.cost_model import estimate
+from core.jobs.worker import WorkerService, default_limits
+from core.fix.detect import REMUX_FIXABLE, run_detection
+from core.telemetry import job_metrics
+
+OWNER = "watch-folder"  # 任务队列中的提交者标识
+INPUT_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.flv', '.avi', '.webm', '.ts', '.m4v'}
+PARTIAL_MARKER = ".partial"
+
+# 处理流程 -> (任务类型, 输出文件后缀)
+PIPELINES = {
+    'remux': ('convert', "_remux.mp4"),
+    'convert': ('convert', "_PR.mp4"),
+    'extract': ('extract', ".mp3"),
+    'fix': ('fix', "_fixed.mp4"),
+}
+
+# ==================== 写入完成检测 ====================
+class StabilityTracker:
+    """轮询文件大小与mtime，在 settle 秒内两次观察都不变才视为写入完成
+
+    只看mtime不够：cp -p / rsync 会保留源文件的旧mtime，所以必须观察到大小停止增长。
+    """
+
+    def __init__(self, settle):
+        self.settle = settle
+        self._seen = {}  # 路径 -> (大小, mtime_ns, 首次观察到该状态的时间)
+
+    def update(self, paths, now=None):
+        """传入本轮扫描到的文件，返回已稳定的文件"""
+        now = time.monotonic() if now is None else now
+        stable, current = [], {}
+        for path in paths:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # 扫描后被删除或改名
+            state = (stat.st_size, stat.st_mtime_ns)
+            previous = self._seen.get(path)
+            since = previous[2] if previous and previous[:2] == state else now
+            current[path] = state + (since,)
+            if stat.st_size > 0 and now - since >= self.settle:
+                stable.append(path)
+        self._seen = current  # 已消失的文件不再跟踪
+        return stable
+
+# ==================== 监视目录 ====================
+class WatchFolder:
+    """监视目录中写入完成的录制文件，按配置的流程提交到任务队列
+
+    直接读取原文件，不经过上传暂存；输出先写到目标目录中的隐藏临时文件，
+    任务完成后再 os.replace 为正式文件名，其他程序不会读到写了一半的输出。
+    """
+
+    def __init__(self, watch_dir, pipeline, output_dir=None, settle=5.0, recursive=False, options=None):
+        self.watch_dir = Path(watch_dir)
+        self.pipeline = pipeline
+        self.kind, self.suffix = PIPELINES[pipeline]
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.recursive = recursive
+        self.options = options or {}
+        self.tracker = StabilityTracker(settle)
+        self.pending = {}   # 任务ID -> (输入, 临时输出, 正式输出)
+        self.handled = {}   # 输入 -> (大小, mtime_ns)，本次运行中已处理或判定无需处理
+        self.stats = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    # ---------- 路径 ----------
+    def output_path(self, input_path):
+        target_dir = self.output_dir or input_path.parent
+        if self.output_dir and self.recursive:
+            target_dir = self.output_dir / input_path.parent.relative_to(self.watch_dir)
+        return target_dir / (input_path.stem + self.suffix)
+
+    def partial_path(self, final_path):
+        """与正式输出同目录（保证 os.replace 原子），隐藏且保留扩展名供ffmpeg识别格式"""
+        return final_path.with_name(f".{final_path.stem}{PARTIAL_MARKER}{final_path.suffix}")
+
+    def is_candidate(self, path):
+        """跳过隐藏文件、临时输出以及各流程自己产生的输出"""
+        name = path.name
+        if name.startswith('.') or PARTIAL_MARKER in name or path.suffix.lower() not in INPUT_EXTENSIONS:
+            return False
+        return not any(name.endswith(suffix) for _, suffix in PIPELINES.values())
+
+    def is_up_to_date(self, input_path):
+        final_path = self.output_path(input_path)
+        try:
+            return final_path.stat().st_mtime >= input_path.stat().st_mtime
+        except OSError:
+            return False
+
+    def scan(self):
+        pattern = self.watch_dir.rglob('*') if self.recursive else self.watch_dir.glob('*')
+        return [p for p in pattern if p.is_file() and self.is_candidate(p)]
+
+    # ---------- 提交 ----------
+    def build_params(self, input_path, output_path):
+        """按流程构建任务参数；fix 流程在结构扫描无可修复问题时返回 None
+
+        输出在共享目录中可能被用户原地改写，shared_output 让结果缓存复制产物而不是硬链接。
+        """
+        params = {'input_path': str(input_path), 'output_path': str(output_path), 'shared_output': True}
+        if self.kind == 'convert':
+            params['config'] = {
+                'pr_compat_mode': self.pipeline == 'convert',
+                'audio_bitrate': self.options.get('audio_bitrate', '320k'),
+                'preset': self.options.get('preset', 'medium'),
+                'force_audio': False,
+                'hw_encode': self.options.get('hw_encode', False),
+            }
+        elif self.kind == 'extract':
+            params['bitrate'] = self.options.get('bitrate', '320k')
+        else:
+            errors, _ = run_detection(input_path)
+            if not any(error['type'] in REMUX_FIXABLE for error in errors):
+                return None
+            params.update({'fix_type': 'moov', 'error_count': len(errors), 'deep_scan': False})
+        return params
+
+    def submit(self, input_path):
+        stat = input_path.stat()
+        self.handled[input_path] = (stat.st_size, stat.st_mtime_ns)
+        final_path = self.output_path(input_path)
+        partial = self.partial_path(final_path)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+
+        params = self.build_params(input_path, partial)
+        if params is None:
+            self.stats['skipped'] += 1
+            print(f"[跳过] {input_path.name}：未发现可修复的问题")
+            return None
+
+        label = f"{self.pipeline} {input_path.name}"
+        cached = result_cache.lookup(self.kind, params)
+        if cached is not None:
+            job_metrics.record_cache_hit(self.kind, params['input_path'], cached['output_path'])
+            job_queue.record_done(self.kind, params, OWNER, label, cached)
+            self.publish(input_path, partial, final_path, "⚡ 缓存命中")
+            return None
+
+        cost = estimate(self.kind, params)
+        job_id = job_queue.enqueue(self.kind, params, OWNER, label, cost=cost['seconds'], profile=cost['profile'])
+        self.pending[job_id] = (input_path, partial, final_path)
+        print(f"[提交] {input_path.name} -> {final_path}")
+        return job_id
+
+    def publish(self, input_path, partial, final_path, note=""):
+        os.replace(partial, final_path)
+        os.utime(final_path)  # 保证输出mtime不早于输入，重启后不会重复处理
+        self.stats['done'] += 1
+        print(f"[完成] {input_path.name} -> {final_path.name} {note}".rstrip())
+
+    # ---------- 收尾 ----------
+    def cancel_pending(self):
+        """停止监视时取消尚未完成的任务，并清理临时输出"""
+        for job_id, (_, partial, _) in self.pending.items():
+            job_queue.request_cancel(job_id)
+            partial.unlink(missing_ok=True)
+        self.pending.clear()
+
+    def collect_finished(self):
+        for job_id, (input_path, partial, final_path) in list(self.pending.items()):
+            job = job_queue.get_job(job_id)
+            if job is None or job['status'] in job_queue.ACTIVE_STATES:
+                continue
+            del self.pending[job_id]
+            if job['status'] == job_queue.DONE and partial.exists():
+                self.publish(input_path, partial, final_path, job['result'].get('summary', ''))
+            else:
+                partial.unlink(missing_ok=True)
+                self.stats['failed'] += 1
+                print(f"[失败] {input_path.name}：{job['error'] or job['status']}")
+
+    def poll_once(self):
+        """扫描一轮：提交新稳定的文件，发布已完成的任务"""
+        for path in self.tracker.update(self.scan()):
+            try:
+                stat = path.stat()
+                if self.handled.get(path) == (stat.st_size, stat.st_mtime_ns) or self.is_up_to_date(path):
+                    continue
+                self.submit(path)
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"[失败] {path.name}：{e}")
+        self.collect_finished()
+
+    def run(self, interval=2.0, stop=None, once=False):
+        """持续监视；once=True 时处理完当前已写完的文件后返回"""
+        stop = stop or threading.Event()
+        if once:
+            self.poll_once()
+            stop.wait(self.tracker.settle)  # 至少观察两次，确认大小不再变化
+        while not stop.is_set():
+            self.poll_once()
+            if once and not self.pending:
+                break
+            stop.wait(interval)
+        return self.stats
+
+# ==================== 命令行入口 ====================
+def main():
+    parser = argparse.ArgumentParser(description="监视目录，自动处理写入完成的录制文件")
+    parser.add_argument("watch_dir", help="要监视的目录（如共享盘上的录制目录）")
+    parser.add_argument("--pipeline", choices=list(PIPELINES), default="remux",
+                        help="remux: 快速封装 / convert: PR兼容转换 / extract: 提取MP3 / fix: 修复moov")
+    parser.add_argument("-o", "--output-dir", help="输出目录（默认与输入文件同目录）")
+    parser.add_argument("--recursive", action="store_true", help="包含子目录")
+    parser.add_argument("--settle", type=float, default=5.0, help="大小与mtime保持不变多少秒后视为写入完成")
+    parser.add_argument("--interval", type=float, default=2.0, help="扫描间隔(秒)")
+    parser.add_argument("--once", action="store_true", help="处理当前已有文件后退出")
+    parser.add_argument("--workers", type=int, help="同时运行的任务总数上限")
+    parser.add_argument("--no-worker", action="store_true", help="只提交任务，由单独运行的 worker.py 执行")
+    parser.add_argument("--bitrate", default="320k", help="extract 流程的MP3比特率")
+    parser.add_argument("--preset", default="medium", help="convert 流程的libx264编码预设")
+    parser.add_argument("--audio-bitrate", default="320k", help="convert 流程的音频比特率")
+    parser.add_argument("--hw-encode", action="store_true", help="convert 流程优先使用硬件H.264编码器")
+    args = parser.parse_args()
+
+    if not Path(args.watch_dir).is_dir():
+        print(f"错误：目录不存在 - {args.watch_dir}")
+        return 1
+
+    watcher = WatchFolder(
+        args.watch_dir, args.pipeline, args.output_dir, settle=args.settle, recursive=args.recursive,
+        options={'bitrate': args.bitrate, 'preset': args.preset,
+                 'audio_bitrate': args.audio_bitrate, 'hw_encode': args.hw_encode},
+    )
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    service = None if args.no_worker else WorkerService(max_workers=args.workers, limits=default_limits()).start()
+    print(f"正在监视 {args.watch_dir}（流程: {args.pipeline}），按 Ctrl+C 停止")
+    try:
+        stats = watcher.run(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        stats = watcher.stats
+        print("正在停止，未完成的任务已取消，下次启动时重新处理")
+        watcher.cancel_pending()
+    finally:
+        if service:
+            service.stop(wait=False)
+    print(f"完成 {stats['done']} 个，失败 {stats['failed']} 个，跳过 {stats['skipped']} 个")
+    return 0 if stats['failed'] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
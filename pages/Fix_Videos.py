@@ -1,9 +1,14 @@
 import streamlit as st
-import subprocess
-from pathlib import Path
-import tempfile
 import time
 
+from core.staging.upload_staging import stage_upload, new_output_path
+from core.fix.detect import REMUX_FIXABLE, REBUILD_FIXABLE, TIMESTAMP_FIXABLE, run_detection
+from core.fix.slice_scan import DEFAULT_MAX_ERRORS, affected_ranges
+from core.fix.timestamp_analyzer import merge_repairs
+from core.jobs.job_panel import submit_job, job_panel
+from core.telemetry import job_metrics
+from core.preview.media_preview import preview_panel
+
 st.set_page_config(
     page_title="Video Fixer",
     page_icon="🔧",
@@ -18,46 +23,15 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-ERROR_MAPPING = {
-    "moov atom not found": {
-        "description": "视频元数据损坏（moov原子缺失）",
-        "solution": "使用快速启动模式重新封装视频"
-    },
-    "invalid data": {
-        "description": "无效的视频数据",
-        "solution": "尝试重新编码视频流"
-    },
-    "corrupt": {
-        "description": "文件损坏",
-        "solution": "尝试修复容器格式"
-    }
-}
-
-def detect_errors(input_path):
-    """使用ffmpeg检测视频错误"""
-    cmd = [
-        "ffmpeg",
-        "-v", "error",
-        "-i", str(input_path),
-        "-f", "null",
-        "-"
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return result.stderr.splitlines()
-
-def fix_moov(input_path, output_path):
-    """修复moov原子缺失问题"""
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", str(input_path),
-        "-c", "copy",
-        "-movflags", "faststart",
-        str(output_path)
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(result.stderr)
+def format_location(error):
+    """错误位置：时间戳与字节偏移，没有位置信息时返回空字符串"""
+    parts = []
+    if error.get('time') is not None:
+        minutes, seconds = divmod(error['time'], 60)
+        parts.append(f"⏱️ {int(minutes // 60):02d}:{int(minutes % 60):02d}:{seconds:06.3f}")
+    if error.get('offset') is not None:
+        parts.append(f"字节偏移 {error['offset']:#x}")
+    return " · ".join(parts)
 
 def main():
     st.title("Fix Videos ⚙️")
@@ -95,40 +69,50 @@ def main():
             st.markdown(f'<div class="uploadedFile">{file_info}</div>', unsafe_allow_html=True)
             st.markdown("  ")
         
+        with st.expander("🎥 视频预览"):
+            preview_panel(uploaded_file, auto=False)
+        
+        deep_scan = st.checkbox(
+            "🔬 深度扫描",
+            value=False,
+            help="按关键帧切片并发完整解码每一帧，定位数据错误的时间与位置；默认只扫描容器结构"
+        )
+        timestamps = st.checkbox(
+            "⏱️ 时间戳分析",
+            value=False,
+            help="读取全部数据包的时间戳，检查可变帧率、断层、重复/倒退的时间戳、音视频不同步与码率突增"
+        )
+        max_errors = DEFAULT_MAX_ERRORS
+        if deep_scan:
+            max_errors = st.number_input(
+                "发现多少个错误后停止", min_value=1, max_value=10000, value=DEFAULT_MAX_ERRORS,
+                help="严重损坏的文件不必解码到结尾，达到数量后立即停止"
+            )
+        
         # 检测按钮
         if st.button("🔍 开始检测", use_container_width=True):
             with st.spinner("正在分析视频文件..."):
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    try:
-                        # 保存临时文件
-                        input_path = Path(tmp_dir) / uploaded_file.name
-                        input_path.write_bytes(uploaded_file.getbuffer())
-                        
-                        # 执行检测
-                        raw_errors = detect_errors(input_path)
-                        processed_errors = []
-                        
-                        # 错误分类处理
-                        for err in raw_errors:
-                            for key in ERROR_MAPPING:
-                                if key in err.lower():
-                                    processed_errors.append({
-                                        "error": err.strip(),
-                                        "type": key,
-                                        "info": ERROR_MAPPING[key]
-                                    })
-                                    break
-                            else:
-                                processed_errors.append({
-                                    "error": err.strip(),
-                                    "type": "unknown",
-                                    "info": {"description": "未知错误", "solution": "建议重新录制或获取源文件"}
-                                })
-                        
-                        st.session_state.detected_errors = processed_errors
-                        
-                    except Exception as e:
-                        st.error(f"检测失败: {str(e)}")
+                try:
+                    # 上传文件只落盘一次，检测与修复共用
+                    input_path = stage_upload(uploaded_file)
+                    progress_bar = st.progress(0.0, text="分析中...") if deep_scan or timestamps else None
+                    
+                    # 执行检测
+                    with job_metrics.collect('detect_deep' if deep_scan else 'detect', str(input_path)):
+                        processed_errors, is_isobmff = run_detection(
+                            input_path, deep_scan, max_errors,
+                            on_progress=lambda p: progress_bar.progress(p, text=f"分析中... {p:.0%}"),
+                            timestamps=timestamps
+                        )
+                    if progress_bar:
+                        progress_bar.empty()
+                    if not is_isobmff and not deep_scan and not timestamps:
+                        st.info("ℹ️ 非MP4/MOV容器，结构扫描不适用，可开启深度扫描或时间戳分析")
+                    
+                    st.session_state.detected_errors = processed_errors
+                    
+                except Exception as e:
+                    st.error(f"检测失败: {str(e)}")
         
         # 显示检测结果
         if st.session_state.detected_errors:
@@ -136,10 +120,11 @@ def main():
             st.subheader("📝 检测报告")
             
             for idx, error in enumerate(st.session_state.detected_errors, 1):
+                location = format_location(error)
                 with st.container():
                     st.markdown(f"""
                     <div class="error-box">
-                        <b>错误 #{idx}</b><br>
+                        <b>错误 #{idx}</b>{f" · {location}" if location else ""}<br>
                         🚨 类型: {error['info']['description']}<br>
                         📋 详情: {error['error']}<br>
                         💡 建议解决方案: {error['info']['solution']}
@@ -148,43 +133,94 @@ def main():
             
             # 修复按钮
             if st.button("⚡ 一键修复", type="primary", use_container_width=True):
-                with st.spinner("正在施展魔法修复..."):
-                    with tempfile.TemporaryDirectory() as tmp_dir:
-                        try:
-                            input_path = Path(tmp_dir) / uploaded_file.name
-                            input_path.write_bytes(uploaded_file.getbuffer())
-                            
-                            output_path = input_path.with_name(f"fixed_{input_path.name}")
-                            
-                            # 根据错误类型执行修复
-                            for error in st.session_state.detected_errors:
-                                if error['type'] == "moov atom not found":
-                                    fix_moov(input_path, output_path)
-                                    break  # 暂时只处理moov错误
-                            
-                            # 验证修复结果
-                            verify_errors = detect_errors(output_path)
-                            if len(verify_errors) < len(st.session_state.detected_errors):
-                                st.success("🎉 修复成功！")
-                                st.balloons()
-                                
-                                # 生成下载按钮
-                                fixed_data = output_path.read_bytes()
-                                st.download_button(
-                                    label="⬇️ 下载修复后的视频",
-                                    data=fixed_data,
-                                    file_name=output_path.name,
-                                    mime="video/mp4",
-                                    use_container_width=True
-                                )
-                            else:
-                                st.warning("⚠️ 部分问题未能完全修复")
-                            
-                        except Exception as e:
-                            st.error(f"修复失败: {str(e)}")
+                if any(error['type'] in REMUX_FIXABLE for error in st.session_state.detected_errors):
+                    # 提交到任务队列，由worker修复并验证
+                    input_path = stage_upload(uploaded_file)
+                    submit_job(
+                        'fix',
+                        {
+                            'input_path': str(input_path),
+                            'output_path': str(new_output_path(input_path, f"fixed_{input_path.name}")),
+                            'fix_type': 'moov',
+                            'error_count': len(st.session_state.detected_errors),
+                            'deep_scan': deep_scan,
+                            'timestamps': timestamps
+                        },
+                        label=f"修复 {uploaded_file.name}"
+                    )
+                else:
+                    st.warning("⚠️ 暂不支持自动修复检测到的问题")
+
+            # 深度扫描定位到的受损片段：只重新编码这些片段，其余部分无损复制
+            ranges = affected_ranges(st.session_state.detected_errors)
+            if ranges:
+                damaged = sum(end - start for start, end in ranges)
+                if st.button(f"🎯 仅重新编码受损片段（{len(ranges)} 段，共 {damaged:.1f} 秒）", use_container_width=True):
+                    input_path = stage_upload(uploaded_file)
+                    submit_job(
+                        'fix',
+                        {
+                            'input_path': str(input_path),
+                            'output_path': str(new_output_path(input_path, f"fixed_{input_path.stem}.mp4")),
+                            'fix_type': 'ranges',
+                            'ranges': ranges,
+                            'error_count': len(st.session_state.detected_errors),
+                            'deep_scan': True,
+                            'timestamps': timestamps
+                        },
+                        label=f"局部修复 {uploaded_file.name}"
+                    )
+
+            # 时间戳问题：只重新处理有问题的流（恒定帧率/限制码率重新编码视频，对齐重新编码音频）
+            timestamp_issues = [e for e in st.session_state.detected_errors if e['type'] in TIMESTAMP_FIXABLE]
+            if timestamp_issues:
+                if st.button(f"⏱️ 修复时间戳与帧率问题（{len(timestamp_issues)} 项）", use_container_width=True):
+                    input_path = stage_upload(uploaded_file)
+                    submit_job(
+                        'fix',
+                        {
+                            'input_path': str(input_path),
+                            'output_path': str(new_output_path(input_path, f"fixed_{input_path.stem}.mp4")),
+                            'fix_type': 'timestamps',
+                            'repair': merge_repairs(timestamp_issues),
+                            'error_count': len(st.session_state.detected_errors),
+                            'deep_scan': deep_scan,
+                            'timestamps': True
+                        },
+                        label=f"时间戳修复 {uploaded_file.name}"
+                    )
+
+            # 录制中断：用同设备录制的正常文件作为参考重建moov
+            if any(error['type'] in REBUILD_FIXABLE for error in st.session_state.detected_errors):
+                st.markdown("  ")
+                reference_file = st.file_uploader(
+                    "上传参考文件",
+                    type=["mp4", "mov"],
+                    key="reference_file",
+                    help="同一设备、相同录制设置下的正常视频，用于学习编码配置和数据布局（支持H.264/HEVC）"
+                )
+                video_only = st.checkbox(
+                    "只恢复视频", False, key="rebuild_video_only",
+                    help="不恢复音频；AAC音频按参考文件的帧特征切分并经解码校验，校验未通过时会自动只保留视频"
+                )
+                if reference_file and st.button("🧩 用参考文件重建moov", use_container_width=True):
+                    input_path = stage_upload(uploaded_file)
+                    submit_job(
+                        'rebuild',
+                        {
+                            'input_path': str(input_path),
+                            'reference_path': str(stage_upload(reference_file)),
+                            'output_path': str(new_output_path(input_path, f"rebuilt_{input_path.stem}.mp4")),
+                            'video_only': video_only,
+                        },
+                        label=f"重建 {uploaded_file.name}"
+                    )
                             
         else:
             st.info("🤔 未检测到错误，无需修复~")
 
+    # 任务状态与下载
+    job_panel(['fix', 'rebuild'])
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,19 @@
 import streamlit as st
-import subprocess
 import platform
 from pathlib import Path
-import tempfile
 import time
+import json
+
+from core.cache.media_cache import media_cache
+from core.process.async_runner import run
+from core.staging.upload_staging import stage_upload, new_output_path, session_workspace
+from core.jobs.job_panel import submit_job, job_panel, record_result
+from core.extract.mp3_extract import stream_extract
+from core.telemetry import job_metrics
+from core.extract.multi_output import plan_outputs
+from core.fix.atom_scanner import stream_readable
+from core.preview.media_preview import preview_panel
+from core.extract.audio_analysis import waveform_panel
 
 # 页面配置
 st.set_page_config(
@@ -12,6 +22,102 @@ st.set_page_config(
     layout="centered",
 )
 
+def probe_audio_streams(input_path):
+    """使用ffprobe获取音频流信息（经内容哈希缓存）"""
+    cmd = [
+        "ffprobe",
+        "-v", "quiet",
+        "-print_format", "json",
+        "-select_streams", "a",
+        "-show_streams",
+        str(input_path)
+    ]
+
+    def probe():
+        return json.loads(run(cmd).stdout).get('streams', [])
+
+    return media_cache.get_or_compute(input_path, cmd[:-1], probe)
+
+def extract_streaming(uploaded_file, bitrate, audio_filter=None):
+    """上传数据直接经管道送入ffmpeg，MP3边产生边写入下载文件，不落临时文件
+
+    在页面内完成（并发仍受编码类进程上限约束），第一块MP3在ffmpeg读到开头的数据后即写出；
+    完成后记录到任务列表统一提供下载。页面重跑或停止时终止ffmpeg并删除写了一半的输出。
+    """
+    file_name = Path(uploaded_file.name).with_suffix(".mp3").name
+    output_path = new_output_path(session_workspace() / uploaded_file.file_id / uploaded_file.name, file_name)
+    total = max(uploaded_file.size, 1)
+    progress_bar = st.progress(0.0, text="流式提取中...")
+    last_render = 0.0
+
+    def on_progress(fed, written):
+        nonlocal last_render
+        now = time.monotonic()
+        if now - last_render >= 0.5:
+            last_render = now
+            progress_bar.progress(
+                min(fed / total, 1.0),
+                text=f"已读取 {fed/1024/1024:.1f} / {total/1024/1024:.1f} MB · 已输出 {written/1024/1024:.2f} MB"
+            )
+
+    start = time.monotonic()
+    try:
+        with job_metrics.collect('extract_stream') as metrics, open(output_path, 'wb') as sink:
+            metrics.input_bytes = uploaded_file.size
+            written = stream_extract(uploaded_file.getbuffer(), sink, bitrate, on_progress, audio_filter)
+            metrics.output_bytes = written
+    except BaseException:
+        output_path.unlink(missing_ok=True)
+        raise
+    finally:
+        progress_bar.empty()
+
+    params = {'input_path': uploaded_file.name, 'output_path': str(output_path), 'bitrate': bitrate, 'streamed': True}
+    if audio_filter:
+        params['audio_filter'] = audio_filter
+    record_result(
+        'extract_stream',
+        params,
+        label=f"{uploaded_file.name} → MP3 {bitrate}（流式{'，裁剪静音' if audio_filter else ''}）",
+        result={
+            'output_path': str(output_path),
+            'mime': 'audio/mpeg',
+            'summary': f"✅ Done！文件大小: {written/1024/1024:.2f} MB，耗时 {time.monotonic() - start:.1f}s",
+        }
+    )
+
+def submit_staged(uploaded_file, bitrates, export_mp4, audio_filter=None):
+    """上传文件落盘后提交到任务队列"""
+    # 上传文件只落盘一次，重复提取时复用
+    input_path = stage_upload(uploaded_file)
+
+    # 没有音频流时提前失败，避免启动ffmpeg
+    if not probe_audio_streams(input_path):
+        raise RuntimeError("文件中未找到音频流")
+
+    # 提交到任务队列，由worker执行；页面重跑或刷新不会中断提取
+    if len(bitrates) == 1 and not export_mp4:
+        output_path = new_output_path(input_path, input_path.with_suffix(".mp3").name)
+        params = {'input_path': str(input_path), 'output_path': str(output_path), 'bitrate': bitrates[0]}
+        if audio_filter:
+            params['audio_filter'] = audio_filter
+        submit_job(
+            'extract',
+            params,
+            label=f"{uploaded_file.name} → MP3 {bitrates[0]}{'（裁剪静音）' if audio_filter else ''}"
+        )
+    else:
+        # 多个输出共用一次解码
+        output_dir = new_output_path(input_path, input_path.name).parent
+        outputs = plan_outputs(output_dir, input_path.stem, bitrates,
+                               {'pr_compat_mode': False} if export_mp4 else None, audio_filter)
+        targets = [f"MP3 {b}" for b in bitrates] + (["MP4"] if export_mp4 else [])
+        submit_job(
+            'multi',
+            {'input_path': str(input_path), 'outputs': outputs},
+            label=f"{uploaded_file.name} → {' + '.join(targets)}"
+        )
+
 # 自定义样式
 st.markdown("""
 <style>
@@ -36,11 +142,16 @@ def main():
     # 参数设置侧边栏
     with st.sidebar:
         st.header("⚙️ 转换参数")
-        bitrate = st.selectbox(
+        bitrates = st.multiselect(
             "音频比特率",
-            ("320k", "256k", "192k"),
-            index=0,
-            help="更高的比特率意味着更好的音质和更大的文件大小"
+            ["320k", "256k", "192k"],
+            default=["320k"],
+            help="更高的比特率意味着更好的音质和更大的文件大小；选择多个时只解码一次同时输出"
+        )
+        export_mp4 = st.checkbox("同时导出MP4（无损封装）", False, help="与MP3在同一次ffmpeg调用中完成")
+        streaming = st.checkbox(
+            "流式提取", True,
+            help="单个MP3时上传数据直接经管道送入ffmpeg，边提取边写出，不写临时文件；moov在文件末尾的MP4会自动改用普通提取"
         )
         st.markdown("  ")
         st.info("""
@@ -54,7 +165,8 @@ def main():
     if uploaded_file:
         # 文件预览区域
         with st.expander("🎥 视频预览", expanded=True):
-            st.video(uploaded_file)
+            # 按需生成缩略图与代理片段，不把整个上传文件推送到浏览器
+            preview_panel(uploaded_file, auto=False)
             file_info = f"""📄 文件名称: <span class="ellipsis" title="{uploaded_file.name}">{uploaded_file.name}</span><br/>
                         📏 文件大小: {uploaded_file.size/1024/1024:.2f} MB<br/>
                         🕒 上传时间: {time.strftime("%Y-%m-%d %H:%M:%S")}
@@ -62,56 +174,27 @@ def main():
             st.markdown(f'<div class="uploadedFile">{file_info}</div>', unsafe_allow_html=True)
             st.markdown("  ")
 
+        # 低采样率PCM流式分析：波形、响度与静音段，可在提取的同一次编码中裁掉静音
+        with st.expander("📈 音频波形", expanded=True):
+            audio_filter = waveform_panel(uploaded_file)
+
         # 转换按钮
         if st.button("🚀 开始提取", use_container_width=True):
-            with st.spinner("⏳ 正在提取，请稍候..."):
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    try:
-                        # 保存上传文件
-                        input_path = Path(tmp_dir) / uploaded_file.name
-                        input_path.write_bytes(uploaded_file.getbuffer())
-
-                        # 生成输出路径
-                        output_path = input_path.with_suffix(".mp3")
-
-                        # 构建FFmpeg命令
-                        cmd = [
-                            "ffmpeg",
-                            "-y", "-v", "error",
-                            "-i", str(input_path),
-                            "-vn",  # 忽略视频流
-                            "-acodec", "libmp3lame",
-                            "-b:a", bitrate,
-                            "-q:a", "0",  # 最高质量
-                            "-threads", "0",  # 自动线程
-                            str(output_path)
-                        ]
-
-                        # 执行转换
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        if result.returncode != 0:
-                            raise RuntimeError(result.stderr)
-
-                        # 准备下载文件
-                        mp3_data = output_path.read_bytes()
-                        file_size = len(mp3_data) / 1024 / 1024
-
-                        # 显示结果
-                        st.success(f"✅ Done！文件大小: {file_size:.2f} MB")
-                        st.balloons()
-
-                        # 下载按钮
-                        st.download_button(
-                            label="⬇️ Download",
-                            data=mp3_data,
-                            file_name=output_path.name,
-                            mime="audio/mpeg",
-                            use_container_width=True,
-                            key="download-btn"
-                        )
-
-                    except Exception as e:
-                        st.error(f"❌ 提取失败:  {str(e)}")
+            try:
+                if not bitrates and not export_mp4:
+                    raise RuntimeError("请至少选择一个比特率或导出MP4")
+
+                # 管道模式：不写临时文件，直接在页面内完成；其余情况落盘后提交到任务队列
+                if (streaming and len(bitrates) == 1 and not export_mp4
+                        and stream_readable(uploaded_file.getbuffer())):
+                    extract_streaming(uploaded_file, bitrates[0], audio_filter)
+                else:
+                    submit_staged(uploaded_file, bitrates, export_mp4, audio_filter)
+            except Exception as e:
+                st.error(f"❌ 提取失败:  {str(e)}")
+
+    # 任务状态与下载
+    job_panel(['extract', 'extract_stream', 'multi'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,104 @@
+import streamlit as st
+import time
+
+from core.telemetry import job_metrics
+
+st.set_page_config(
+    page_title="Performance Metrics",
+    page_icon="📈",
+    layout="wide",
+)
+
+# 统计时间范围（秒），None 表示全部
+TIME_WINDOWS = {
+    "最近1小时": 3600,
+    "最近24小时": 24 * 3600,
+    "最近7天": 7 * 24 * 3600,
+    "全部": None,
+}
+
+OPERATION_LABELS = {
+    'convert': "视频转换",
+    'extract': "MP3提取",
+    'extract_stream': "MP3流式提取",
+    'multi': "多输出",
+    'detect': "结构检测",
+    'detect_deep': "深度检测",
+    'fix': "修复",
+    'rebuild': "moov重建",
+    'trim': "无损裁剪",
+    'split': "分割",
+}
+
+def main():
+    st.title("📈 Performance Metrics")
+    st.markdown("---")
+
+    with st.sidebar:
+        st.header("⚙️ 统计范围")
+        window = st.selectbox("时间范围", list(TIME_WINDOWS), index=1)
+        st.markdown("  ")
+        st.info(f"""
+        **导出文件：**
+        - JSONL: `{job_metrics.LOG_PATH}`
+        - Prometheus: `{job_metrics.PROM_PATH}`
+        """)
+
+    since = time.time() - TIME_WINDOWS[window] if TIME_WINDOWS[window] else None
+    summary = job_metrics.operation_summary(since)
+    if not summary:
+        st.info("暂无任务指标，完成一次转换、提取或修复后再来查看")
+        return
+
+    # 吞吐量分位数（只统计成功且未命中结果缓存的任务）
+    st.subheader("吞吐量分位数")
+    st.caption("速度为ffmpeg报告的倍实时速度；吞吐量按输入文件大小 / 耗时计算")
+    st.dataframe([
+        {
+            "操作": OPERATION_LABELS.get(s['operation'], s['operation']),
+            "任务数": s['jobs'],
+            "成功率": f"{s['success_rate']:.0%}",
+            "速度 p50": s['speed_p50'],
+            "速度 p90": s['speed_p90'],
+            "速度 p99": s['speed_p99'],
+            "MB/s p50": s['mbps_p50'],
+            "MB/s p90": s['mbps_p90'],
+            "MB/s p99": s['mbps_p99'],
+            "耗时p50(s)": s['wall_sec_p50'],
+            "耗时p90(s)": s['wall_sec_p90'],
+            "耗时p99(s)": s['wall_sec_p99'],
+        }
+        for s in summary
+    ], use_container_width=True, hide_index=True)
+
+    st.subheader("资源与缓存")
+    st.dataframe([
+        {
+            "操作": OPERATION_LABELS.get(s['operation'], s['operation']),
+            "平均CPU时间(s)": s['avg_cpu_sec'],
+            "结果缓存命中率": f"{s['result_cache_hit_rate']:.0%}",
+            "媒体信息缓存命中率": f"{s['media_cache_hit_rate']:.0%}" if s['media_cache_hit_rate'] is not None else "-",
+        }
+        for s in summary
+    ], use_container_width=True, hide_index=True)
+
+    st.subheader("最近任务")
+    st.dataframe([
+        {
+            "完成时间": time.strftime("%m-%d %H:%M:%S", time.localtime(r['finished_at'])),
+            "操作": OPERATION_LABELS.get(r['operation'], r['operation']),
+            "状态": r['status'],
+            "耗时(s)": r['wall_sec'],
+            "速度": r['speed'],
+            "fps": r['fps'],
+            "CPU(s)": r['cpu_sec'],
+            "峰值内存(MB)": round(r['peak_rss_kb'] / 1024, 1) if r['peak_rss_kb'] else None,
+            "输入(MB)": round(r['input_bytes'] / 1024 / 1024, 2) if r['input_bytes'] else None,
+            "输出(MB)": round(r['output_bytes'] / 1024 / 1024, 2) if r['output_bytes'] else None,
+            "缓存命中": "⚡" if r['result_cache_hit'] else "",
+        }
+        for r in job_metrics.recent_records(50, since)
+    ], use_container_width=True, hide_index=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 import streamlit as st  
+import importlib
 
 st.subheader("Videos Convert 🔄​")
-st.sidebar.markdown("# Videos Convert 🔄​")
\ No newline at end of file
+st.sidebar.markdown("# Videos Convert 🔄​")
+
+# flv-to-mp4.py 文件名带连字符，只能通过 importlib 加载
+importlib.import_module("core.convert.flv-to-mp4").main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 与命令行脚本相同：以仓库根目录为导入起点（import core.xxx）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,148 @@
+import struct
+
+import pytest
+
+from core.fix import faststart
+from core.fix.faststart import FaststartUnsupported, fix_moov, patch_chunk_offsets, relocate_moov
+
+# ==================== 构造 ISO-BMFF ====================
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def offsets_box(box_type, offsets):
+    typecode = '>I' if box_type == b'stco' else '>Q'
+    table = b''.join(struct.pack(typecode, value) for value in offsets)
+    return box(box_type, struct.pack('>I', 0) + struct.pack('>I', len(offsets)) + table)
+
+def moov_box(*tables):
+    """moov/trak/mdia/minf/stbl 逐层嵌套，每个表一个 trak"""
+    traks = [box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', table)))) for table in tables]
+    return box(b'moov', box(b'mvhd', bytes(100)) + b''.join(traks))
+
+def chunk_offsets(data):
+    """按文件顺序读出所有 stco/co64 的块偏移"""
+    result = []
+    for box_type, typecode, width in ((b'stco', '>I', 4), (b'co64', '>Q', 8)):
+        pos = data.find(box_type)
+        while pos != -1:
+            count, = struct.unpack_from('>I', data, pos + 8)
+            result += [struct.unpack_from(typecode, data, pos + 12 + i * width)[0] for i in range(count)]
+            pos = data.find(box_type, pos + 4)
+    return result
+
+FTYP = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+SAMPLES = [bytes([i]) * (100 + i) for i in range(1, 6)]
+
+def tail_moov_file(table_type=b'stco'):
+    """ftyp + mdat(5个块) + moov，返回 (文件内容, 各块内容)"""
+    mdat_body = b''.join(SAMPLES)
+    mdat_offset = len(FTYP)
+    offsets, pos = [], mdat_offset + 8
+    for sample in SAMPLES:
+        offsets.append(pos)
+        pos += len(sample)
+    return FTYP + box(b'mdat', mdat_body) + moov_box(offsets_box(table_type, offsets)), SAMPLES
+
+def top_level_types(data):
+    types, pos = [], 0
+    while pos < len(data):
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        types.append(box_type)
+        pos += size
+    return types
+
+# ==================== 重定位 ====================
+@pytest.mark.parametrize('table_type', [b'stco', b'co64'])
+def test_relocate_moves_moov_and_patches_offsets(tmp_path, table_type):
+    data, samples = tail_moov_file(table_type)
+    source, target = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    source.write_bytes(data)
+
+    assert relocate_moov(source, target) is True
+    out = target.read_bytes()
+    assert len(out) == len(data)
+    assert top_level_types(out) == [b'ftyp', b'moov', b'mdat']
+    # 修正后的偏移仍指向原来的块内容
+    for offset, sample in zip(chunk_offsets(out), samples):
+        assert out[offset:offset + len(sample)] == sample
+    assert source.read_bytes() == data  # 原文件保持不变
+
+def test_relocate_keeps_files_already_faststart(tmp_path):
+    data, _ = tail_moov_file()
+    mdat_end = len(FTYP) + 8 + sum(len(s) for s in SAMPLES)
+    source, target = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    source.write_bytes(FTYP + data[mdat_end:] + data[len(FTYP):mdat_end])
+
+    assert relocate_moov(source, target) is False
+    assert not target.exists()
+
+def test_multiple_tracks_are_patched(tmp_path):
+    mdat_body = b''.join(SAMPLES)
+    first = len(FTYP) + 8
+    video = offsets_box(b'stco', [first, first + len(SAMPLES[0])])
+    audio = offsets_box(b'co64', [first + len(SAMPLES[0]) + len(SAMPLES[1])])
+    source, target = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    source.write_bytes(FTYP + box(b'mdat', mdat_body) + moov_box(video, audio))
+
+    assert relocate_moov(source, target)
+    out = target.read_bytes()
+    offsets = chunk_offsets(out)
+    assert len(offsets) == 3
+    for offset, sample in zip(offsets, SAMPLES):
+        assert out[offset:offset + len(sample)] == sample
+
+@pytest.mark.parametrize('layout, message', [
+    (lambda: FTYP + box(b'mdat', b'x' * 16), "缺少 moov 或 mdat"),
+    (lambda: FTYP + box(b'moov', b'') + box(b'moof', b'') + box(b'mdat', b'x' * 16), "分片MP4"),
+    (lambda: FTYP + box(b'mdat', b'x' * 16) + box(b'moov', b'') + box(b'moov', b''), "多个 moov"),
+    (lambda: FTYP + struct.pack('>I4s', 4096, b'mdat') + b'x' * 16, "大小无效"),
+])
+def test_unsupported_layouts(tmp_path, layout, message):
+    source = tmp_path / "in.mp4"
+    source.write_bytes(layout())
+    with pytest.raises(FaststartUnsupported, match=message):
+        relocate_moov(source, tmp_path / "out.mp4")
+
+# ==================== 偏移修正 ====================
+def test_patch_only_shifts_offsets_inside_range():
+    moov = bytearray(moov_box(offsets_box(b'stco', [10, 100, 500])))
+    patch_chunk_offsets(moov, 8, len(moov), 50, 400, 1000)
+    assert chunk_offsets(bytes(moov)) == [10, 1100, 500]
+
+def test_stco_overflow_is_unsupported():
+    moov = bytearray(moov_box(offsets_box(b'stco', [0xFFFFFF00])))
+    with pytest.raises(FaststartUnsupported, match="32位块偏移溢出"):
+        patch_chunk_offsets(moov, 8, len(moov), 0, 0xFFFFFFFF, 0x1000)
+
+def test_co64_does_not_overflow_at_32_bits():
+    moov = bytearray(moov_box(offsets_box(b'co64', [0xFFFFFF00])))
+    patch_chunk_offsets(moov, 8, len(moov), 0, 0xFFFFFFFF, 0x1000)
+    assert chunk_offsets(bytes(moov)) == [0xFFFFFF00 + 0x1000]
+
+def test_truncated_offset_table_is_unsupported():
+    table = bytearray(offsets_box(b'stco', [10, 20]))
+    struct.pack_into('>I', table, 12, 1000)  # 条目数大于box实际容量
+    moov = bytearray(moov_box(bytes(table)))
+    with pytest.raises(FaststartUnsupported, match="条目数超出"):
+        patch_chunk_offsets(moov, 8, len(moov), 0, 100, 8)
+
+# ==================== 退回ffmpeg ====================
+def test_fix_moov_falls_back_to_ffmpeg(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(faststart, 'run', lambda cmd, kind=None: commands.append(cmd))
+    source = tmp_path / "in.mp4"
+    source.write_bytes(FTYP + box(b'mdat', b'x' * 16))  # 缺少moov，原生无法处理
+
+    fix_moov(source, tmp_path / "out.mp4")
+    assert len(commands) == 1 and commands[0][0] == "ffmpeg" and "faststart" in commands[0]
+
+def test_fix_moov_native_skips_ffmpeg(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(faststart, 'run', lambda cmd, kind=None: commands.append(cmd))
+    data, _ = tail_moov_file()
+    source = tmp_path / "in.mp4"
+    source.write_bytes(data)
+
+    fix_moov(source, tmp_path / "out.mp4")
+    assert commands == []
+    assert top_level_types((tmp_path / "out.mp4").read_bytes()) == [b'ftyp', b'moov', b'mdat']
@@ -0,0 +1,192 @@
+import random
+import struct
+from array import array
+from types import SimpleNamespace
+
+from core.fix.aac_frames import AacModel, frame_end_ok
+from core.fix.moov_rebuild import composition_box, verify_audio
+from core.fix.picture_order import AvcOrder, HevcOrder, frame_offsets
+
+# ==================== 构造码流 ====================
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, bits, value):
+        self.bits += [(value >> (bits - 1 - i)) & 1 for i in range(bits)]
+
+    def ue(self, value):
+        value += 1
+        self.u(value.bit_length() - 1, 0)
+        self.u(value.bit_length(), value)
+
+    def to_bytes(self):
+        bits = self.bits + [1]  # rbsp_stop_one_bit
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+def avc_sps(log2_max_poc_lsb=6):
+    w = BitWriter()
+    w.u(8, 100)
+    w.u(16, 40)
+    w.ue(0)
+    w.ue(1)          # chroma_format_idc
+    w.ue(0)
+    w.ue(0)
+    w.u(2, 0)        # qpprime_y_zero_transform_bypass、seq_scaling_matrix_present
+    w.ue(0)          # log2_max_frame_num_minus4
+    w.ue(0)          # pic_order_cnt_type
+    w.ue(log2_max_poc_lsb - 4)
+    w.ue(3)
+    w.u(1, 0)
+    w.ue(79)
+    w.ue(44)
+    w.u(1, 1)        # frame_mbs_only_flag
+    return b'\x67' + w.to_bytes()
+
+def avc_slice(poc_lsb, idr=False, reference=True, lsb_bits=6):
+    w = BitWriter()
+    w.ue(0)
+    w.ue(7 if idr else 5)
+    w.ue(0)
+    w.u(4, 0)
+    if idr:
+        w.ue(0)
+    w.u(lsb_bits, poc_lsb)
+    return bytes([0x65 if idr else (0x41 if reference else 0x01)]) + w.to_bytes() + b'\xaa' * 16
+
+def hevc_parameter_sets():
+    w = BitWriter()
+    w.u(4, 0)
+    w.u(3, 0)        # sps_max_sub_layers_minus1
+    w.u(1, 1)
+    w.u(96, 0)       # profile_tier_level
+    w.ue(0)
+    w.ue(1)
+    w.ue(1920)
+    w.ue(1080)
+    w.u(1, 0)
+    w.ue(0)
+    w.ue(0)
+    w.ue(4)          # log2_max_pic_order_cnt_lsb_minus4
+    sps = b'\x42\x01' + w.to_bytes()
+    w = BitWriter()
+    w.ue(0)
+    w.ue(0)
+    w.u(1, 0)
+    w.u(1, 1)        # output_flag_present_flag
+    w.u(3, 1)        # num_extra_slice_header_bits
+    return sps, b'\x44\x01' + w.to_bytes()
+
+def hevc_slice(nal_type, poc_lsb):
+    w = BitWriter()
+    w.u(1, 1)
+    if 16 <= nal_type <= 23:
+        w.u(1, 0)
+    w.ue(0)
+    w.u(1, 0)        # extra bit
+    w.ue(1)
+    w.u(1, 1)        # pic_output_flag
+    if nal_type not in (19, 20):
+        w.u(8, poc_lsb)
+    return bytes([nal_type << 1, 1]) + w.to_bytes() + b'\xaa' * 16
+
+# ==================== 显示顺序 ====================
+def test_avc_poc_gives_display_order():
+    order = AvcOrder(avc_sps())
+    # I0 P3 B1 B2 P6 B4 B5，然后新的IDR
+    frames = [avc_slice(0, idr=True), avc_slice(6), avc_slice(2, reference=False), avc_slice(4, reference=False),
+              avc_slice(12), avc_slice(8, reference=False), avc_slice(10, reference=False),
+              avc_slice(0, idr=True), avc_slice(4), avc_slice(2, reference=False)]
+    results = [order.picture(nal) for nal in frames]
+    assert [restart for restart, _ in results] == [True] + [False] * 6 + [True, False, False]
+
+    pocs = array('i', [poc for _, poc in results])
+    restarts = [i for i, (restart, _) in enumerate(results) if restart]
+    assert list(frame_offsets(pocs, restarts)) == [0, 2, -1, -1, 2, -1, -1, 0, 1, -1]
+
+def test_avc_poc_msb_wraps():
+    order = AvcOrder(avc_sps(log2_max_poc_lsb=4))
+    pocs = [order.picture(avc_slice(0, idr=True, lsb_bits=4))[1]]
+    pocs += [order.picture(avc_slice(poc % 16, lsb_bits=4))[1] for poc in range(2, 40, 2)]
+    assert pocs == list(range(0, 40, 2))
+
+def test_hevc_poc_with_extra_slice_header_bits():
+    sps, pps = hevc_parameter_sets()
+    order = HevcOrder(sps, [pps])
+    results = [order.picture(hevc_slice(nal_type, lsb))
+               for nal_type, lsb in ((19, 0), (1, 4), (1, 2), (0, 1), (0, 3), (1, 120), (1, 240), (1, 104), (20, 0))]
+    assert results == [(True, 0), (False, 4), (False, 2), (False, 1), (False, 3),
+                       (False, 120), (False, 240), (False, 360), (True, 0)]
+
+def test_composition_box_shifts_offsets_and_returns_delay():
+    index = {'pocs': array('i', [0, 4, 2, 6]), 'poc_restarts': array('I', [0])}
+    ctts, media_time = composition_box(index, 512)
+    count, = struct.unpack_from('>I', ctts, 12)
+    entries = struct.unpack_from(f'>{count * 2}I', ctts, 16)
+    assert entries == (1, 512, 1, 1024, 1, 0, 1, 512)  # 偏移 [0, 1, -1, 0] 帧，整体加1帧
+    assert media_time == 512
+
+    assert composition_box({'pocs': array('i', [0, 2, 4]), 'poc_restarts': array('I', [0])}, 512) == (None, 0)
+
+# ==================== AAC帧切分 ====================
+def aac_frame(rng, size):
+    """帧首为 CPE(0x21)，帧尾为 ID_END 加补零；中间不出现 0x21"""
+    body = bytes(b if b != 0x21 else 0x22 for b in rng.randbytes(size - 2))
+    return b'\x21' + bytes([body[0] & 0x7F]) + body[1:] + b'\xe0'
+
+def aac_chunks(seed, chunk_count):
+    """返回 (数据, 块偏移, 每块帧数, 各帧大小)"""
+    rng = random.Random(seed)
+    data, offsets, counts, sizes = bytearray(), [], [], []
+    for _ in range(chunk_count):
+        offsets.append(len(data))
+        counts.append(rng.randrange(3, 6))
+        for _ in range(counts[-1]):
+            sizes.append(rng.randrange(300, 420))
+            data += aac_frame(rng, sizes[-1])
+    return bytes(data), offsets, counts, sizes
+
+def aac_model():
+    data, offsets, counts, sizes = aac_chunks(1, 50)
+    return AacModel(data, offsets, counts, array('I', sizes), bytes([0x11, 0x90]))
+
+def test_frame_end_ok():
+    assert frame_end_ok(b'\x00\xe0', 2)
+    assert frame_end_ok(b'\x03\x80', 2)   # ID_END 跨字节
+    assert not frame_end_ok(b'\xe0\x00', 2)
+    assert not frame_end_ok(b'\x00\xa0', 2)
+
+def test_split_recovers_frame_sizes():
+    model = aac_model()
+    data, offsets, counts, sizes = aac_chunks(2, 20)
+    frame = 0
+    for offset, count, end in zip(offsets, counts, offsets[1:] + [len(data)]):
+        assert model.split(data, offset, end) == sizes[frame:frame + count]
+        frame += count
+
+def test_split_rejects_non_audio():
+    model = aac_model()
+    garbage = bytes(random.Random(3).randbytes(2000))
+    assert model.split(garbage, 0, len(garbage)) is None
+
+def test_verify_audio_retries_failed_chunks_with_alternatives():
+    model = aac_model()
+    rng = random.Random(4)
+    # 第二帧正中藏一个伪边界（前一字节符合帧尾模式，之后是帧首字节），按大小代价切成两帧更“像”
+    second = bytearray(aac_frame(rng, 600))
+    second[299:303] = b'\x07\x21\x05\x55'
+    data = aac_frame(rng, 350) + bytes(second) + aac_frame(rng, 380)
+    true_sizes = [350, 600, 380]
+    guessed = model.split(data, 0, len(data))
+    assert guessed == [350, 300, 300, 380]
+
+    def decode(mm, chunks):
+        return {i: 1 for i, (_, sizes) in enumerate(chunks) if list(sizes) != true_sizes}
+
+    model.verify = decode
+    index = {'audio_offsets': array('Q', [0]), 'audio_counts': array('I', [len(guessed)]),
+             'audio_sizes': array('I', guessed)}
+    assert verify_audio(data, SimpleNamespace(aac=model), index) == 0
+    assert list(index['audio_counts']) == [3]
+    assert list(index['audio_sizes']) == true_sizes